@@ -0,0 +1,235 @@
+# coding=utf-8
+""" Microbenchmark of the collectives used by the gradient synchronization strategies.
+
+Times gather + scatter through rank 0 (task2a), all_reduce (task2b), all_reduce of a message split into
+buckets of --bucket_cap_mb (bucketed) and broadcast over a sweep of message sizes, dtypes and world sizes,
+and reports latency, algorithmic bandwidth and bus bandwidth.
+
+The message size is the per-rank payload, i.e. the size of the gradient being synchronized. Algorithmic
+bandwidth is size / time. Bus bandwidth scales it by the bytes that cross the busiest link in one
+direction, per byte of message, so that it can be compared with the (full-duplex) link speed whatever
+the world size. For the rooted collectives the busiest link is the root's:
+
+    all_reduce, bucketed all_reduce:  algbw * 2 * (n - 1) / n   (every rank sends and receives 2 (n - 1) / n)
+    gather + scatter:                 algbw * (n - 1)           (rank 0 receives, then sends, (n - 1) messages)
+    broadcast:                        algbw                     (the root sends the message once when forwarded)
+
+Smaller world sizes are benchmarked on the first ranks of the job, so one launch covers the whole sweep.
+Run all processes on one machine with
+
+    python benchmark_collectives.py --nproc 4 --world_sizes 2,4
+
+or start one process per node as for run_glue.py
+
+    python benchmark_collectives.py --master_ip $ip_address --master_port $port --world_size 4 --local_rank $rank
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import csv
+import json
+import logging
+import os
+import time
+
+import torch
+import torch.multiprocessing as mp
+
+from utils_dist import find_free_port
+
+logger = logging.getLogger(__name__)
+
+DTYPES = {'float32': torch.float32, 'float16': torch.float16, 'bfloat16': torch.bfloat16}
+
+
+def bench_gather_scatter(tensor, group, group_size, rank, bucket_cap_bytes):
+    gather_list = [torch.empty_like(tensor) for _ in range(group_size)] if rank == 0 else None
+    torch.distributed.gather(tensor, gather_list, dst=0, group=group)
+    torch.distributed.scatter(tensor, gather_list, src=0, group=group)
+
+
+def bench_all_reduce(tensor, group, group_size, rank, bucket_cap_bytes):
+    torch.distributed.all_reduce(tensor, op=torch.distributed.ReduceOp.SUM, group=group)
+
+
+def bench_bucketed_all_reduce(tensor, group, group_size, rank, bucket_cap_bytes):
+    bucket_numel = max(1, bucket_cap_bytes // tensor.element_size())
+    works = [torch.distributed.all_reduce(bucket, op=torch.distributed.ReduceOp.SUM, group=group, async_op=True)
+             for bucket in tensor.split(bucket_numel)]
+    for work in works:
+        work.wait()
+
+
+def bench_broadcast(tensor, group, group_size, rank, bucket_cap_bytes):
+    torch.distributed.broadcast(tensor, src=0, group=group)
+
+
+BENCHMARKS = {
+    'gather_scatter': bench_gather_scatter,
+    'all_reduce': bench_all_reduce,
+    'bucketed_all_reduce': bench_bucketed_all_reduce,
+    'broadcast': bench_broadcast,
+}
+
+# Bytes crossing the busiest link in one direction per message byte (see the module docstring)
+BUS_FACTORS = {
+    'gather_scatter': lambda n: 1.0 * (n - 1),
+    'all_reduce': lambda n: 2.0 * (n - 1) / n,
+    'bucketed_all_reduce': lambda n: 2.0 * (n - 1) / n,
+    'broadcast': lambda n: 1.0,
+}
+
+
+def message_sizes(min_bytes, max_bytes, factor):
+    sizes = []
+    size = min_bytes
+    while size <= max_bytes:
+        sizes.append(size)
+        size *= factor
+    return sizes
+
+
+def run_benchmarks(args, rank, world_size):
+    """Runs the whole sweep on an initialized process group; returns the result rows on rank 0."""
+    world_sizes = [int(n) for n in args.world_sizes.split(',')] if args.world_sizes else [world_size]
+    for n in world_sizes:
+        if not 1 < n <= world_size:
+            raise ValueError("Benchmarked world sizes must be in [2, {}], got {}".format(world_size, n))
+    # new_group must be called by every process for every group, in the same order
+    groups = [(n, torch.distributed.new_group(list(range(n))) if n < world_size else None) for n in world_sizes]
+
+    rows = []
+    for group_size, group in groups:
+        if rank >= group_size:
+            continue
+        for op in args.ops.split(','):
+            benchmark = BENCHMARKS[op]
+            for dtype_name in args.dtypes.split(','):
+                dtype = DTYPES[dtype_name]
+                for size in message_sizes(args.min_bytes, args.max_bytes, args.size_factor):
+                    tensor = torch.ones(max(1, size // (torch.finfo(dtype).bits // 8)), dtype=dtype)
+                    for _ in range(args.warmup_iters):
+                        benchmark(tensor, group, group_size, rank, int(args.bucket_cap_mb * 2**20))
+                    torch.distributed.barrier(group=group)
+                    start = time.time()
+                    for _ in range(args.iters):
+                        benchmark(tensor, group, group_size, rank, int(args.bucket_cap_mb * 2**20))
+                    elapsed = torch.tensor([(time.time() - start) / args.iters], dtype=torch.float64)
+                    # The slowest rank determines when a collective is done
+                    torch.distributed.all_reduce(elapsed, op=torch.distributed.ReduceOp.MAX, group=group)
+                    latency = elapsed.item()
+                    num_bytes = tensor.numel() * tensor.element_size()
+                    algbw = num_bytes / latency / 1e9
+                    rows.append({
+                        'op': op,
+                        'dtype': dtype_name,
+                        'world_size': group_size,
+                        'bytes': num_bytes,
+                        'latency_us': latency * 1e6,
+                        'algbw_gbps': algbw,
+                        'busbw_gbps': algbw * BUS_FACTORS[op](group_size),
+                    })
+                    del tensor
+    return rows if rank == 0 else None
+
+
+def print_tables(rows):
+    keys = []
+    for row in rows:
+        if (row['op'], row['dtype'], row['world_size']) not in keys:
+            keys.append((row['op'], row['dtype'], row['world_size']))
+    for op, dtype, world_size in keys:
+        print("\n### {} ({}, world size {})\n".format(op, dtype, world_size))
+        print("| size (bytes) | latency (us) | algbw (GB/s) | busbw (GB/s) |")
+        print("|---:|---:|---:|---:|")
+        for row in rows:
+            if (row['op'], row['dtype'], row['world_size']) == (op, dtype, world_size):
+                print("| {} | {:.1f} | {:.3f} | {:.3f} |".format(
+                    row['bytes'], row['latency_us'], row['algbw_gbps'], row['busbw_gbps']))
+
+
+def write_results(rows, output_file):
+    if output_file.endswith('.csv'):
+        with open(output_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(output_file, 'w') as f:
+            json.dump(rows, f, indent=2)
+    logger.info("Benchmark results saved to %s", output_file)
+
+
+def worker(rank, args, init_method, world_size):
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                        datefmt='%m/%d/%Y %H:%M:%S',
+                        level=logging.INFO if rank == 0 else logging.WARN)
+    torch.distributed.init_process_group(backend='gloo', init_method=init_method, world_size=world_size, rank=rank)
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+    rows = run_benchmarks(args, rank, world_size)
+    if rows is not None:
+        print_tables(rows)
+        if args.output_file:
+            write_results(rows, args.output_file)
+    torch.distributed.destroy_process_group()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nproc", type=int, default=0,
+                        help="Spawn this many processes on this machine; otherwise this process is one rank of a "
+                             "multi-node job given by --master_ip/--master_port/--world_size/--local_rank")
+    parser.add_argument("--master_ip", type=str, default=None,
+                        help="IP address of main node")
+    parser.add_argument("--master_port", type=str, default=None,
+                        help="Port of main node")
+    parser.add_argument("--world_size", type=int, default=1,
+                        help="Num nodes in distributed training")
+    parser.add_argument("--local_rank", type=int, default=-1,
+                        help="Rank of this process in a multi-node benchmark")
+    parser.add_argument("--world_sizes", type=str, default="",
+                        help="Comma-separated world sizes to benchmark on the first ranks; defaults to all ranks")
+    parser.add_argument("--ops", type=str, default=",".join(BENCHMARKS.keys()),
+                        help="Comma-separated collectives to time, from: " + ", ".join(BENCHMARKS.keys()))
+    parser.add_argument("--dtypes", type=str, default="float32",
+                        help="Comma-separated dtypes, from: " + ", ".join(DTYPES.keys()))
+    parser.add_argument("--min_bytes", type=int, default=4 * 2**10,
+                        help="Smallest message size in bytes")
+    parser.add_argument("--max_bytes", type=int, default=512 * 2**20,
+                        help="Largest message size in bytes")
+    parser.add_argument("--size_factor", type=int, default=2,
+                        help="Factor between consecutive message sizes")
+    parser.add_argument("--bucket_cap_mb", type=float, default=25.0,
+                        help="Bucket size in MB of the bucketed all_reduce")
+    parser.add_argument("--warmup_iters", type=int, default=2,
+                        help="Untimed iterations per measurement")
+    parser.add_argument("--iters", type=int, default=10,
+                        help="Timed iterations per measurement")
+    parser.add_argument("--num_threads", type=int, default=0,
+                        help="torch threads per process; 0 keeps the default (with --nproc: cores / nproc)")
+    parser.add_argument("--output_file", type=str, default="",
+                        help="Also save the results as .json or .csv")
+    args = parser.parse_args()
+
+    for op in args.ops.split(','):
+        if op not in BENCHMARKS:
+            raise ValueError("Unknown collective: %s" % op)
+    for dtype in args.dtypes.split(','):
+        if dtype not in DTYPES:
+            raise ValueError("Unknown dtype: %s" % dtype)
+
+    if args.nproc > 0:
+        if args.num_threads == 0:
+            args.num_threads = max(1, os.cpu_count() // args.nproc)
+        init_method = "tcp://127.0.0.1:{}".format(find_free_port())
+        mp.spawn(worker, args=(args, init_method, args.nproc), nprocs=args.nproc)
+    else:
+        if args.master_ip is None or args.master_port is None or args.local_rank == -1:
+            raise ValueError("Without --nproc, master_ip, master_port and local_rank must be specified")
+        worker(args.local_rank, args, f"tcp://{args.master_ip}:{args.master_port}", args.world_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# coding=utf-8
+""" Compares step time, communication and final accuracy of several runs, e.g. different sync strategies.
+
+Run run_glue.py once per configuration with a different --output_dir, for example
+
+    python run_glue.py [other input args] --output_dir /tmp/RTE_ddp --sync_strategy ddp ...
+    python run_glue.py [other input args] --output_dir /tmp/RTE_powersgd --sync_strategy ddp --comm_hook powersgd ...
+    python run_glue.py [other input args] --output_dir /tmp/RTE_bucketed --sync_strategy bucketed ...
+
+and then compare them with
+
+    python compare_runs.py ddp=/tmp/RTE_ddp powersgd=/tmp/RTE_powersgd
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import os
+
+
+def read_summary(output_dir, rank):
+    with open(os.path.join(output_dir, "train_summary_rank_{}.json".format(rank))) as f:
+        return json.load(f)
+
+
+def read_eval_results(output_dir, rank):
+    """Reads the final evaluation results written by evaluate() for the given rank."""
+    rank_dir = os.path.join(output_dir, "rank_{}".format(rank))
+    eval_file = os.path.join(rank_dir, "eval_results_final.txt")
+    if not os.path.exists(eval_file):
+        eval_file = os.path.join(output_dir, "eval_results_final.txt")
+    results = {}
+    with open(eval_file) as f:
+        for line in f:
+            key, value = line.strip().split(" = ")
+            results[key] = float(value)
+    return results
+
+
+def format_megabytes(num_bytes):
+    """Formats a byte count in MB, or "n/a" when the run did not measure it."""
+    return "{:.2f}".format(num_bytes / 2**20) if num_bytes is not None else "n/a"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("runs", nargs="+",
+                        help="Runs to compare as name=output_dir; the first run is the baseline")
+    parser.add_argument("--rank", type=int, default=0,
+                        help="Rank whose timing and evaluation results are compared")
+    parser.add_argument("--metric", type=str, default="acc",
+                        help="Evaluation metric to report")
+    args = parser.parse_args()
+
+    rows = []
+    for run in args.runs:
+        name, output_dir = run.split("=", 1)
+        summary = read_summary(output_dir, args.rank)
+        results = read_eval_results(output_dir, args.rank)
+        rows.append((name, summary, results.get(args.metric)))
+
+    baseline_time = rows[0][1]['avg_iteration_time']
+    print("| run | sync strategy | comm hook | avg step time (s) | speedup | comm time/step (s) | MB sent/step | padding | final {} |".format(args.metric))
+    print("|---|---|---|---|---|---|---|---|---|")
+    for name, summary, metric in rows:
+        print("| {} | {} | {} | {:.4f} | {:.2f}x | {:.4f} | {} | {} | {} |".format(
+            name, summary.get('sync_strategy', 'ddp'), summary['comm_hook'], summary['avg_iteration_time'],
+            baseline_time / summary['avg_iteration_time'],
+            summary.get('avg_comm_time', 0.0), format_megabytes(summary.get('avg_comm_bytes', 0.0)),
+            "{:.1f}%".format(100 * summary['padding_fraction']) if 'padding_fraction' in summary else "n/a",
+            "{:.4f}".format(metric) if metric is not None else "n/a"))
+
+
+if __name__ == "__main__":
+    main()
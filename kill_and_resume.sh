@@ -0,0 +1,50 @@
+#!/bin/bash
+# Kills one worker of a local multi-process run once it has saved a checkpoint, then restarts the job
+# with --resume and checks that it continued from the saved step instead of starting over.
+#
+#   GLUE_DIR=/proj/cos568proj2-PG0/glue_data ./kill_and_resume.sh [output_dir]
+#
+# NPROC, SAVE_STEPS and SYNC_STRATEGY can be overridden from the environment.
+
+GLUE_DIR=${GLUE_DIR:-/proj/cos568proj2-PG0/glue_data}
+TASK_NAME=${TASK_NAME:-RTE}
+OUTPUT_DIR=${1:-/tmp/${TASK_NAME}_resume}
+NPROC=${NPROC:-2}
+SAVE_STEPS=${SAVE_STEPS:-5}
+SYNC_STRATEGY=${SYNC_STRATEGY:-allreduce}
+
+ARGS=(--model_type bert --model_name_or_path bert-base-cased --task_name "$TASK_NAME"
+      --do_train --do_eval --data_dir "$GLUE_DIR/$TASK_NAME" --max_seq_length 128
+      --per_device_train_batch_size 16 --learning_rate 2e-5 --num_train_epochs 1
+      --output_dir "$OUTPUT_DIR" --sync_strategy "$SYNC_STRATEGY" --nproc "$NPROC" --save_steps "$SAVE_STEPS")
+CHECKPOINT="$OUTPUT_DIR/checkpoint-last/training_state.bin"
+
+cd "$(dirname "$0")"
+rm -rf "$OUTPUT_DIR"
+
+python3 run_glue.py "${ARGS[@]}" &
+LAUNCHER=$!
+# Wait for the first checkpoint
+while [ ! -f "$CHECKPOINT" ]; do
+    if ! kill -0 $LAUNCHER 2>/dev/null; then
+        echo "Training ended before saving a checkpoint; lower SAVE_STEPS"
+        exit 1
+    fi
+    sleep 1
+done
+
+# The workers are the launcher's multiprocessing children
+WORKER=$(pgrep -P $LAUNCHER -f spawn_main | tail -n 1)
+echo "Checkpoint saved; killing worker process $WORKER"
+kill -9 "$WORKER"
+wait $LAUNCHER
+echo "Launcher exited with status $? after losing a worker"
+
+python3 run_glue.py "${ARGS[@]}" --resume || exit 1
+if grep -q "Resuming from step" "$OUTPUT_DIR/logs/rank_0.log"; then
+    grep "Resuming from step" "$OUTPUT_DIR/logs/rank_0.log"
+    echo "Resumed from $CHECKPOINT"
+else
+    echo "The restarted job did not resume from $CHECKPOINT"
+    exit 1
+fi
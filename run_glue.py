@@ -0,0 +1,1126 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors and The HuggingFace Inc. team.
+# Copyright (c) 2018, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Finetuning the library models for sequence classification on GLUE (Bert, XLM, XLNet, RoBERTa).
+
+This is the training script shared by all tasks. How gradients are synchronized between processes is chosen
+with --sync_strategy (see utils_sync.py); task1, task2a, task2b and task3 only change its default.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import glob
+import logging
+import os
+import random
+import resource
+import sys
+import time
+import json
+from datetime import datetime
+
+import numpy as np
+import torch
+from torch.utils.data import (DataLoader, RandomSampler, SequentialSampler,
+                              TensorDataset)
+from tqdm import tqdm, trange
+
+# import a previous version of the HuggingFace Transformers package
+from pytorch_transformers import (WEIGHTS_NAME, BertConfig,
+                                  BertForSequenceClassification, BertTokenizer,
+                                  RobertaConfig,
+                                  RobertaForSequenceClassification,
+                                  RobertaTokenizer,
+                                  XLMConfig, XLMForSequenceClassification,
+                                  XLMTokenizer, XLNetConfig,
+                                  XLNetForSequenceClassification,
+                                  XLNetTokenizer)
+
+from pytorch_transformers import WarmupLinearSchedule
+
+from utils_glue import (compute_metrics, convert_examples_to_features,
+                        output_modes, processors)
+from utils_comm import CommLogger
+from utils_dist import find_free_port
+from utils_data import (BatchRebalancer, DynamicPaddingCollator, EpochShardedDataset, LengthGroupedBatchSampler,
+                        RebalancingBatchSampler, fixed_shard, ResumableDistributedSampler, StreamingFeatureDataset,
+                        TokenBudgetBatchSampler,
+                        features_to_columns, load_feature_columns, save_feature_columns)
+from utils_optim import LR_SCALING_RULES, OPTIMIZERS, OPTIMIZER_BACKENDS, scaled_learning_rate
+from utils_sync import SYNC_STRATEGIES
+
+logger = logging.getLogger(__name__)
+
+ALL_MODELS = sum((tuple(conf.pretrained_config_archive_map.keys()) for conf in (BertConfig, XLNetConfig, XLMConfig, RobertaConfig)), ())
+
+MODEL_CLASSES = {
+    'bert': (BertConfig, BertForSequenceClassification, BertTokenizer),
+    'xlnet': (XLNetConfig, XLNetForSequenceClassification, XLNetTokenizer),
+    'xlm': (XLMConfig, XLMForSequenceClassification, XLMTokenizer),
+    'roberta': (RobertaConfig, RobertaForSequenceClassification, RobertaTokenizer),
+}
+
+
+def set_seed(args):
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    torch.backends.cudnn.deterministic = True
+    torch.backends.cudnn.benchmark = False
+    torch.cuda.manual_seed_all(args.seed)
+
+
+def save_training_state(args, model, optimizer, scheduler, sync, t_total, global_step, epoch, epoch_samples, tr_loss):
+    """Saves everything needed to continue training after the current step to output_dir/checkpoint-last.
+
+    `epoch_samples` is the number of samples of the current epoch consumed by all ranks together.
+    """
+    checkpoint_dir = os.path.join(args.output_dir, 'checkpoint-last')
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    model_to_save = model.module if hasattr(model, 'module') else model  # Take care of distributed/parallel training
+    state = {
+        'model': model_to_save.state_dict(),
+        'optimizer': optimizer.state_dict(),
+        'scheduler': scheduler.state_dict(),
+        'sync': sync.state_dict(),
+        't_total': t_total,
+        'global_step': global_step,
+        'epoch': epoch,
+        'epoch_samples': epoch_samples,
+        'tr_loss': tr_loss,
+        'world_size': args.world_size,
+        'rng_state': (random.getstate(), np.random.get_state(), torch.get_rng_state()),
+    }
+    # Write to a temporary file first so that a worker dying mid-save never leaves a truncated checkpoint
+    checkpoint_file = os.path.join(checkpoint_dir, 'training_state.bin')
+    torch.save(state, checkpoint_file + '.tmp')
+    os.replace(checkpoint_file + '.tmp', checkpoint_file)
+    logger.info("Saved training state at step %d to %s", global_step, checkpoint_file)
+
+
+def load_training_state(args):
+    """Returns the state saved by save_training_state in output_dir, or None if there is none."""
+    checkpoint_file = os.path.join(args.output_dir, 'checkpoint-last', 'training_state.bin')
+    if not os.path.exists(checkpoint_file):
+        return None
+    return torch.load(checkpoint_file, map_location='cpu')
+
+
+def train(args, train_dataset, model, tokenizer, sync):
+    """ Train the model, synchronizing gradients through the SyncStrategy `sync` """
+    args.train_batch_size = args.per_device_train_batch_size
+    
+    # Pad every batch to its longest sequence only
+    collate_fn = DynamicPaddingCollator(pad_on_left=args.model_type in ['xlnet']) if args.dynamic_padding else None
+    rebalancer = None
+    if isinstance(train_dataset, StreamingFeatureDataset):
+        # Rows are sharded and shuffled by the dataset itself; workers tokenize while the model trains
+        train_sampler = None
+        train_dataloader = DataLoader(train_dataset, batch_size=args.train_batch_size,
+                                      num_workers=args.stream_num_workers, collate_fn=collate_fn)
+    elif isinstance(train_dataset, EpochShardedDataset):
+        # The dataset already holds this epoch's examples of this rank in sampling order
+        train_sampler = SequentialSampler(train_dataset)
+        train_dataloader = DataLoader(train_dataset, sampler=train_sampler, batch_size=args.train_batch_size,
+                                      collate_fn=collate_fn)
+    elif args.shard_dataset == 'fixed' and args.rank != -1:
+        # Shuffle within the shard of this rank
+        train_sampler = ResumableDistributedSampler(train_dataset, 1, 0)
+        train_dataloader = DataLoader(train_dataset, sampler=train_sampler, batch_size=args.train_batch_size,
+                                      collate_fn=collate_fn)
+    elif args.rebalance_steps > 0:
+        # Every global batch is split across ranks in proportion to their measured speed
+        train_sampler = RebalancingBatchSampler(train_dataset, args.train_batch_size * args.world_size,
+                                                args.world_size, args.rank)
+        train_dataloader = DataLoader(train_dataset, batch_sampler=train_sampler, collate_fn=collate_fn)
+        rebalancer = BatchRebalancer(train_sampler, args.rank, args.world_size, args.rebalance_steps)
+    elif args.group_by_length:
+        # Batches of similar lengths, so that dynamic padding removes most of the padding
+        train_sampler = LengthGroupedBatchSampler(train_dataset.tensors[4], args.train_batch_size,
+                                                  args.world_size, max(args.rank, 0), seed=args.seed)
+        train_dataloader = DataLoader(train_dataset, batch_sampler=train_sampler, collate_fn=collate_fn)
+    elif args.max_tokens_per_batch > 0:
+        # Batch sizes follow the lengths so that every rank processes about the same number of tokens
+        train_sampler = TokenBudgetBatchSampler(train_dataset.tensors[4], args.max_tokens_per_batch,
+                                                args.world_size, max(args.rank, 0), seed=args.seed)
+        train_dataloader = DataLoader(train_dataset, batch_sampler=train_sampler, collate_fn=collate_fn)
+    else:
+        # Use distributed sampler if we're in distributed mode or checkpointing; it can resume mid-epoch on any number of processes
+        if args.rank != -1 or args.resume or args.save_steps > 0:
+            train_sampler = ResumableDistributedSampler(train_dataset, args.world_size, max(args.rank, 0))
+        else:
+            train_sampler = RandomSampler(train_dataset)
+
+        train_dataloader = DataLoader(train_dataset, sampler=train_sampler, batch_size=args.train_batch_size,
+                                      collate_fn=collate_fn)
+    
+    # Initialize loss logging
+    loss_log = []
+    total_loss = 0.0
+
+    if args.max_steps > 0:
+        t_total = args.max_steps
+        args.num_train_epochs = args.max_steps // (len(train_dataloader) // args.gradient_accumulation_steps) + 1
+    else:
+        t_total = len(train_dataloader) // args.gradient_accumulation_steps * args.num_train_epochs
+
+    resume_state = load_training_state(args) if args.resume else None
+    if resume_state is not None:
+        # Keep the learning rate schedule of the original run even if the world size changed
+        t_total = resume_state['t_total']
+
+    # Prepare optimizer and schedule (linear warmup and decay)
+    no_decay = ['bias', 'LayerNorm.weight']
+    optimizer_grouped_parameters = [
+        {'params': [p for n, p in model.named_parameters() if not any(nd in n for nd in no_decay)], 'weight_decay': args.weight_decay},
+        {'params': [p for n, p in model.named_parameters() if any(nd in n for nd in no_decay)], 'weight_decay': 0.0,
+         'layer_adaptation': False}  # LAMB/LARS take the plain step for biases and LayerNorm
+        ]
+    optimizer = sync.build_optimizer(optimizer_grouped_parameters)
+    _, clip_grad_norm = OPTIMIZER_BACKENDS[args.optimizer_backend]
+    scheduler = WarmupLinearSchedule(optimizer, warmup_steps=args.warmup_steps, t_total=t_total)
+    if args.fp16:
+        try:
+            from apex import amp
+        except ImportError:
+            raise ImportError("Please install apex from https://www.github.com/nvidia/apex to use fp16 training.")
+        model, optimizer = amp.initialize(model, optimizer, opt_level=args.fp16_opt_level)
+
+    # Train!
+    logger.info("***** Running training *****")
+    logger.info("  Num examples = %d", len(train_dataset))
+    logger.info("  Num Epochs = %d", args.num_train_epochs)
+    logger.info("  Instantaneous batch size per device = %d", args.per_device_train_batch_size)
+    logger.info("  Total train batch size (w. parallel, distributed & accumulation) = %d",
+                   args.train_batch_size * args.gradient_accumulation_steps * (torch.distributed.get_world_size() if args.rank != -1 else 1))
+    logger.info("  Gradient Accumulation steps = %d", args.gradient_accumulation_steps)
+    logger.info("  Total optimization steps = %d", t_total)
+
+    logger.info("  Sync strategy = %s", sync.name)
+    sync.setup(model, optimizer, t_total, no_decay)
+
+    # Record every collective issued during training and the interface counters at epoch boundaries
+    comm_log = None
+    if args.log_comm and args.rank != -1:
+        comm_log = CommLogger(args.rank, interface=args.net_interface)
+        comm_log.install()
+
+    global_step = 0
+    tr_loss, logging_loss = 0.0, 0.0
+    # Real tokens of the batches, and token positions the model computed on (real tokens + padding)
+    real_tokens, processed_tokens = 0, 0
+    # Examples this process trained on; batch sizes vary with rebalancing, token budgets and streaming
+    num_examples = 0
+    model.zero_grad()
+    train_iterator = trange(int(args.num_train_epochs), desc="Epoch", disable=args.rank not in [-1, 0])
+    set_seed(args)  # Added here for reproductibility (even between python 2 and 3)
+    epoch = 0
+
+    # Continue after the last saved step; the rest of that epoch is split across the current processes
+    resume_epoch, resume_samples = 1, 0
+    if resume_state is not None:
+        model_to_load = model.module if hasattr(model, 'module') else model
+        model_to_load.load_state_dict(resume_state['model'])
+        optimizer.load_state_dict(resume_state['optimizer'])
+        scheduler.load_state_dict(resume_state['scheduler'])
+        sync.load_state_dict(resume_state.get('sync', {}))
+        global_step = resume_state['global_step']
+        tr_loss = resume_state['tr_loss']
+        resume_epoch, resume_samples = resume_state['epoch'], resume_state['epoch_samples']
+        random.setstate(resume_state['rng_state'][0])
+        np.random.set_state(resume_state['rng_state'][1])
+        torch.set_rng_state(resume_state['rng_state'][2])
+        logger.info("  Resuming from step %d (epoch %d, %d samples into the epoch) saved with world size %d",
+                    global_step, resume_epoch, resume_samples, resume_state['world_size'])
+    
+    # Initialize timers
+    epoch_times = []
+    iteration_times = []
+    iteration_start_time = None
+    first_iteration_time = None
+    time_to_first_step = None
+    train_start_time = time.time()
+    
+    for _ in train_iterator:
+        epoch += 1
+        if epoch < resume_epoch:
+            continue
+        epoch_start_samples = resume_samples if epoch == resume_epoch else 0
+        if isinstance(train_dataset, EpochShardedDataset):
+            train_dataset.set_epoch(epoch - 1, epoch_start_samples)
+        elif args.shard_dataset == 'fixed' and args.rank != -1:
+            # Samples are counted over all ranks; each rank consumed its share of them from its own shard
+            train_sampler.set_epoch(epoch - 1, epoch_start_samples // args.world_size)
+        elif isinstance(train_sampler, (ResumableDistributedSampler, RebalancingBatchSampler, LengthGroupedBatchSampler,
+                                        TokenBudgetBatchSampler)):
+            train_sampler.set_epoch(epoch - 1, epoch_start_samples)
+        elif isinstance(train_dataset, StreamingFeatureDataset):
+            train_dataset.set_epoch(epoch - 1)
+        epoch_start_time = time.time()
+        if comm_log is not None:
+            comm_log.start_epoch()
+        epoch_iterator = tqdm(train_dataloader, desc="Iteration", disable=args.rank not in [-1, 0])
+        
+        for step, batch in enumerate(epoch_iterator):
+            # Skip timing for the first batch as it includes compilation time
+            if iteration_start_time is None:
+                iteration_start_time = time.time()
+                time_to_first_step = iteration_start_time - args.start_time
+                logger.info("Time to first step: %.2f seconds", time_to_first_step)
+                
+            compute_start_time = time.time()
+            sync_step = (step + 1) % args.gradient_accumulation_steps == 0
+            # Strategies may skip communication on accumulation micro-steps (DDP no_sync)
+            with sync.micro_step_context(sync_step):
+                model.train()
+                batch = tuple(t.to(args.device) for t in batch)
+                inputs = {'input_ids':      batch[0],
+                          'attention_mask': batch[1],
+                          'token_type_ids': batch[2] if args.model_type in ['bert', 'xlnet'] else None,  # XLM don't use segment_ids
+                          'labels':         batch[3]}
+                outputs = model(**inputs)
+                loss = outputs[0]  # model outputs are always tuple in pytorch-transformers (see doc)
+
+                if rebalancer is not None:
+                    # Averaging the gradients over ranks must weight every rank by its share of the global batch
+                    loss = loss * (batch[0].size(0) * args.world_size / train_sampler.global_batch_size)
+                elif isinstance(train_sampler, TokenBudgetBatchSampler):
+                    loss = loss * (batch[0].size(0) * args.world_size / train_sampler.last_global_batch_size)
+
+                if args.gradient_accumulation_steps > 1:
+                    loss = loss / args.gradient_accumulation_steps
+
+                sync.before_backward(sync_step)
+
+                if args.fp16:
+                    with amp.scale_loss(loss, optimizer) as scaled_loss:
+                        scaled_loss.backward()
+                else:
+                    # Backward pass
+                    loss.backward()
+                sync.after_backward(sync_step)
+            if rebalancer is not None:
+                rebalancer.record_compute(time.time() - compute_start_time, batch[0].size(0))
+            num_examples += batch[0].size(0)
+            real_tokens += int(batch[4].sum())
+            processed_tokens += batch[0].numel()
+
+            # Log the loss for every step
+            current_loss = loss.item()
+            tr_loss += current_loss
+            total_loss += current_loss
+            
+            # Add to loss log with step information and cumulative loss
+            loss_log.append({
+                'epoch': epoch,
+                'step': step,
+                'global_step': global_step,
+                'step_loss': current_loss,
+                'total_loss': total_loss,
+                'avg_loss': total_loss / (global_step + 1) if global_step > 0 else total_loss,
+                'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            })
+            
+            if sync_step:
+                # Print out the loss for the first 5 steps
+                if step < 5:
+                    print('Epoch: {}, Step: {}, Step Loss: {}, Total Loss: {}'.format(
+                        epoch, step, current_loss, total_loss))
+                
+                # Average the gradients of all processes
+                sync_start_time = time.time()
+                sync.before_optimizer()
+                if rebalancer is not None:
+                    rebalancer.record_wait(time.time() - sync_start_time)
+
+                if sync.clips_gradients:
+                    if args.fp16:
+                        clip_grad_norm(amp.master_params(optimizer), args.max_grad_norm)
+                    else:
+                        clip_grad_norm(model.parameters(), args.max_grad_norm)
+
+                # Perform optimizer step
+                sync.optimizer_step(optimizer, scheduler)
+                model.zero_grad()
+                global_step += 1
+
+                loss_log[-1].update(sync.after_optimizer(global_step))
+                if rebalancer is not None and rebalancer.maybe_rebalance(global_step) is not None:
+                    loss_log[-1]['batch_sizes'] = list(train_sampler.batch_sizes)
+
+                if args.save_steps > 0 and global_step % args.save_steps == 0:
+                    sync.before_checkpoint()
+                    if isinstance(train_sampler, TokenBudgetBatchSampler):
+                        epoch_samples = train_sampler.consumed_samples(step + 1)
+                    else:
+                        epoch_samples = epoch_start_samples + (step + 1) * args.train_batch_size * args.world_size
+                    if args.rank in [-1, 0]:
+                        save_training_state(args, model, optimizer, scheduler, sync, t_total, global_step, epoch,
+                                            epoch_samples, tr_loss)
+                    if args.rank != -1:
+                        torch.distributed.barrier()
+                
+                # Record iteration time for all iterations of the first epoch except the first one
+                if epoch == resume_epoch:
+                    if first_iteration_time is None:
+                        first_iteration_time = time.time() - iteration_start_time
+                        print(f"First iteration time (excluded from average): {first_iteration_time:.4f} seconds")
+                    else:
+                        iteration_times.append(time.time() - iteration_start_time)
+                    iteration_start_time = time.time()
+
+            if args.max_steps > 0 and global_step > args.max_steps:
+                epoch_iterator.close()
+                break
+                
+        # Record epoch time
+        epoch_end_time = time.time()
+        epoch_time = epoch_end_time - epoch_start_time
+        epoch_times.append(epoch_time)
+        logger.info(f"Epoch {epoch} completed in {epoch_time:.4f} seconds")
+        if comm_log is not None:
+            comm_log.end_epoch(epoch)
+        
+        if args.max_steps > 0 and global_step > args.max_steps:
+            train_iterator.close()
+            break
+        
+        # Call evaluate() after every epoch
+        evaluate(args, model, tokenizer, prefix=str(epoch))
+    
+    sync.finish()
+    if comm_log is not None:
+        comm_log.uninstall()
+        comm_log.write(args.output_dir)
+
+    train_time = time.time() - train_start_time
+    logger.info(f"Training throughput: {num_examples / train_time:.2f} examples/sec on rank {args.rank}")
+    global_num_examples = num_examples
+    if args.rank != -1:
+        counts = torch.tensor([num_examples], dtype=torch.float64)
+        torch.distributed.all_reduce(counts)
+        global_num_examples = int(counts.item())
+        logger.info("Global training throughput: %.2f examples/sec over %d ranks",
+                    global_num_examples / train_time, args.world_size)
+
+    # Print average iteration time
+    avg_iteration_time = sum(iteration_times) / len(iteration_times) if iteration_times else 0.0
+    logger.info(f"Average iteration time (excluding first iteration): {avg_iteration_time:.4f} seconds")
+
+    # Also just log each iteration time
+    for i, time_val in enumerate(iteration_times):
+        logger.info(f"Iteration {i + 1} time: {time_val:.4f} seconds")
+    
+    logger.info(sync.summary())
+    if sync.compressor is not None:
+        logger.info(sync.compressor.summary())
+
+    # Print average epoch time
+    avg_epoch_time = sum(epoch_times) / len(epoch_times) if epoch_times else 0.0
+    logger.info(f"Average epoch time: {avg_epoch_time:.4f} seconds")
+
+    padding_fraction = 1.0 - real_tokens / processed_tokens if processed_tokens else 0.0
+    logger.info("Tokens: %d real, %d processed, %.1f%% padding", real_tokens, processed_tokens, 100 * padding_fraction)
+
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    peak_rss_children_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    logger.info("Peak memory: %.1f MB in this process, %.1f MB in its largest child process",
+                peak_rss_mb, peak_rss_children_mb)
+
+    # Save a timing summary so that runs with different sync strategies can be compared
+    os.makedirs(args.output_dir, exist_ok=True)
+    summary_file = os.path.join(args.output_dir, f"train_summary_rank_{max(args.rank, 0)}.json")
+    summary = {
+        'comm_hook': args.comm_hook,
+        'grad_compression': args.grad_compression,
+        'world_size': args.world_size,
+        'num_iterations': len(iteration_times),
+        'avg_iteration_time': avg_iteration_time,
+        'avg_epoch_time': avg_epoch_time,
+        'train_time': train_time,
+        'num_examples': num_examples,
+        'throughput': num_examples / train_time,
+        'global_num_examples': global_num_examples,
+        'global_throughput': global_num_examples / train_time,
+        'time_to_first_step': time_to_first_step,
+        # Peak resident memory of this process and of its largest finished child, e.g. a DataLoader worker
+        # that read and tokenized the --streaming train set (ru_maxrss is in KB on Linux)
+        'peak_rss_mb': peak_rss_mb,
+        'peak_rss_children_mb': peak_rss_children_mb,
+        'peak_rss_total_mb': peak_rss_mb + peak_rss_children_mb,
+        'real_tokens': real_tokens,
+        'processed_tokens': processed_tokens,
+        'padding_fraction': padding_fraction,
+    }
+    summary.update(sync.stats())
+    if rebalancer is not None:
+        summary['rebalance_log'] = rebalancer.history
+    if isinstance(train_sampler, TokenBudgetBatchSampler):
+        summary['token_budget'] = train_sampler.stats
+    with open(summary_file, 'w') as f:
+        json.dump(summary, f, indent=2)
+    
+    # Save the loss log to a file
+    if args.rank != -1:
+        loss_log_file = os.path.join(args.output_dir, f"loss_log_rank_{args.rank}.json")
+    else:
+        loss_log_file = os.path.join(args.output_dir, "loss_log.json")
+        
+    os.makedirs(args.output_dir, exist_ok=True)
+    with open(loss_log_file, 'w') as f:
+        json.dump(loss_log, f, indent=2)
+    logger.info(f"Loss log saved to {loss_log_file}")
+
+    # Also just log all the total losses
+    for i, entry in enumerate(loss_log):
+        logger.info(f"Epoch {entry['epoch']}, Step {entry['step']}, Global Step {entry['global_step']}, Total Loss: {entry['total_loss']}")
+
+    return global_step, tr_loss / max(global_step, 1)
+
+
+def evaluate(args, model, tokenizer, prefix=""):
+    # Loop to handle MNLI double evaluation (matched, mis-matched)
+    eval_task_names = ("mnli", "mnli-mm") if args.task_name == "mnli" else (args.task_name,)
+    eval_outputs_dirs = (args.output_dir, args.output_dir + '-MM') if args.task_name == "mnli" else (args.output_dir,)
+
+    results = {}
+    for eval_task, eval_output_dir in zip(eval_task_names, eval_outputs_dirs):
+        eval_dataset = load_and_cache_examples(args, eval_task, tokenizer, evaluate=True)
+
+        # Create node-specific output directory
+        if args.rank != -1:
+            node_output_dir = os.path.join(eval_output_dir, f"rank_{args.rank}")
+        else:
+            node_output_dir = eval_output_dir
+            
+        if not os.path.exists(node_output_dir):
+            os.makedirs(node_output_dir)
+
+        args.eval_batch_size = args.per_device_eval_batch_size
+        # Note that DistributedSampler samples randomly
+        eval_sampler = SequentialSampler(eval_dataset)
+        collate_fn = DynamicPaddingCollator(pad_on_left=args.model_type in ['xlnet']) if args.dynamic_padding else None
+        eval_dataloader = DataLoader(eval_dataset, sampler=eval_sampler, batch_size=args.eval_batch_size,
+                                     collate_fn=collate_fn)
+
+        # Eval!
+        logger.info("***** Running evaluation {} for rank {} *****".format(prefix, args.rank))
+        logger.info("  Num examples = %d", len(eval_dataset))
+        logger.info("  Batch size = %d", args.eval_batch_size)
+        eval_loss = 0.0
+        nb_eval_steps = 0
+        preds = None
+        out_label_ids = None
+        for batch in tqdm(eval_dataloader, desc="Evaluating"):
+            model.eval()
+            batch = tuple(t.to(args.device) for t in batch)
+
+            with torch.no_grad():
+                inputs = {'input_ids':      batch[0],
+                          'attention_mask': batch[1],
+                          'token_type_ids': batch[2] if args.model_type in ['bert', 'xlnet'] else None,  # XLM and RoBERTa don't use segment_ids
+                          'labels':         batch[3]}
+                outputs = model(**inputs)
+                tmp_eval_loss, logits = outputs[:2]
+
+                eval_loss += tmp_eval_loss.mean().item()
+            nb_eval_steps += 1
+            if preds is None:
+                preds = logits.detach().cpu().numpy()
+                out_label_ids = inputs['labels'].detach().cpu().numpy()
+            else:
+                preds = np.append(preds, logits.detach().cpu().numpy(), axis=0)
+                out_label_ids = np.append(out_label_ids, inputs['labels'].detach().cpu().numpy(), axis=0)
+
+        eval_loss = eval_loss / nb_eval_steps
+        if args.output_mode == "classification":
+            preds = np.argmax(preds, axis=1)
+        elif args.output_mode == "regression":
+            preds = np.squeeze(preds)
+        result = compute_metrics(eval_task, preds, out_label_ids)
+        results.update(result)
+
+        # Save to node-specific output file
+        output_eval_file = os.path.join(node_output_dir, f"eval_results_{prefix}.txt")
+        with open(output_eval_file, "w") as writer:
+            logger.info("***** Eval results {} for rank {} *****".format(prefix, args.rank))
+            for key in sorted(result.keys()):
+                logger.info("  %s = %s", key, str(result[key]))
+                writer.write("%s = %s\n" % (key, str(result[key])))
+
+    return results
+
+
+def get_label_list(args, task, processor):
+    label_list = processor.get_labels()
+    if task in ['mnli', 'mnli-mm'] and args.model_type in ['roberta']:
+        # HACK(label indices are swapped in RoBERTa pretrained model)
+        label_list[1], label_list[2] = label_list[2], label_list[1] 
+    return label_list
+
+
+def convert_options(args, tokenizer):
+    """Model-specific keyword arguments of convert_examples_to_features."""
+    return dict(
+        max_seq_length=args.max_seq_length,
+        cls_token_at_end=bool(args.model_type in ['xlnet']),            # xlnet has a cls token at the end
+        cls_token=tokenizer.cls_token,
+        cls_token_segment_id=2 if args.model_type in ['xlnet'] else 0,
+        sep_token=tokenizer.sep_token,
+        sep_token_extra=bool(args.model_type in ['roberta']),           # roberta uses an extra separator b/w pairs of sentences, cf. github.com/pytorch/fairseq/commit/1684e166e3da03f5b600dbb7855cb98ddfcd0805
+        pad_on_left=bool(args.model_type in ['xlnet']),                 # pad on the left for xlnet
+        pad_token=tokenizer.convert_tokens_to_ids([tokenizer.pad_token])[0],
+        pad_token_segment_id=4 if args.model_type in ['xlnet'] else 0,
+    )
+
+
+def load_streaming_examples(args, task, tokenizer):
+    """Train set that is read and tokenized lazily while training (--streaming)."""
+    processor = processors[task]()
+    dataset = StreamingFeatureDataset(processor, args.data_dir, get_label_list(args, task, processor), tokenizer,
+                                      output_modes[task], convert_options(args, tokenizer), max(args.rank, 0),
+                                      args.world_size, batch_size=args.per_device_train_batch_size, seed=args.seed,
+                                      shuffle_buffer=args.stream_shuffle_buffer)
+    logger.info("Streaming %d lines of the train set, %d examples per process", dataset.num_lines, len(dataset))
+    return dataset
+
+
+def load_and_cache_examples(args, task, tokenizer, evaluate=False):
+    if args.rank not in [-1, 0]:
+        torch.distributed.barrier()  # Make sure only the first process in distributed training process the dataset, and the others will use the cache
+
+    processor = processors[task]()
+    output_mode = output_modes[task]
+    # Load data features from cache or dataset file
+    cached_features_file = os.path.join(args.data_dir, 'cached_{}_{}_{}_{}'.format(
+        'dev' if evaluate else 'train',
+        list(filter(None, args.model_name_or_path.split('/'))).pop(),
+        str(args.max_seq_length),
+        str(task)))
+    # Columns of the features as .npy files that are memory-mapped instead of unpickled
+    cached_columns_dir = cached_features_file + '_columns'
+    columns = None
+    if os.path.isdir(cached_columns_dir):
+        logger.info("Loading features from cached columns %s", cached_columns_dir)
+    elif os.path.exists(cached_features_file):
+        # Pickled list of InputFeatures written by earlier versions
+        logger.info("Converting cached file %s to cached columns", cached_features_file)
+        columns = features_to_columns(torch.load(cached_features_file), output_mode)
+        if args.rank in [-1, 0]:
+            save_feature_columns(columns, cached_columns_dir)
+    else:
+        logger.info("Creating features from dataset file at %s", args.data_dir)
+        label_list = get_label_list(args, task, processor)
+        examples = processor.get_dev_examples(args.data_dir) if evaluate else processor.get_train_examples(args.data_dir)
+        features = convert_examples_to_features(examples, label_list, tokenizer=tokenizer, output_mode=output_mode,
+                                                num_workers=args.preprocessing_num_workers,
+                                                **convert_options(args, tokenizer))
+        columns = features_to_columns(features, output_mode)
+        if args.rank in [-1, 0]:
+            logger.info("Saving features into cached columns %s", cached_columns_dir)
+            save_feature_columns(columns, cached_columns_dir)
+
+    if args.rank == 0:
+        torch.distributed.barrier()  # Make sure only the first process in distributed training process the dataset, and the others will use the cache
+
+    # Map the cached columns into tensors; without a cache (e.g. it could not be written) use them from memory
+    if os.path.isdir(cached_columns_dir):
+        all_input_ids, all_input_mask, all_segment_ids, all_label_ids, all_lengths = load_feature_columns(cached_columns_dir)
+    else:
+        all_input_ids, all_input_mask, all_segment_ids, all_label_ids, all_lengths = [torch.from_numpy(c) for c in columns]
+
+    dataset = TensorDataset(all_input_ids, all_input_mask, all_segment_ids, all_label_ids, all_lengths)
+
+    # Keep only the part of the train set this rank trains on
+    if not evaluate and args.rank != -1 and args.shard_dataset != 'none':
+        start = time.time()
+        if args.shard_dataset == 'fixed':
+            dataset = fixed_shard(dataset, args.world_size, args.rank)
+        else:
+            dataset = EpochShardedDataset(dataset, args.world_size, args.rank)
+        logger.info("Materialised the train shard of rank %d in %.2f seconds", args.rank, time.time() - start)
+    return dataset
+
+
+def split_cores(nproc):
+    """Splits the cores this process may run on into `nproc` disjoint, contiguous sets."""
+    cores = sorted(os.sched_getaffinity(0))
+    if len(cores) < nproc:
+        # More workers than cores: share them round-robin
+        return [[cores[i % len(cores)]] for i in range(nproc)]
+    per_worker = len(cores) // nproc
+    return [cores[i * per_worker:(i + 1) * per_worker] for i in range(nproc)]
+
+
+def launch_worker(local_rank, args, cores):
+    """Entry point of a worker started by launch_local(); its output goes to output_dir/logs/rank_{local_rank}.log."""
+    log_file = open(os.path.join(args.output_dir, 'logs', f"rank_{local_rank}.log"), 'w', buffering=1)
+    sys.stdout = sys.stderr = log_file
+    if cores is not None:
+        os.sched_setaffinity(0, cores[local_rank])
+        if args.num_threads == 0:
+            args.num_threads = len(cores[local_rank])
+    args.local_rank = local_rank
+    run(args)
+
+
+def launch_local(args):
+    """Runs --nproc workers on this machine as one node of a tcp:// job and summarizes their timings."""
+    import torch.multiprocessing as mp
+
+    if os.path.exists(args.output_dir) and os.listdir(args.output_dir) and args.do_train and not args.overwrite_output_dir and not args.resume:
+        raise ValueError("Output directory ({}) already exists and is not empty. Use --overwrite_output_dir to overcome.".format(args.output_dir))
+    os.makedirs(os.path.join(args.output_dir, 'logs'), exist_ok=True)
+    # The workers' own check would trip over the log directory created above
+    args.overwrite_output_dir = True
+
+    args.master_ip, args.master_port = '127.0.0.1', str(find_free_port())
+    args.init_method, args.world_size, args.node_rank = 'tcp', 1, 0
+    args.nproc_per_node = args.nproc
+    cores = None if args.no_pin_cores else split_cores(args.nproc)
+    logging.basicConfig(format = '%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                        datefmt = '%m/%d/%Y %H:%M:%S',
+                        level = logging.INFO)
+    logger.info("Launching %d workers on %s:%s, logs in %s", args.nproc, args.master_ip, args.master_port,
+                os.path.join(args.output_dir, 'logs'))
+
+    start_time = time.time()
+    mp.spawn(launch_worker, args=(args, cores), nprocs=args.nproc)
+    wall_time = time.time() - start_time
+
+    # Collect the per-rank timing summaries written by train()
+    ranks = []
+    for rank in range(args.nproc):
+        summary_file = os.path.join(args.output_dir, f"train_summary_rank_{rank}.json")
+        if os.path.exists(summary_file):
+            with open(summary_file) as f:
+                summary = json.load(f)
+            summary['rank'] = rank
+            summary['cores'] = cores[rank] if cores is not None else None
+            ranks.append(summary)
+    launch_summary = {
+        'nproc': args.nproc,
+        'sync_strategy': args.sync_strategy,
+        'wall_time': wall_time,
+        'ranks': ranks,
+    }
+    if ranks:
+        launch_summary['max_avg_iteration_time'] = max(r['avg_iteration_time'] for r in ranks)
+        launch_summary['total_throughput'] = sum(r['throughput'] for r in ranks)
+    with open(os.path.join(args.output_dir, 'launch_summary.json'), 'w') as f:
+        json.dump(launch_summary, f, indent=2)
+
+    print("| rank | cores | avg step time (s) | avg epoch time (s) | throughput (examples/s) | comm time/step (s) |")
+    print("|---|---|---|---|---|---|")
+    for r in ranks:
+        print("| {} | {} | {:.4f} | {:.4f} | {:.2f} | {:.4f} |".format(
+            r['rank'], len(r['cores']) if r['cores'] is not None else 'all', r['avg_iteration_time'],
+            r['avg_epoch_time'], r['throughput'], r['avg_comm_time']))
+    if ranks:
+        logger.info("%d workers, %s: %.2f examples/sec in total, slowest average step %.4f s, wall time %.1f s",
+                    args.nproc, args.sync_strategy, launch_summary['total_throughput'],
+                    launch_summary['max_avg_iteration_time'], wall_time)
+
+
+def main(default_sync_strategy="allreduce"):
+    parser = argparse.ArgumentParser()
+
+    ## Required parameters
+    parser.add_argument("--data_dir", default=None, type=str, required=True,
+                        help="The input data dir. Should contain the .tsv files (or other data files) for the task.")
+    parser.add_argument("--model_type", default=None, type=str, required=True,
+                        help="Model type selected in the list: " + ", ".join(MODEL_CLASSES.keys()))
+    parser.add_argument("--model_name_or_path", default=None, type=str, required=True,
+                        help="Path to pre-trained model or shortcut name selected in the list: " + ", ".join(ALL_MODELS))
+    parser.add_argument("--task_name", default=None, type=str, required=True,
+                        help="The name of the task to train selected in the list: " + ", ".join(processors.keys()))
+    parser.add_argument("--output_dir", default=None, type=str, required=True,
+                        help="The output directory where the model predictions and checkpoints will be written.")
+
+    ## Other parameters
+    parser.add_argument("--config_name", default="", type=str,
+                        help="Pretrained config name or path if not the same as model_name")
+    parser.add_argument("--tokenizer_name", default="", type=str,
+                        help="Pretrained tokenizer name or path if not the same as model_name")
+    parser.add_argument("--cache_dir", default="", type=str,
+                        help="Where do you want to store the pre-trained models downloaded from s3")
+    parser.add_argument("--max_seq_length", default=128, type=int,
+                        help="The maximum total input sequence length after tokenization. Sequences longer "
+                             "than this will be truncated, sequences shorter will be padded.")
+    parser.add_argument("--dynamic_padding", action='store_true',
+                        help="Pad every batch to its longest sequence instead of --max_seq_length")
+    parser.add_argument("--group_by_length", action='store_true',
+                        help="Shuffle the training set into batches of similar lengths (use with --dynamic_padding)")
+    parser.add_argument("--max_tokens_per_batch", type=int, default=0,
+                        help="Build global batches of variable size with about this many padded tokens per rank, "
+                             "split so that ranks get near-equal token counts (requires --dynamic_padding); "
+                             "replaces --per_device_train_batch_size for training")
+    parser.add_argument("--shard_dataset", type=str, default="none", choices=["none", "fixed", "epoch"],
+                        help="Hold only part of the train set on every process: a fixed contiguous 1/world_size "
+                             "block shuffled within itself ('fixed'), or the examples of the global shuffle this "
+                             "process trains on, gathered again every epoch ('epoch', same batches as 'none')")
+    parser.add_argument("--streaming", action='store_true',
+                        help="Read and tokenize train.tsv lazily while training, sharded across processes and "
+                             "DataLoader workers and shuffled through a bounded buffer, instead of building the cache")
+    parser.add_argument("--stream_shuffle_buffer", type=int, default=10000,
+                        help="Examples in the shuffle buffer of every --streaming worker")
+    parser.add_argument("--stream_num_workers", type=int, default=1,
+                        help="DataLoader worker processes that tokenize the --streaming train set")
+    parser.add_argument("--preprocessing_num_workers", type=int, default=0,
+                        help="Tokenize the examples with this many processes when building the feature cache "
+                             "(same features as the serial path); 0 or 1 tokenizes serially")
+    parser.add_argument("--do_train", action='store_true',
+                        help="Whether to run training.")
+    parser.add_argument("--do_eval", action='store_true',
+                        help="Whether to run eval on the dev set.")
+    parser.add_argument("--do_lower_case", action='store_true',
+                        help="Set this flag if you are using an uncased model.")
+
+    parser.add_argument("--per_device_train_batch_size", default=8, type=int,
+                        help="Batch size per GPU/CPU for training.")
+    parser.add_argument("--per_device_eval_batch_size", default=8, type=int,
+                        help="Batch size per GPU/CPU for evaluation.")
+    parser.add_argument('--gradient_accumulation_steps', type=int, default=1,
+                        help="Number of updates steps to accumulate before performing a backward/update pass.")
+    parser.add_argument("--learning_rate", default=5e-5, type=float,
+                        help="The initial learning rate for Adam.")
+    parser.add_argument("--weight_decay", default=0.0, type=float,
+                        help="Weight deay if we apply some.")
+    parser.add_argument("--adam_epsilon", default=1e-8, type=float,
+                        help="Epsilon for Adam optimizer.")
+    parser.add_argument("--max_grad_norm", default=1.0, type=float,
+                        help="Max gradient norm.")
+    parser.add_argument("--optimizer", type=str, default="adamw", choices=OPTIMIZERS,
+                        help="AdamW, or the layer-wise adaptive LAMB (AdamW-scale --learning_rate) or LARS (SGD-scale "
+                             "--learning_rate) for global batches of 1k+ samples")
+    parser.add_argument("--lr_scaling", type=str, default="none", choices=LR_SCALING_RULES,
+                        help="Scale --learning_rate from --base_batch_size to the global batch size "
+                             "(per device x processes x accumulation): linearly or with the square root (usual for LAMB)")
+    parser.add_argument("--base_batch_size", type=int, default=64,
+                        help="Global batch size --learning_rate was tuned for, used by --lr_scaling")
+    parser.add_argument("--lars_momentum", type=float, default=0.9,
+                        help="Momentum of LARS")
+    parser.add_argument("--lars_trust_coefficient", type=float, default=0.001,
+                        help="Trust coefficient of the LARS per-layer learning rate")
+    parser.add_argument("--optimizer_backend", type=str, default="loop", choices=list(OPTIMIZER_BACKENDS.keys()),
+                        help="AdamW and gradient clipping implementation: per-parameter loop ('loop', pytorch_transformers) "
+                             "or multi-tensor torch._foreach_* updates ('foreach'), with the same results. "
+                             "The zero1 sync strategy always uses its own flat sharded AdamW")
+    parser.add_argument("--num_train_epochs", default=3.0, type=float,
+                        help="Total number of training epochs to perform.")
+    parser.add_argument("--max_steps", default=-1, type=int,
+                        help="If > 0: set total number of training steps to perform. Override num_train_epochs.")
+    parser.add_argument("--warmup_steps", default=0, type=int,
+                        help="Linear warmup over warmup_steps.")
+
+    # parser.add_argument("--eval_all_checkpoints", action='store_true',
+    #                     help="Evaluate all checkpoints starting with the same prefix as model_name ending and ending with step number")
+    parser.add_argument("--no_cuda", action='store_true',
+                        help="Avoid using CUDA when available")
+    parser.add_argument('--overwrite_output_dir', action='store_true',
+                        help="Overwrite the content of the output directory")
+    parser.add_argument('--overwrite_cache', action='store_true',
+                        help="Overwrite the cached training and evaluation sets")
+    parser.add_argument('--seed', type=int, default=42,
+                        help="random seed for initialization")
+
+    parser.add_argument('--fp16', action='store_true',
+                        help="Whether to use 16-bit (mixed) precision (through NVIDIA apex) instead of 32-bit")
+    parser.add_argument('--fp16_opt_level', type=str, default='O1',
+                        help="For fp16: Apex AMP optimization level selected in ['O0', 'O1', 'O2', and 'O3']."
+                             "See details at https://nvidia.github.io/apex/amp.html")
+    parser.add_argument("--init_method", type=str, default="tcp", choices=["tcp", "env"],
+                        help="Rendezvous: tcp://master_ip:master_port with the ranks given on the command line ('tcp'), "
+                             "or env:// with RANK, WORLD_SIZE, LOCAL_RANK and MASTER_ADDR/MASTER_PORT set by torchrun "
+                             "('env'). Combine 'env' with --resume and --save_steps for elastic training, e.g. "
+                             "torchrun --nnodes 1:4 --nproc_per_node 1 --max_restarts 3 --rdzv_backend c10d "
+                             "--rdzv_endpoint $ip_address:$port run_glue.py ... --init_method env --resume --save_steps 20")
+    parser.add_argument("--save_steps", type=int, default=0,
+                        help="Save the training state to output_dir/checkpoint-last every this many optimization steps")
+    parser.add_argument("--resume", action='store_true',
+                        help="Continue from output_dir/checkpoint-last if it exists, resharding the rest of the "
+                             "interrupted epoch across the current processes")
+    parser.add_argument("--local_rank", type=int, default=-1,
+                        help="For distributed training: local_rank. If single-node training, local_rank defaults to -1. "
+                             "With --nproc_per_node 1 this is the global rank, otherwise the process index on this node.")
+                        
+    # Additional distributed training parameters
+    parser.add_argument("--master_ip", type=str, default=None,
+                        help="IP address of main node")
+    parser.add_argument("--master_port", type=str, default=None,
+                        help="Port of main node")
+    parser.add_argument("--world_size", type=int, default=1,
+                        help="Num nodes in distributed training")
+    parser.add_argument("--nproc_per_node", type=int, default=1,
+                        help="Number of processes started on every node")
+    parser.add_argument("--node_rank", type=int, default=0,
+                        help="Index of this node; only used with --nproc_per_node > 1")
+    parser.add_argument("--nproc", type=int, default=0,
+                        help="Launch this many workers on this machine (on a free localhost port, each pinned to its "
+                             "own cores) instead of running a single process; see launch_local()")
+    parser.add_argument("--no_pin_cores", action='store_true',
+                        help="With --nproc, do not pin every worker to a disjoint set of cores")
+    parser.add_argument("--num_threads", type=int, default=0,
+                        help="torch threads per process; 0 splits the cores of the node between its processes")
+    parser.add_argument("--sync_strategy", type=str, default=default_sync_strategy, choices=list(SYNC_STRATEGIES.keys()),
+                        help="Gradient synchronization: none ('none'), gather to and scatter from rank 0 per parameter "
+                             "('gather_scatter'), sharded reduce-scatter + all_gather of flat buckets ('reduce_scatter'), "
+                             "one all_reduce per parameter ('allreduce'), one all_reduce per flat gradient bucket "
+                             "('bucketed'), bucketed async all_reduce launched from gradient hooks during the backward "
+                             "pass ('overlap'), all_gather of the top-k entries of every bucket ('topk'), node-local "
+                             "reduce + inter-node all_reduce among node leaders ('hierarchical'), periodic model "
+                             "averaging ('local_sgd'), asynchronous sharded parameter servers with bounded staleness "
+                             "('param_server'), reduce-scatter + AdamW state sharded across ranks ('zero1') or "
+                             "torch DistributedDataParallel ('ddp')")
+    parser.add_argument("--bucket_cap_mb", type=float, default=25.0,
+                        help="Maximum size in MB of a gradient bucket for the reduce_scatter, bucketed, overlap, topk, hierarchical, local_sgd and zero1 sync strategies")
+    parser.add_argument("--sparse_embedding_sync", action='store_true',
+                        help="Sync the word embedding gradients by all_gathering only their non-zero rows, and every "
+                             "other parameter with the sync strategy (gather_scatter, reduce_scatter, allreduce, "
+                             "bucketed, overlap, topk, hierarchical)")
+    parser.add_argument("--topk_density", type=float, default=0.01,
+                        help="Fraction of the entries of every bucket sent by the topk sync strategy")
+    parser.add_argument("--topk_warmup_steps", type=int, default=0,
+                        help="Number of initial steps synchronized densely before top-k sparsification starts")
+    parser.add_argument("--topk_residual", type=str, default="accumulate", choices=["accumulate", "drop"],
+                        help="Whether gradient entries that were not sent are accumulated locally for later steps")
+    parser.add_argument("--local_sgd_period", type=int, default=4,
+                        help="Number of local optimizer steps between two model averaging rounds of local SGD")
+    parser.add_argument("--local_sgd_schedule", type=str, default="",
+                        help="Optional local SGD period schedule as 'step:period,...', e.g. '0:2,200:8'")
+    parser.add_argument("--local_sgd_warmup_steps", type=int, default=0,
+                        help="Number of initial steps with per-step gradient all_reduce before local SGD starts (post-local SGD)")
+    parser.add_argument("--local_sgd_average_optimizer_state", action='store_true',
+                        help="Also average the AdamW moments when averaging the model")
+    parser.add_argument("--rebalance_steps", type=int, default=0,
+                        help="Every this many steps, split the global batch across ranks in proportion to their measured "
+                             "samples/second (straggler mitigation); 0 keeps per_device_train_batch_size on every rank. "
+                             "Not supported by the sync strategies that do not average gradients every step (none, "
+                             "local_sgd, param_server) or that communicate during the backward pass (ddp)")
+    parser.add_argument("--ps_num_servers", type=int, default=1,
+                        help="Number of parameter server processes (started on the rank 0 node) the parameters are sharded across")
+    parser.add_argument("--ps_port", type=int, default=None,
+                        help="First port of the parameter servers; defaults to master_port + 1")
+    parser.add_argument("--ps_staleness", type=int, default=2,
+                        help="Maximum number of steps a worker may run ahead of the slowest worker (SSP bound)")
+    parser.add_argument("--grad_compression", type=str, default="none", choices=["none", "fp16", "bf16", "int8"],
+                        help="Wire format used to communicate gradients; int8 uses one scale per bucket")
+    parser.add_argument("--no_error_feedback", action='store_true',
+                        help="Do not carry the compression error of low-precision or PowerSGD gradients over to the next step")
+    parser.add_argument("--log_comm", action='store_true',
+                        help="Record shape, dtype, bytes and latency of every collective and the network interface "
+                             "counters per epoch into comm_epochs_rank_*.csv/json and comm_collectives_rank_*.csv")
+    parser.add_argument("--net_interface", type=str, default=None,
+                        help="Network interface sampled from /proc/net/dev by --log_comm (e.g. the 10.10.1.* "
+                             "interface on CloudLab); defaults to the sum over all non-loopback interfaces")
+    parser.add_argument("--comm_hook", type=str, default="allreduce", choices=["allreduce", "powersgd"],
+                        help="DDP communication hook of the ddp sync strategy: dense all_reduce ('allreduce') or "
+                             "low-rank PowerSGD compression ('powersgd')")
+    parser.add_argument("--powersgd_rank", type=int, default=4,
+                        help="Rank of the PowerSGD low-rank approximation")
+    parser.add_argument("--powersgd_start_iter", type=int, default=10,
+                        help="Number of initial iterations that use the dense all_reduce before PowerSGD starts")
+    parser.add_argument("--no_powersgd_warm_start", action='store_true',
+                        help="Re-initialize the PowerSGD Q matrices every step instead of reusing them from the previous step")
+                        
+    args = parser.parse_args()
+
+    if args.nproc > 0:
+        launch_local(args)
+    else:
+        run(args)
+
+
+def run(args):
+    """Runs training and evaluation in this process for the parsed command line `args`."""
+    args.start_time = time.time()
+    if args.init_method == 'env':
+        # torchrun assigns the ranks; the world size may differ from one (re)start to the next
+        args.rank = int(os.environ['RANK'])
+        args.local_rank = int(os.environ['LOCAL_RANK'])
+        args.world_size = int(os.environ['WORLD_SIZE'])
+        args.nproc_per_node = int(os.environ.get('LOCAL_WORLD_SIZE', 1))
+        args.num_nodes = args.world_size // args.nproc_per_node
+        args.node_rank = args.rank // args.nproc_per_node
+    else:
+        # --world_size counts nodes; with several processes per node the global rank is derived from the node rank
+        args.num_nodes = args.world_size
+        args.world_size = args.num_nodes * args.nproc_per_node
+        if args.local_rank == -1:
+            args.rank = -1
+        elif args.nproc_per_node > 1:
+            args.rank = args.node_rank * args.nproc_per_node + args.local_rank
+        else:
+            args.rank = args.local_rank
+
+    # Without a process group there is nothing to synchronize
+    if args.rank == -1:
+        args.world_size = 1
+        args.sync_strategy = 'none'
+    if args.comm_hook != 'allreduce' and args.sync_strategy != 'ddp':
+        raise ValueError("--comm_hook is only supported with the ddp sync strategy")
+    sync = SYNC_STRATEGIES[args.sync_strategy](args)
+    if sum([args.rebalance_steps > 0, args.group_by_length, args.max_tokens_per_batch > 0]) > 1:
+        raise ValueError("Only one of --rebalance_steps, --group_by_length and --max_tokens_per_batch can choose the batches")
+    if args.shard_dataset != 'none' and (args.rebalance_steps > 0 or args.group_by_length
+                                         or args.max_tokens_per_batch > 0 or args.streaming):
+        raise ValueError("--shard_dataset cannot be combined with --rebalance_steps, --group_by_length, "
+                         "--max_tokens_per_batch or --streaming, which sample from the whole train set")
+    if args.streaming and (args.rebalance_steps > 0 or args.group_by_length or args.max_tokens_per_batch > 0
+                           or args.save_steps > 0 or args.resume):
+        raise ValueError("--streaming reads the train set in order and cannot be combined with --rebalance_steps, "
+                         "--group_by_length, --max_tokens_per_batch, --save_steps or --resume")
+    if args.max_tokens_per_batch > 0 and not args.dynamic_padding:
+        raise ValueError("--max_tokens_per_batch requires --dynamic_padding")
+    if args.rebalance_steps > 0 and not sync.averages_gradients:
+        raise ValueError("--rebalance_steps requires a sync strategy that averages gradients every step")
+    if args.max_tokens_per_batch > 0 and not sync.averages_gradients:
+        # Per-rank losses are weighted by their share of the global batch, which is only right if the
+        # gradients are averaged over the ranks every step
+        raise ValueError("--max_tokens_per_batch requires a sync strategy that averages gradients every step")
+    if args.rebalance_steps > 0 and sync.communicates_in_backward:
+        # The rebalancer times forward + backward; a backward that blocks on the all-reduce makes every rank
+        # look as slow as the slowest one, so the measured rates carry no signal
+        raise ValueError("--rebalance_steps cannot be combined with the {} sync strategy, which communicates "
+                         "during the backward pass".format(args.sync_strategy))
+    if (args.save_steps > 0 or args.resume) and not sync.supports_checkpoint:
+        raise ValueError("The {} sync strategy does not support --save_steps and --resume".format(args.sync_strategy))
+
+    if os.path.exists(args.output_dir) and os.listdir(args.output_dir) and args.do_train and not args.overwrite_output_dir and not args.resume:
+        raise ValueError("Output directory ({}) already exists and is not empty. Use --overwrite_output_dir to overcome.".format(args.output_dir))
+
+    # Initialize the distributed environment
+    if args.rank != -1:
+        if args.init_method == 'env':
+            init_method = "env://"
+            # The parameter servers are started next to the rendezvous master
+            args.master_ip, args.master_port = os.environ['MASTER_ADDR'], os.environ['MASTER_PORT']
+        elif args.master_ip is None or args.master_port is None:
+            raise ValueError("For distributed training, master_ip and master_port must be specified")
+        else:
+            init_method = f"tcp://{args.master_ip}:{args.master_port}"
+
+        # Initialize the process group
+        torch.distributed.init_process_group(
+            backend='gloo',  # Use 'gloo' backend for CPU, 'nccl' for GPU
+            init_method=init_method,
+            world_size=args.world_size,
+            rank=args.rank
+        )
+        logger.info(f"Initialized process group: rank={args.rank}, world_size={args.world_size}")
+
+        # Split the cores of the node between its processes
+        if args.num_threads > 0:
+            torch.set_num_threads(args.num_threads)
+        elif args.nproc_per_node > 1:
+            torch.set_num_threads(max(1, os.cpu_count() // args.nproc_per_node))
+
+    # set up (distributed) training
+    args.device = torch.device("cuda" if torch.cuda.is_available() and not args.no_cuda else "cpu")
+    args.n_gpu = torch.cuda.device_count() if not args.no_cuda else 0
+
+    # Setup logging
+    logging.basicConfig(format = '%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                        datefmt = '%m/%d/%Y %H:%M:%S',
+                        level = logging.INFO)
+    logger.warning("Process rank: %s, device: %s, distributed training: %s, 16-bits training: %s",
+                    args.rank, args.device, bool(args.rank != -1), args.fp16)
+
+    # Scale the learning rate tuned for --base_batch_size to the actual global batch size
+    if args.lr_scaling != 'none':
+        global_batch_size = args.per_device_train_batch_size * args.world_size * args.gradient_accumulation_steps
+        base_learning_rate = args.learning_rate
+        args.learning_rate = scaled_learning_rate(base_learning_rate, global_batch_size, args.base_batch_size,
+                                                  args.lr_scaling)
+        logger.info("Scaled learning rate (%s rule) for global batch size %d: %g -> %g", args.lr_scaling,
+                    global_batch_size, base_learning_rate, args.learning_rate)
+
+    # Set seed
+    set_seed(args)
+
+    # Prepare GLUE task
+    args.task_name = args.task_name.lower()
+    if args.task_name not in processors:
+        raise ValueError("Task not found: %s" % (args.task_name))
+    processor = processors[args.task_name]()
+    args.output_mode = output_modes[args.task_name]
+    label_list = processor.get_labels()
+    num_labels = len(label_list)
+
+    # Load pretrained model and tokenizer
+    if args.rank not in [-1, 0]:
+        torch.distributed.barrier()  # Make sure only the first process in distributed training will download model & vocab
+
+    args.model_type = args.model_type.lower()
+    config_class, model_class, tokenizer_class = MODEL_CLASSES[args.model_type]
+    config = config_class.from_pretrained(args.config_name if args.config_name else args.model_name_or_path, num_labels=num_labels, finetuning_task=args.task_name)
+    tokenizer = tokenizer_class.from_pretrained(args.tokenizer_name if args.tokenizer_name else args.model_name_or_path, do_lower_case=args.do_lower_case)
+    
+    ##################################################
+    # TODO(cos568): load the model using from_pretrained. Remember to pass in `config` as an argument.
+    # If you pass in args.model_name_or_path (e.g. "bert-base-cased"), the model weights file will be downloaded from HuggingFace. (expect one line of code)
+    model = model_class.from_pretrained(args.model_name_or_path, config=config)
+
+    if args.rank == 0:
+        torch.distributed.barrier()  # Make sure only the first process in distributed training will download model & vocab
+
+    model.to(args.device)
+    model = sync.wrap_model(model)
+
+    logger.info("Training/evaluation parameters %s", args)
+
+    # Training
+    if args.do_train:
+        if args.streaming:
+            train_dataset = load_streaming_examples(args, args.task_name, tokenizer)
+        else:
+            train_dataset = load_and_cache_examples(args, args.task_name, tokenizer, evaluate=False)
+        global_step, tr_loss = train(args, train_dataset, model, tokenizer, sync)
+        logger.info(" global_step = %s, average loss = %s", global_step, tr_loss)
+        
+        # Save model after training
+        if args.rank == -1 or args.rank == 0:  # Save model only on master process
+            # Create output directory if needed
+            if not os.path.exists(args.output_dir):
+                os.makedirs(args.output_dir)
+
+            logger.info("Saving model checkpoint to %s", args.output_dir)
+            # Save a trained model, configuration and tokenizer using `save_pretrained()`.
+            # They can then be reloaded using `from_pretrained()`
+            model_to_save = model.module if hasattr(model, 'module') else model  # Take care of distributed/parallel training
+            model_to_save.save_pretrained(args.output_dir)
+            tokenizer.save_pretrained(args.output_dir)
+
+            # Good practice: save your training arguments together with the trained model
+            torch.save(args, os.path.join(args.output_dir, 'training_args.bin'))
+
+    # Evaluation - all nodes evaluate
+    if args.do_eval:
+        # Make sure data is loaded properly on all nodes
+        if args.rank != -1:
+            torch.distributed.barrier()
+        evaluate(args, model, tokenizer, prefix="final")
+        if args.rank != -1:
+            torch.distributed.barrier()
+    
+    # Clean up the distributed environment
+    if args.rank != -1:
+        logger.info("Destroying process group...")
+        torch.distributed.destroy_process_group()
+        logger.info("Process group destroyed")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
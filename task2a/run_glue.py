@@ -1,591 +1,20 @@
 # coding=utf-8
-# Copyright 2018 The Google AI Language Team Authors and The HuggingFace Inc. team.
-# Copyright (c) 2018, NVIDIA CORPORATION.  All rights reserved.
-#
-# Licensed under the Apache License, Version 2.0 (the "License");
-# you may not use this file except in compliance with the License.
-# You may obtain a copy of the License at
-#
-#     http://www.apache.org/licenses/LICENSE-2.0
-#
-# Unless required by applicable law or agreed to in writing, software
-# distributed under the License is distributed on an "AS IS" BASIS,
-# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
-# See the License for the specific language governing permissions and
-# limitations under the License.
-""" Finetuning the library models for sequence classification on GLUE (Bert, XLM, XLNet, RoBERTa)."""
+""" Task 2(a): distributed fine-tuning with gradients averaged through gather and scatter on rank 0.
+
+The training code is shared by all tasks and lives in run_glue.py in the repository root; this script
+only selects the default --sync_strategy ('gather_scatter'), so any other strategy can still be chosen on the
+command line.
+"""
 
 from __future__ import absolute_import, division, print_function
 
-import argparse
-import glob
-import logging
 import os
 import sys
-import random
-import time
-import json
-from datetime import datetime
-
-import numpy as np
-import torch
-from torch.utils.data import (DataLoader, RandomSampler, SequentialSampler,
-                              TensorDataset)
-from torch.utils.data.distributed import DistributedSampler
-from tqdm import tqdm, trange
-
-# import a previous version of the HuggingFace Transformers package
-from pytorch_transformers import (WEIGHTS_NAME, BertConfig,
-                                  BertForSequenceClassification, BertTokenizer,
-                                  RobertaConfig,
-                                  RobertaForSequenceClassification,
-                                  RobertaTokenizer,
-                                  XLMConfig, XLMForSequenceClassification,
-                                  XLMTokenizer, XLNetConfig,
-                                  XLNetForSequenceClassification,
-                                  XLNetTokenizer)
-
-from pytorch_transformers import AdamW, WarmupLinearSchedule
-
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-
-from utils_glue import (compute_metrics, convert_examples_to_features,
-                        output_modes, processors)
-
-logger = logging.getLogger(__name__)
-
-ALL_MODELS = sum((tuple(conf.pretrained_config_archive_map.keys()) for conf in (BertConfig, XLNetConfig, XLMConfig, RobertaConfig)), ())
-
-MODEL_CLASSES = {
-    'bert': (BertConfig, BertForSequenceClassification, BertTokenizer),
-    'xlnet': (XLNetConfig, XLNetForSequenceClassification, XLNetTokenizer),
-    'xlm': (XLMConfig, XLMForSequenceClassification, XLMTokenizer),
-    'roberta': (RobertaConfig, RobertaForSequenceClassification, RobertaTokenizer),
-}
-
-
-def set_seed(args):
-    random.seed(args.seed)
-    np.random.seed(args.seed)
-    torch.manual_seed(args.seed)
-    torch.backends.cudnn.deterministic = True
-    torch.backends.cudnn.benchmark = False
-    torch.cuda.manual_seed_all(args.seed)
-
-
-def train(args, train_dataset, model, tokenizer):
-    """ Train the model """
-    args.train_batch_size = args.per_device_train_batch_size
-    
-    # Use distributed sampler if we're in distributed mode
-    if args.local_rank != -1:
-        train_sampler = DistributedSampler(train_dataset)
-    else:
-        train_sampler = RandomSampler(train_dataset)
-        
-    train_dataloader = DataLoader(train_dataset, sampler=train_sampler, batch_size=args.train_batch_size)
-    
-    # Initialize loss logging
-    loss_log = []
-    total_loss = 0.0
-
-    if args.max_steps > 0:
-        t_total = args.max_steps
-        args.num_train_epochs = args.max_steps // (len(train_dataloader) // args.gradient_accumulation_steps) + 1
-    else:
-        t_total = len(train_dataloader) // args.gradient_accumulation_steps * args.num_train_epochs
-
-    # Prepare optimizer and schedule (linear warmup and decay)
-    no_decay = ['bias', 'LayerNorm.weight']
-    optimizer_grouped_parameters = [
-        {'params': [p for n, p in model.named_parameters() if not any(nd in n for nd in no_decay)], 'weight_decay': args.weight_decay},
-        {'params': [p for n, p in model.named_parameters() if any(nd in n for nd in no_decay)], 'weight_decay': 0.0}
-        ]
-    optimizer = AdamW(optimizer_grouped_parameters, lr=args.learning_rate, eps=args.adam_epsilon)
-    scheduler = WarmupLinearSchedule(optimizer, warmup_steps=args.warmup_steps, t_total=t_total)
-    if args.fp16:
-        try:
-            from apex import amp
-        except ImportError:
-            raise ImportError("Please install apex from https://www.github.com/nvidia/apex to use fp16 training.")
-        model, optimizer = amp.initialize(model, optimizer, opt_level=args.fp16_opt_level)
-
-    # Train!
-    logger.info("***** Running training *****")
-    logger.info("  Num examples = %d", len(train_dataset))
-    logger.info("  Num Epochs = %d", args.num_train_epochs)
-    logger.info("  Instantaneous batch size per device = %d", args.per_device_train_batch_size)
-    logger.info("  Total train batch size (w. parallel, distributed & accumulation) = %d",
-                   args.train_batch_size * args.gradient_accumulation_steps * (torch.distributed.get_world_size() if args.local_rank != -1 else 1))
-    logger.info("  Gradient Accumulation steps = %d", args.gradient_accumulation_steps)
-    logger.info("  Total optimization steps = %d", t_total)
-
-    global_step = 0
-    tr_loss, logging_loss = 0.0, 0.0
-    model.zero_grad()
-    train_iterator = trange(int(args.num_train_epochs), desc="Epoch", disable=args.local_rank not in [-1, 0])
-    set_seed(args)  # Added here for reproductibility (even between python 2 and 3)
-    epoch = 0
-    
-    # Initialize timers
-    epoch_times = []
-    
-    for _ in train_iterator:
-        epoch += 1
-        epoch_start_time = time.time()
-        epoch_iterator = tqdm(train_dataloader, desc="Iteration", disable=args.local_rank not in [-1, 0])
-        
-        for step, batch in enumerate(epoch_iterator):
-            # Skip timing for the first batch as it includes compilation time
-            if epoch == 1 and step == 0:
-                iteration_start_time = time.time()
-                
-            model.train()
-            batch = tuple(t.to(args.device) for t in batch)
-            inputs = {'input_ids':      batch[0],
-                      'attention_mask': batch[1],
-                      'token_type_ids': batch[2] if args.model_type in ['bert', 'xlnet'] else None,  # XLM don't use segment_ids
-                      'labels':         batch[3]}
-            outputs = model(**inputs)
-            loss = outputs[0]  # model outputs are always tuple in pytorch-transformers (see doc)
-
-            if args.gradient_accumulation_steps > 1:
-                loss = loss / args.gradient_accumulation_steps
-
-            if args.fp16:
-                with amp.scale_loss(loss, optimizer) as scaled_loss:
-                    scaled_loss.backward()
-            else:
-                # Backward pass
-                loss.backward()
-
-            # Log the loss for every step
-            current_loss = loss.item()
-            tr_loss += current_loss
-            total_loss += current_loss
-            
-            # Add to loss log with step information and cumulative loss
-            loss_log.append({
-                'epoch': epoch,
-                'step': step,
-                'global_step': global_step,
-                'step_loss': current_loss,
-                'total_loss': total_loss,
-                'avg_loss': total_loss / (global_step + 1) if global_step > 0 else total_loss,
-                'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
-            
-            if (step + 1) % args.gradient_accumulation_steps == 0:
-                # Print out the loss for the first 5 steps
-                if step < 5:
-                    print('Epoch: {}, Step: {}, Step Loss: {}, Total Loss: {}'.format(
-                        epoch, step, current_loss, total_loss))
-                
-                # Implement gradient synchronization with gather and scatter
-                if args.local_rank != -1:
-                    # Gradient synchronization logic
-                    # Gather, average, and scatter gradients 
-                    for param in model.parameters():
-                        if param.requires_grad and param.grad is not None:
-                            # Create tensor list to hold gradients from all processes
-                            gather_list = [torch.zeros_like(param.grad) for _ in range(args.world_size)]
-                            
-                            # Gather gradients from all processes to process 0
-                            torch.distributed.gather(param.grad, gather_list if args.local_rank == 0 else None, dst=0)
-                            
-                            # Process 0 computes the average
-                            if args.local_rank == 0:
-                                # Element-wise sum of all gradients
-                                avg_grad = torch.zeros_like(param.grad)
-                                for grad in gather_list:
-                                    avg_grad += grad
-                                # Divide by world_size to get the average
-                                avg_grad /= args.world_size
-                                # Prepare list for scattering
-                                scatter_list = [avg_grad for _ in range(args.world_size)]
-                            else:
-                                scatter_list = None
-                            
-                            # Scatter the average gradient back to all processes
-                            torch.distributed.scatter(param.grad, scatter_list if args.local_rank == 0 else None, src=0)
-                    
-                    # Synchronize all processes after gradient update
-                    torch.distributed.barrier()
-                
-                if args.fp16:
-                    torch.nn.utils.clip_grad_norm_(amp.master_params(optimizer), args.max_grad_norm)
-                else:
-                    torch.nn.utils.clip_grad_norm_(model.parameters(), args.max_grad_norm)
-                
-                # Perform optimizer step
-                optimizer.step()
-                scheduler.step()  # Update learning rate schedule
-                model.zero_grad()
-                global_step += 1
-                
-                # Record iteration time for all iterations except first one
-                if epoch == 1 and step == 0:
-                    iteration_time = time.time() - iteration_start_time
-                    print(f"First iteration time (excluded from average): {iteration_time:.4f} seconds")
-                    iteration_start_time = time.time()
-                elif epoch == 1 and step == 1:
-                    # Start measuring average iteration time from the second iteration
-                    iteration_times = [time.time() - iteration_start_time]
-                    iteration_start_time = time.time()
-                elif epoch == 1 and step > 1:
-                    iteration_times.append(time.time() - iteration_start_time)
-                    iteration_start_time = time.time()
-
-            if args.max_steps > 0 and global_step > args.max_steps:
-                epoch_iterator.close()
-                break
-                
-        # Record epoch time
-        epoch_end_time = time.time()
-        epoch_time = epoch_end_time - epoch_start_time
-        epoch_times.append(epoch_time)
-        logger.info(f"Epoch {epoch} completed in {epoch_time:.4f} seconds")
-        
-        if args.max_steps > 0 and global_step > args.max_steps:
-            train_iterator.close()
-            break
-        
-        # Call evaluate() after every epoch
-        evaluate(args, model, tokenizer, prefix=str(epoch))
-    
-    # Print average iteration time
-    avg_iteration_time = sum(iteration_times) / len(iteration_times)
-    logger.info(f"Average iteration time (excluding first iteration): {avg_iteration_time:.4f} seconds")
-
-    # Also just log each iteration time
-    for i, time_val in enumerate(iteration_times):
-        logger.info(f"Iteration {i + 1} time: {time_val:.4f} seconds")
-    
-    # Print average epoch time
-    avg_epoch_time = sum(epoch_times) / len(epoch_times)
-    logger.info(f"Average epoch time: {avg_epoch_time:.4f} seconds")
-    
-    # Save the loss log to a file
-    if args.local_rank != -1:
-        loss_log_file = os.path.join(args.output_dir, f"loss_log_rank_{args.local_rank}.json")
-    else:
-        loss_log_file = os.path.join(args.output_dir, "loss_log.json")
-        
-    os.makedirs(args.output_dir, exist_ok=True)
-    with open(loss_log_file, 'w') as f:
-        json.dump(loss_log, f, indent=2)
-    logger.info(f"Loss log saved to {loss_log_file}")
-
-    # Also just log all the total losses
-    for i, entry in enumerate(loss_log):
-        logger.info(f"Epoch {entry['epoch']}, Step {entry['step']}, Global Step {entry['global_step']}, Total Loss: {entry['total_loss']}")
-
-    return global_step, tr_loss / global_step
-
-
-def evaluate(args, model, tokenizer, prefix=""):
-    # Loop to handle MNLI double evaluation (matched, mis-matched)
-    eval_task_names = ("mnli", "mnli-mm") if args.task_name == "mnli" else (args.task_name,)
-    eval_outputs_dirs = (args.output_dir, args.output_dir + '-MM') if args.task_name == "mnli" else (args.output_dir,)
-
-    results = {}
-    for eval_task, eval_output_dir in zip(eval_task_names, eval_outputs_dirs):
-        eval_dataset = load_and_cache_examples(args, eval_task, tokenizer, evaluate=True)
-
-        # Create node-specific output directory
-        if args.local_rank != -1:
-            node_output_dir = os.path.join(eval_output_dir, f"rank_{args.local_rank}")
-        else:
-            node_output_dir = eval_output_dir
-            
-        if not os.path.exists(node_output_dir):
-            os.makedirs(node_output_dir)
-
-        args.eval_batch_size = args.per_device_eval_batch_size
-        # Note that DistributedSampler samples randomly
-        eval_sampler = SequentialSampler(eval_dataset)
-        eval_dataloader = DataLoader(eval_dataset, sampler=eval_sampler, batch_size=args.eval_batch_size)
-
-        # Eval!
-        logger.info("***** Running evaluation {} for rank {} *****".format(prefix, args.local_rank))
-        logger.info("  Num examples = %d", len(eval_dataset))
-        logger.info("  Batch size = %d", args.eval_batch_size)
-        eval_loss = 0.0
-        nb_eval_steps = 0
-        preds = None
-        out_label_ids = None
-        for batch in tqdm(eval_dataloader, desc="Evaluating"):
-            model.eval()
-            batch = tuple(t.to(args.device) for t in batch)
-
-            with torch.no_grad():
-                inputs = {'input_ids':      batch[0],
-                          'attention_mask': batch[1],
-                          'token_type_ids': batch[2] if args.model_type in ['bert', 'xlnet'] else None,  # XLM and RoBERTa don't use segment_ids
-                          'labels':         batch[3]}
-                outputs = model(**inputs)
-                tmp_eval_loss, logits = outputs[:2]
-
-                eval_loss += tmp_eval_loss.mean().item()
-            nb_eval_steps += 1
-            if preds is None:
-                preds = logits.detach().cpu().numpy()
-                out_label_ids = inputs['labels'].detach().cpu().numpy()
-            else:
-                preds = np.append(preds, logits.detach().cpu().numpy(), axis=0)
-                out_label_ids = np.append(out_label_ids, inputs['labels'].detach().cpu().numpy(), axis=0)
-
-        eval_loss = eval_loss / nb_eval_steps
-        if args.output_mode == "classification":
-            preds = np.argmax(preds, axis=1)
-        elif args.output_mode == "regression":
-            preds = np.squeeze(preds)
-        result = compute_metrics(eval_task, preds, out_label_ids)
-        results.update(result)
-
-        # Save to node-specific output file
-        output_eval_file = os.path.join(node_output_dir, f"eval_results_{prefix}.txt")
-        with open(output_eval_file, "w") as writer:
-            logger.info("***** Eval results {} for rank {} *****".format(prefix, args.local_rank))
-            for key in sorted(result.keys()):
-                logger.info("  %s = %s", key, str(result[key]))
-                writer.write("%s = %s\n" % (key, str(result[key])))
-
-    return results
-
-
-def load_and_cache_examples(args, task, tokenizer, evaluate=False):
-    if args.local_rank not in [-1, 0]:
-        torch.distributed.barrier()  # Make sure only the first process in distributed training process the dataset, and the others will use the cache
-
-    processor = processors[task]()
-    output_mode = output_modes[task]
-    # Load data features from cache or dataset file
-    cached_features_file = os.path.join(args.data_dir, 'cached_{}_{}_{}_{}'.format(
-        'dev' if evaluate else 'train',
-        list(filter(None, args.model_name_or_path.split('/'))).pop(),
-        str(args.max_seq_length),
-        str(task)))
-    if os.path.exists(cached_features_file):
-        logger.info("Loading features from cached file %s", cached_features_file)
-        features = torch.load(cached_features_file)
-    else:
-        logger.info("Creating features from dataset file at %s", args.data_dir)
-        label_list = processor.get_labels()
-        if task in ['mnli', 'mnli-mm'] and args.model_type in ['roberta']:
-            # HACK(label indices are swapped in RoBERTa pretrained model)
-            label_list[1], label_list[2] = label_list[2], label_list[1] 
-        examples = processor.get_dev_examples(args.data_dir) if evaluate else processor.get_train_examples(args.data_dir)
-        features = convert_examples_to_features(examples, label_list, args.max_seq_length, tokenizer, output_mode,
-            cls_token_at_end=bool(args.model_type in ['xlnet']),            # xlnet has a cls token at the end
-            cls_token=tokenizer.cls_token,
-            cls_token_segment_id=2 if args.model_type in ['xlnet'] else 0,
-            sep_token=tokenizer.sep_token,
-            sep_token_extra=bool(args.model_type in ['roberta']),           # roberta uses an extra separator b/w pairs of sentences, cf. github.com/pytorch/fairseq/commit/1684e166e3da03f5b600dbb7855cb98ddfcd0805
-            pad_on_left=bool(args.model_type in ['xlnet']),                 # pad on the left for xlnet
-            pad_token=tokenizer.convert_tokens_to_ids([tokenizer.pad_token])[0],
-            pad_token_segment_id=4 if args.model_type in ['xlnet'] else 0,
-        )
-        if args.local_rank in [-1, 0]:
-            logger.info("Saving features into cached file %s", cached_features_file)
-            torch.save(features, cached_features_file)
-
-    if args.local_rank == 0:
-        torch.distributed.barrier()  # Make sure only the first process in distributed training process the dataset, and the others will use the cache
-
-    # Convert to Tensors and build dataset
-    all_input_ids = torch.tensor([f.input_ids for f in features], dtype=torch.long)
-    all_input_mask = torch.tensor([f.input_mask for f in features], dtype=torch.long)
-    all_segment_ids = torch.tensor([f.segment_ids for f in features], dtype=torch.long)
-    if output_mode == "classification":
-        all_label_ids = torch.tensor([f.label_id for f in features], dtype=torch.long)
-    elif output_mode == "regression":
-        all_label_ids = torch.tensor([f.label_id for f in features], dtype=torch.float)
-
-    dataset = TensorDataset(all_input_ids, all_input_mask, all_segment_ids, all_label_ids)
-    return dataset
-
-
-def main():
-    parser = argparse.ArgumentParser()
-
-    ## Required parameters
-    parser.add_argument("--data_dir", default=None, type=str, required=True,
-                        help="The input data dir. Should contain the .tsv files (or other data files) for the task.")
-    parser.add_argument("--model_type", default=None, type=str, required=True,
-                        help="Model type selected in the list: " + ", ".join(MODEL_CLASSES.keys()))
-    parser.add_argument("--model_name_or_path", default=None, type=str, required=True,
-                        help="Path to pre-trained model or shortcut name selected in the list: " + ", ".join(ALL_MODELS))
-    parser.add_argument("--task_name", default=None, type=str, required=True,
-                        help="The name of the task to train selected in the list: " + ", ".join(processors.keys()))
-    parser.add_argument("--output_dir", default=None, type=str, required=True,
-                        help="The output directory where the model predictions and checkpoints will be written.")
-
-    ## Other parameters
-    parser.add_argument("--config_name", default="", type=str,
-                        help="Pretrained config name or path if not the same as model_name")
-    parser.add_argument("--tokenizer_name", default="", type=str,
-                        help="Pretrained tokenizer name or path if not the same as model_name")
-    parser.add_argument("--cache_dir", default="", type=str,
-                        help="Where do you want to store the pre-trained models downloaded from s3")
-    parser.add_argument("--max_seq_length", default=128, type=int,
-                        help="The maximum total input sequence length after tokenization. Sequences longer "
-                             "than this will be truncated, sequences shorter will be padded.")
-    parser.add_argument("--do_train", action='store_true',
-                        help="Whether to run training.")
-    parser.add_argument("--do_eval", action='store_true',
-                        help="Whether to run eval on the dev set.")
-    parser.add_argument("--do_lower_case", action='store_true',
-                        help="Set this flag if you are using an uncased model.")
-
-    parser.add_argument("--per_device_train_batch_size", default=8, type=int,
-                        help="Batch size per GPU/CPU for training.")
-    parser.add_argument("--per_device_eval_batch_size", default=8, type=int,
-                        help="Batch size per GPU/CPU for evaluation.")
-    parser.add_argument('--gradient_accumulation_steps', type=int, default=1,
-                        help="Number of updates steps to accumulate before performing a backward/update pass.")
-    parser.add_argument("--learning_rate", default=5e-5, type=float,
-                        help="The initial learning rate for Adam.")
-    parser.add_argument("--weight_decay", default=0.0, type=float,
-                        help="Weight deay if we apply some.")
-    parser.add_argument("--adam_epsilon", default=1e-8, type=float,
-                        help="Epsilon for Adam optimizer.")
-    parser.add_argument("--max_grad_norm", default=1.0, type=float,
-                        help="Max gradient norm.")
-    parser.add_argument("--num_train_epochs", default=3.0, type=float,
-                        help="Total number of training epochs to perform.")
-    parser.add_argument("--max_steps", default=-1, type=int,
-                        help="If > 0: set total number of training steps to perform. Override num_train_epochs.")
-    parser.add_argument("--warmup_steps", default=0, type=int,
-                        help="Linear warmup over warmup_steps.")
-
-    # parser.add_argument("--eval_all_checkpoints", action='store_true',
-    #                     help="Evaluate all checkpoints starting with the same prefix as model_name ending and ending with step number")
-    parser.add_argument("--no_cuda", action='store_true',
-                        help="Avoid using CUDA when available")
-    parser.add_argument('--overwrite_output_dir', action='store_true',
-                        help="Overwrite the content of the output directory")
-    parser.add_argument('--overwrite_cache', action='store_true',
-                        help="Overwrite the cached training and evaluation sets")
-    parser.add_argument('--seed', type=int, default=42,
-                        help="random seed for initialization")
-
-    parser.add_argument('--fp16', action='store_true',
-                        help="Whether to use 16-bit (mixed) precision (through NVIDIA apex) instead of 32-bit")
-    parser.add_argument('--fp16_opt_level', type=str, default='O1',
-                        help="For fp16: Apex AMP optimization level selected in ['O0', 'O1', 'O2', and 'O3']."
-                             "See details at https://nvidia.github.io/apex/amp.html")
-    parser.add_argument("--local_rank", type=int, default=-1,
-                        help="For distributed training: local_rank. If single-node training, local_rank defaults to -1.")
-                        
-    # Additional distributed training parameters
-    parser.add_argument("--master_ip", type=str, default=None,
-                        help="IP address of main node")
-    parser.add_argument("--master_port", type=str, default=None,
-                        help="Port of main node")
-    parser.add_argument("--world_size", type=int, default=1,
-                        help="Num nodes in distributed training")
-                        
-    args = parser.parse_args()
-
-    if os.path.exists(args.output_dir) and os.listdir(args.output_dir) and args.do_train and not args.overwrite_output_dir:
-        raise ValueError("Output directory ({}) already exists and is not empty. Use --overwrite_output_dir to overcome.".format(args.output_dir))
-
-    # Initialize the distributed environment
-    if args.local_rank != -1:
-        if args.master_ip is None or args.master_port is None:
-            raise ValueError("For distributed training, master_ip and master_port must be specified")
-        
-        # Initialize the process group
-        init_method = f"tcp://{args.master_ip}:{args.master_port}"
-        torch.distributed.init_process_group(
-            backend='gloo',  # Use 'gloo' backend for CPU, 'nccl' for GPU
-            init_method=init_method,
-            world_size=args.world_size,
-            rank=args.local_rank
-        )
-        logger.info(f"Initialized process group: rank={args.local_rank}, world_size={args.world_size}")
-
-    # set up (distributed) training
-    args.device = torch.device("cuda" if torch.cuda.is_available() and not args.no_cuda else "cpu")
-    args.n_gpu = torch.cuda.device_count() if not args.no_cuda else 0
-
-    # Setup logging
-    logging.basicConfig(format = '%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
-                        datefmt = '%m/%d/%Y %H:%M:%S',
-                        level = logging.INFO)
-    logger.warning("Process rank: %s, device: %s, distributed training: %s, 16-bits training: %s",
-                    args.local_rank, args.device, bool(args.local_rank != -1), args.fp16)
-
-    # Set seed
-    set_seed(args)
-
-    # Prepare GLUE task
-    args.task_name = args.task_name.lower()
-    if args.task_name not in processors:
-        raise ValueError("Task not found: %s" % (args.task_name))
-    processor = processors[args.task_name]()
-    args.output_mode = output_modes[args.task_name]
-    label_list = processor.get_labels()
-    num_labels = len(label_list)
-
-    # Load pretrained model and tokenizer
-    if args.local_rank not in [-1, 0]:
-        torch.distributed.barrier()  # Make sure only the first process in distributed training will download model & vocab
-
-    args.model_type = args.model_type.lower()
-    config_class, model_class, tokenizer_class = MODEL_CLASSES[args.model_type]
-    config = config_class.from_pretrained(args.config_name if args.config_name else args.model_name_or_path, num_labels=num_labels, finetuning_task=args.task_name)
-    tokenizer = tokenizer_class.from_pretrained(args.tokenizer_name if args.tokenizer_name else args.model_name_or_path, do_lower_case=args.do_lower_case)
-    
-    ##################################################
-    # TODO(cos568): load the model using from_pretrained. Remember to pass in `config` as an argument.
-    # If you pass in args.model_name_or_path (e.g. "bert-base-cased"), the model weights file will be downloaded from HuggingFace. (expect one line of code)
-    model = model_class.from_pretrained(args.model_name_or_path, config=config)
-
-    if args.local_rank == 0:
-        torch.distributed.barrier()  # Make sure only the first process in distributed training will download model & vocab
-
-    model.to(args.device)
-
-    logger.info("Training/evaluation parameters %s", args)
-
-    # Training
-    if args.do_train:
-        train_dataset = load_and_cache_examples(args, args.task_name, tokenizer, evaluate=False)
-        global_step, tr_loss = train(args, train_dataset, model, tokenizer)
-        logger.info(" global_step = %s, average loss = %s", global_step, tr_loss)
-        
-        # Save model after training
-        if args.local_rank == -1 or args.local_rank == 0:  # Save model only on master process
-            # Create output directory if needed
-            if not os.path.exists(args.output_dir):
-                os.makedirs(args.output_dir)
-
-            logger.info("Saving model checkpoint to %s", args.output_dir)
-            # Save a trained model, configuration and tokenizer using `save_pretrained()`.
-            # They can then be reloaded using `from_pretrained()`
-            model_to_save = model.module if hasattr(model, 'module') else model  # Take care of distributed/parallel training
-            model_to_save.save_pretrained(args.output_dir)
-            tokenizer.save_pretrained(args.output_dir)
 
-            # Good practice: save your training arguments together with the trained model
-            torch.save(args, os.path.join(args.output_dir, 'training_args.bin'))
+# Put the repository root first so that `run_glue` resolves to the shared script and not to this file
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-    # Evaluation - all nodes evaluate
-    if args.do_eval:
-        # Make sure data is loaded properly on all nodes
-        if args.local_rank != -1:
-            torch.distributed.barrier()
-        evaluate(args, model, tokenizer, prefix="final")
-        if args.local_rank != -1:
-            torch.distributed.barrier()
-    
-    # Clean up the distributed environment
-    if args.local_rank != -1:
-        logger.info("Destroying process group...")
-        torch.distributed.destroy_process_group()
-        logger.info("Process group destroyed")
+from run_glue import main
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(default_sync_strategy="gather_scatter")
@@ -0,0 +1,219 @@
+# coding=utf-8
+""" Communication volume accounting for the distributed GLUE fine-tuning scripts.
+
+`CommLogger` wraps the torch.distributed collectives and records the shape, dtype, payload bytes and latency
+of every call. At epoch boundaries it also samples the byte counters of /proc/net/dev, so that the traffic
+the collectives are expected to cause can be compared with what actually crossed the network interface.
+
+Expected bytes are what an ideal implementation of each collective sends and receives on this rank:
+ring all_reduce and all_gather, and direct transfers to or from the root for gather, scatter, reduce
+and broadcast. The observed counters also include TCP/IP headers, gloo's own algorithm choices and
+any traffic that is not a collective, such as parameter server sockets.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import csv
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Collectives that are wrapped, with the index of the positional argument holding the local tensor
+COLLECTIVES = OrderedDict([
+    ('all_reduce', 0),
+    ('all_gather', 1),
+    ('gather', 0),
+    ('scatter', 0),
+    ('reduce', 0),
+    ('broadcast', 0),
+    ('barrier', None),
+])
+
+# Positional index and default of the root rank argument of the rooted collectives
+ROOT_ARGS = {'gather': ('dst', 2, 0), 'scatter': ('src', 2, 0), 'reduce': ('dst', 1, 0), 'broadcast': ('src', 1, 0)}
+
+
+def read_net_dev(interface=None):
+    """Returns the `(rx_bytes, tx_bytes)` counters of `interface`, or summed over all non-loopback interfaces."""
+    rx_bytes, tx_bytes = 0, 0
+    with open('/proc/net/dev') as f:
+        for line in f.readlines()[2:]:
+            name, counters = line.split(':', 1)
+            name = name.strip()
+            if (interface is None and name == 'lo') or (interface is not None and name != interface):
+                continue
+            fields = counters.split()
+            rx_bytes += int(fields[0])
+            tx_bytes += int(fields[8])
+    return rx_bytes, tx_bytes
+
+
+def expected_bytes(op, num_bytes, group_size, is_root):
+    """Bytes `(tx, rx)` that an ideal implementation of `op` moves on one rank for a `num_bytes` payload."""
+    if group_size <= 1 or op == 'barrier':
+        return 0, 0
+    if op == 'all_reduce':
+        ring = 2 * (group_size - 1) * num_bytes // group_size
+        return ring, ring
+    if op == 'all_gather':
+        return (group_size - 1) * num_bytes, (group_size - 1) * num_bytes
+    if op in ['gather', 'reduce']:
+        return (0, (group_size - 1) * num_bytes) if is_root else (num_bytes, 0)
+    if op in ['scatter', 'broadcast']:
+        return ((group_size - 1) * num_bytes, 0) if is_root else (0, num_bytes)
+    return 0, 0
+
+
+class _EpochStats(object):
+    def __init__(self):
+        self.num_collectives = 0
+        self.payload_bytes = 0
+        self.expected_tx_bytes = 0
+        self.expected_rx_bytes = 0
+        self.latency = 0.0
+        # (op, shape, dtype) -> [count, payload bytes, latency]
+        self.collectives = OrderedDict()
+
+
+class CommLogger(object):
+    """Records every torch.distributed collective between `install()` and `uninstall()`.
+
+    Synchronous calls are timed around the call; for `async_op=True` calls the latency runs until the
+    returned work completes. Call `start_epoch()` and `end_epoch()` around every training epoch and
+    `write()` at the end to save the per-epoch and per-collective tables.
+    """
+
+    def __init__(self, rank, interface=None):
+        self.rank = rank
+        self.interface = interface
+        self.lock = threading.Lock()
+        self.current = _EpochStats()
+        self.epochs = []
+        self.originals = {}
+        self.net_start = None
+        self.epoch_start = None
+
+    def install(self):
+        for op, tensor_index in COLLECTIVES.items():
+            self.originals[op] = getattr(torch.distributed, op)
+            setattr(torch.distributed, op, self._wrap(op, tensor_index, self.originals[op]))
+
+    def uninstall(self):
+        for op, original in self.originals.items():
+            setattr(torch.distributed, op, original)
+        self.originals = {}
+
+    def _wrap(self, op, tensor_index, original):
+        def collective(*args, **kwargs):
+            tensor = None
+            if tensor_index is not None:
+                tensor = args[tensor_index] if len(args) > tensor_index else kwargs.get('tensor')
+            group = kwargs.get('group')
+            group_size = torch.distributed.get_world_size(group) if group is not None else torch.distributed.get_world_size()
+            is_root = False
+            if op in ROOT_ARGS:
+                name, index, default = ROOT_ARGS[op]
+                root = args[index] if len(args) > index else kwargs.get(name, default)
+                is_root = root == self.rank
+
+            start = time.time()
+            work = original(*args, **kwargs)
+            if kwargs.get('async_op') and work is not None:
+                try:
+                    work.get_future().add_done_callback(
+                        lambda fut: self.record(op, tensor, group_size, is_root, time.time() - start))
+                    return work
+                except RuntimeError:
+                    # Some backends do not expose a future for every work; count the issue time only
+                    pass
+            self.record(op, tensor, group_size, is_root, time.time() - start)
+            return work
+        return collective
+
+    def record(self, op, tensor, group_size, is_root, latency):
+        num_bytes = tensor.numel() * tensor.element_size() if tensor is not None else 0
+        tx_bytes, rx_bytes = expected_bytes(op, num_bytes, group_size, is_root)
+        key = (op, tuple(tensor.shape) if tensor is not None else (), str(tensor.dtype).replace('torch.', '') if tensor is not None else '')
+        with self.lock:
+            stats = self.current
+            stats.num_collectives += 1
+            stats.payload_bytes += num_bytes
+            stats.expected_tx_bytes += tx_bytes
+            stats.expected_rx_bytes += rx_bytes
+            stats.latency += latency
+            entry = stats.collectives.setdefault(key, [0, 0, 0.0])
+            entry[0] += 1
+            entry[1] += num_bytes
+            entry[2] += latency
+
+    def start_epoch(self):
+        with self.lock:
+            self.current = _EpochStats()
+        self.net_start = read_net_dev(self.interface)
+        self.epoch_start = time.time()
+
+    def end_epoch(self, epoch):
+        """Closes the current epoch and returns its row of the per-epoch table."""
+        epoch_time = time.time() - self.epoch_start
+        rx_bytes, tx_bytes = read_net_dev(self.interface)
+        with self.lock:
+            stats, self.current = self.current, _EpochStats()
+        observed_rx, observed_tx = rx_bytes - self.net_start[0], tx_bytes - self.net_start[1]
+        expected_total = stats.expected_tx_bytes + stats.expected_rx_bytes
+        row = OrderedDict([
+            ('epoch', epoch),
+            ('epoch_time', epoch_time),
+            ('num_collectives', stats.num_collectives),
+            ('payload_bytes', stats.payload_bytes),
+            ('comm_latency', stats.latency),
+            ('expected_tx_bytes', stats.expected_tx_bytes),
+            ('expected_rx_bytes', stats.expected_rx_bytes),
+            ('observed_tx_bytes', observed_tx),
+            ('observed_rx_bytes', observed_rx),
+            ('observed_over_expected', (observed_tx + observed_rx) / expected_total if expected_total else 0.0),
+            # MB/s over the whole epoch, and over the time spent inside collectives
+            ('effective_bandwidth', (observed_tx + observed_rx) / epoch_time / 2**20 if epoch_time > 0 else 0.0),
+            ('collective_bandwidth', expected_total / stats.latency / 2**20 if stats.latency > 0 else 0.0),
+        ])
+        self.epochs.append((row, stats.collectives))
+        logger.info("Epoch %s communication: %d collectives, expected %.2f MB, observed %.2f MB on %s (%.2f MB/s)",
+                    epoch, stats.num_collectives, expected_total / 2**20, (observed_tx + observed_rx) / 2**20,
+                    self.interface or 'all interfaces', row['effective_bandwidth'])
+        return row
+
+    def write(self, output_dir):
+        """Saves comm_epochs_rank_{rank}.csv/.json and comm_collectives_rank_{rank}.csv to `output_dir`."""
+        os.makedirs(output_dir, exist_ok=True)
+        rows = [row for row, _ in self.epochs]
+        epochs_csv = os.path.join(output_dir, "comm_epochs_rank_{}.csv".format(self.rank))
+        with open(epochs_csv, 'w', newline='') as f:
+            if rows:
+                writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+                writer.writeheader()
+                writer.writerows(rows)
+
+        records = []
+        for row, collectives in self.epochs:
+            record = OrderedDict(row)
+            record['collectives'] = [
+                OrderedDict([('op', op), ('shape', list(shape)), ('dtype', dtype), ('count', count),
+                             ('bytes', num_bytes), ('latency', latency)])
+                for (op, shape, dtype), (count, num_bytes, latency) in collectives.items()]
+            records.append(record)
+        with open(os.path.join(output_dir, "comm_epochs_rank_{}.json".format(self.rank)), 'w') as f:
+            json.dump(records, f, indent=2)
+
+        with open(os.path.join(output_dir, "comm_collectives_rank_{}.csv".format(self.rank)), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['epoch', 'op', 'shape', 'dtype', 'count', 'bytes', 'latency'])
+            for row, collectives in self.epochs:
+                for (op, shape, dtype), (count, num_bytes, latency) in collectives.items():
+                    writer.writerow([row['epoch'], op, 'x'.join(str(d) for d in shape), dtype, count, num_bytes, latency])
+        logger.info("Communication log saved to %s", epochs_csv)
@@ -0,0 +1,601 @@
+# coding=utf-8
+""" Feature cache, samplers and per-rank batch balancing for the distributed GLUE fine-tuning scripts """
+
+from __future__ import absolute_import, division, print_function
+
+import logging
+import math
+import os
+import random
+import shutil
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset, IterableDataset, Sampler, TensorDataset, get_worker_info
+
+from utils_glue import convert_examples_to_features
+
+logger = logging.getLogger(__name__)
+
+# Columns of the feature cache, one .npy file each, in the order of the TensorDataset tensors.
+# `lengths` is the number of real (unpadded) tokens of every example.
+FEATURE_COLUMNS = ['input_ids', 'input_mask', 'segment_ids', 'labels', 'lengths']
+
+
+def features_to_columns(features, output_mode):
+    """Packs a list of `InputFeatures` into one contiguous array per column of FEATURE_COLUMNS."""
+    label_dtype = np.int64 if output_mode == "classification" else np.float32
+    input_mask = np.array([f.input_mask for f in features], dtype=np.int64)
+    return [
+        np.array([f.input_ids for f in features], dtype=np.int64),
+        input_mask,
+        np.array([f.segment_ids for f in features], dtype=np.int64),
+        np.array([f.label_id for f in features], dtype=label_dtype),
+        input_mask.sum(axis=1),
+    ]
+
+
+def save_feature_columns(columns, cache_dir):
+    """Writes the columns as `cache_dir/<column>.npy`; the directory appears atomically once complete."""
+    tmp_dir = cache_dir + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    for name, column in zip(FEATURE_COLUMNS, columns):
+        np.save(os.path.join(tmp_dir, name + '.npy'), column)
+    os.replace(tmp_dir, cache_dir)
+
+
+def load_feature_columns(cache_dir):
+    """Maps the columns of `cache_dir` into tensors without reading or copying them.
+
+    The files are mapped copy-on-write: the tensors are writable as torch expects, but pages are only
+    copied if written, so processes on the same node share the page cache of the file.
+    """
+    columns = []
+    for name in FEATURE_COLUMNS:
+        path = os.path.join(cache_dir, name + '.npy')
+        if name == 'lengths' and not os.path.exists(path):
+            # Caches written before the lengths were stored
+            columns.append(columns[FEATURE_COLUMNS.index('input_mask')].sum(dim=1))
+            continue
+        columns.append(torch.from_numpy(np.load(path, mmap_mode='c')))
+    return columns
+
+
+
+def _tensors_bytes(tensors):
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def fixed_shard(dataset, num_replicas, rank):
+    """Copies the contiguous block of `dataset` (a TensorDataset) that `rank` owns into its own memory.
+
+    The blocks are padded by wrapping around to ceil(len / num_replicas) examples, so that all ranks run
+    the same number of steps. With a memory-mapped dataset only the pages of the block are read.
+    """
+    shard_size = int(math.ceil(len(dataset) / num_replicas))
+    indices = torch.arange(rank * shard_size, (rank + 1) * shard_size) % len(dataset)
+    shard = TensorDataset(*[t[indices] for t in dataset.tensors])
+    logger.info("Rank %d holds examples %d-%d of %d (%.2f MB)", rank, rank * shard_size,
+                (rank + 1) * shard_size - 1, len(dataset), _tensors_bytes(shard.tensors) / 2**20)
+    return shard
+
+
+class EpochShardedDataset(Dataset):
+    """Holds only the examples `rank` trains on in the current epoch, copied out of `dataset`.
+
+    `set_epoch(epoch, start_index)` draws the indices of ResumableDistributedSampler for this rank and
+    copies those rows of the (memory-mapped) TensorDataset, so iterating over it in order visits the
+    same examples in the same order as the global shuffle while holding 1/num_replicas of the data.
+    """
+
+    def __init__(self, dataset, num_replicas, rank, seed=0):
+        self.source = dataset
+        self.sampler = ResumableDistributedSampler(dataset, num_replicas, rank, seed=seed)
+        self.tensors = None
+        self.set_epoch(0)
+
+    def set_epoch(self, epoch, start_index=0):
+        if self.tensors is not None and (self.sampler.epoch, self.sampler.start_index) == (epoch, start_index):
+            return
+        self.sampler.set_epoch(epoch, start_index)
+        indices = torch.tensor(list(iter(self.sampler)), dtype=torch.long)
+        self.tensors = None  # Release the previous epoch first
+        self.tensors = [t[indices] for t in self.source.tensors]
+        logger.info("Epoch %d shard: %d of %d examples (%.2f MB)", epoch, len(indices), len(self.source),
+                    _tensors_bytes(self.tensors) / 2**20)
+
+    def __getitem__(self, index):
+        return tuple(t[index] for t in self.tensors)
+
+    def __len__(self):
+        return self.tensors[0].size(0)
+
+
+class DynamicPaddingCollator(object):
+    """Collates TensorDataset items and trims the padding columns the whole batch shares.
+
+    Items are `(input_ids, input_mask, segment_ids, label, length)` as in load_and_cache_examples. Every
+    batch is padded to its own longest sequence instead of --max_seq_length; `pad_on_left` is True for
+    models whose features are padded on the left (XLNet).
+    """
+
+    def __init__(self, pad_on_left=False):
+        self.pad_on_left = pad_on_left
+
+    def __call__(self, items):
+        input_ids, input_mask, segment_ids, labels, lengths = [torch.stack(column) for column in zip(*items)]
+        length = int(lengths.max())
+        if self.pad_on_left:
+            trim = slice(input_ids.size(1) - length, input_ids.size(1))
+        else:
+            trim = slice(0, length)
+        return (input_ids[:, trim].contiguous(), input_mask[:, trim].contiguous(),
+                segment_ids[:, trim].contiguous(), labels, lengths)
+
+
+class LengthGroupedBatchSampler(Sampler):
+    """Distributed batch sampler whose batches hold examples of similar length, for dynamic padding.
+
+    Every epoch the dataset is shuffled (seeded by `seed` and the epoch), cut into mega-batches of
+    `megabatch_size` global batches, and every mega-batch is sorted by length and cut into global
+    batches of `batch_size * num_replicas`. The order of the global batches is shuffled again, and
+    each rank takes every `num_replicas`-th example of a global batch, so ranks get similar lengths.
+    As with ResumableDistributedSampler, `set_epoch(epoch, start_index)` skips the global batches
+    holding the first `start_index` samples.
+    """
+
+    def __init__(self, lengths, batch_size, num_replicas, rank, seed=0, megabatch_size=50):
+        self.lengths = torch.as_tensor(lengths)
+        self.batch_size = batch_size
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.megabatch_size = megabatch_size
+        self.global_batch_size = batch_size * num_replicas
+        self.epoch = 0
+        self.start_index = 0
+
+    def set_epoch(self, epoch, start_index=0):
+        self.epoch = epoch
+        self.start_index = start_index
+
+    def _global_batches(self):
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        num_examples = len(self.lengths)
+        indices = torch.randperm(num_examples, generator=g)
+        # Wrap around so that every rank gets the same number of full batches
+        total_size = int(math.ceil(num_examples / self.global_batch_size)) * self.global_batch_size
+        indices = indices.repeat(int(math.ceil(total_size / num_examples)))[:total_size]
+
+        batches = []
+        megabatch = self.global_batch_size * self.megabatch_size
+        for start in range(0, total_size, megabatch):
+            chunk = indices[start:start + megabatch]
+            chunk = chunk[torch.sort(self.lengths[chunk], descending=True, stable=True)[1]]
+            batches.extend(chunk.split(self.global_batch_size))
+        order = torch.randperm(len(batches), generator=g).tolist()
+        return [batches[i] for i in order]
+
+    def __iter__(self):
+        for batch in self._global_batches()[self.start_index // self.global_batch_size:]:
+            yield batch[self.rank::self.num_replicas].tolist()
+
+    def __len__(self):
+        num_batches = int(math.ceil(len(self.lengths) / self.global_batch_size))
+        return max(0, num_batches - self.start_index // self.global_batch_size)
+
+
+class ResumableDistributedSampler(Sampler):
+    """DistributedSampler that can start in the middle of an epoch, on a different number of processes.
+
+    The permutation of an epoch only depends on `seed` and the epoch, as in torch's DistributedSampler.
+    `set_epoch(epoch, start_index)` skips the first `start_index` entries of that permutation, i.e. the
+    samples all ranks of a previous run already consumed, and splits the rest across the current
+    `num_replicas`. With `start_index=0` the indices are the same as those of DistributedSampler.
+    """
+
+    def __init__(self, dataset, num_replicas, rank, seed=0, shuffle=True):
+        self.dataset = dataset
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.shuffle = shuffle
+        self.epoch = 0
+        self.start_index = 0
+
+    def set_epoch(self, epoch, start_index=0):
+        self.epoch = epoch
+        self.start_index = start_index
+
+    def __iter__(self):
+        if self.shuffle:
+            g = torch.Generator()
+            g.manual_seed(self.seed + self.epoch)
+            indices = torch.randperm(len(self.dataset), generator=g).tolist()
+        else:
+            indices = list(range(len(self.dataset)))
+
+        # Pad the whole permutation as DistributedSampler does, then drop what was already consumed
+        total_size = int(math.ceil(len(indices) / self.num_replicas)) * self.num_replicas
+        padding_size = total_size - len(indices)
+        indices += (indices * int(math.ceil(padding_size / len(indices))))[:padding_size]
+        indices = indices[self.start_index:]
+
+        # The new world size may not divide the remainder; wrap around again so that every rank gets as many
+        remaining_size = int(math.ceil(len(indices) / self.num_replicas)) * self.num_replicas
+        indices += indices[:remaining_size - len(indices)]
+        return iter(indices[self.rank:remaining_size:self.num_replicas])
+
+    def __len__(self):
+        total_size = int(math.ceil(len(self.dataset) / self.num_replicas)) * self.num_replicas
+        return int(math.ceil(max(0, total_size - self.start_index) / self.num_replicas))
+
+
+def proportional_batch_sizes(speeds, global_batch_size):
+    """Splits `global_batch_size` into integer per-rank sizes proportional to `speeds`, each at least 1."""
+    total_speed = sum(speeds)
+    shares = [global_batch_size * speed / total_speed for speed in speeds]
+    sizes = [max(1, int(share)) for share in shares]
+    # Hand out (or take back) the rounding difference by largest (smallest) fractional part
+    order = sorted(range(len(speeds)), key=lambda r: shares[r] - int(shares[r]), reverse=True)
+    index = 0
+    while sum(sizes) < global_batch_size:
+        sizes[order[index % len(order)]] += 1
+        index += 1
+    while sum(sizes) > global_batch_size:
+        largest = max(range(len(sizes)), key=lambda r: sizes[r])
+        sizes[largest] -= 1
+    return sizes
+
+
+class RebalancingBatchSampler(Sampler):
+    """Batch sampler that splits every global batch across ranks with per-rank sizes that may change mid-epoch.
+
+    All ranks walk through the same permutation (seeded by `seed` and the epoch) one global batch of
+    `global_batch_size` samples at a time; rank r takes the slice of `batch_sizes[r]` samples after those of
+    ranks 0..r-1. `set_batch_sizes` takes effect from the next batch on, as long as the DataLoader has no
+    worker processes that prefetch batches.
+    """
+
+    def __init__(self, dataset, global_batch_size, num_replicas, rank, seed=0):
+        self.dataset = dataset
+        self.global_batch_size = global_batch_size
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+        self.start_index = 0
+        self.batch_sizes = proportional_batch_sizes([1.0] * num_replicas, global_batch_size)
+
+    def set_epoch(self, epoch, start_index=0):
+        self.epoch = epoch
+        self.start_index = start_index
+
+    def set_batch_sizes(self, batch_sizes):
+        if len(batch_sizes) != self.num_replicas or sum(batch_sizes) != self.global_batch_size:
+            raise ValueError("Per-rank batch sizes {} do not add up to the global batch size {}".format(
+                batch_sizes, self.global_batch_size))
+        self.batch_sizes = list(batch_sizes)
+
+    def _num_samples(self):
+        total_size = int(math.ceil(len(self.dataset) / self.global_batch_size)) * self.global_batch_size
+        return max(0, total_size - self.start_index)
+
+    def __iter__(self):
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        indices = torch.randperm(len(self.dataset), generator=g).tolist()
+        num_samples = self._num_samples()
+        indices = (indices * int(math.ceil((self.start_index + num_samples) / len(indices))))
+        indices = indices[self.start_index:self.start_index + num_samples]
+        # After a resume on a different world size the remainder may not fill the last global batch
+        indices += indices[:int(math.ceil(len(indices) / self.global_batch_size)) * self.global_batch_size - len(indices)]
+
+        for start in range(0, len(indices), self.global_batch_size):
+            offset = start + sum(self.batch_sizes[:self.rank])
+            yield indices[offset:offset + self.batch_sizes[self.rank]]
+
+    def __len__(self):
+        return int(math.ceil(self._num_samples() / self.global_batch_size))
+
+
+class BatchRebalancer(object):
+    """Moves samples of the global batch from slow ranks to fast ones every `every` optimization steps.
+
+    Every rank records the time it spends computing (forward + backward) and waiting in gradient
+    synchronization. On rebalancing steps the ranks all_gather their samples/second over the last window
+    and set per-rank batch sizes proportional to it on the `sampler`; the global batch is unchanged.
+    """
+
+    def __init__(self, sampler, rank, world_size, every):
+        self.sampler = sampler
+        self.rank = rank
+        self.world_size = world_size
+        self.every = every
+        self.history = []
+        self._reset_window()
+
+    def _reset_window(self):
+        self.compute_time = 0.0
+        self.wait_time = 0.0
+        self.samples = 0
+        self.steps = 0
+
+    def record_compute(self, seconds, samples):
+        self.compute_time += seconds
+        self.samples += samples
+
+    def record_wait(self, seconds):
+        self.wait_time += seconds
+        self.steps += 1
+
+    def maybe_rebalance(self, global_step):
+        """Rebalances after every `every` steps; returns the log record of the window, else None."""
+        if global_step % self.every != 0 or self.steps == 0:
+            return None
+        local = torch.tensor([self.samples / max(self.compute_time, 1e-9), self.compute_time / self.steps,
+                              self.wait_time / self.steps], dtype=torch.float64)
+        gathered = [torch.empty_like(local) for _ in range(self.world_size)]
+        torch.distributed.all_gather(gathered, local)
+        speeds = [t[0].item() for t in gathered]
+        old_sizes = list(self.sampler.batch_sizes)
+        new_sizes = proportional_batch_sizes(speeds, self.sampler.global_batch_size)
+        self.sampler.set_batch_sizes(new_sizes)
+
+        record = {
+            'global_step': global_step,
+            'samples_per_sec': speeds,
+            'compute_time_per_step': [t[1].item() for t in gathered],
+            'wait_time_per_step': [t[2].item() for t in gathered],
+            'old_batch_sizes': old_sizes,
+            'new_batch_sizes': new_sizes,
+        }
+        self.history.append(record)
+        logger.info("Rebalanced after step %d: wait time per step %s s, batch sizes %s -> %s", global_step,
+                    ["%.4f" % w for w in record['wait_time_per_step']], old_sizes, new_sizes)
+        self._reset_window()
+        return record
+
+
+class TokenBudgetBatchSampler(Sampler):
+    """Distributed batch sampler that fills global batches up to a token budget and splits them by tokens.
+
+    With dynamic padding a batch costs `longest length * examples` token positions, so equal example
+    counts leave ranks with very different work. Every epoch the dataset is shuffled (seeded by `seed`
+    and the epoch), cut into mega-batches of `megabatch_size` examples and sorted by length within each.
+    Global batches are then filled while every rank stays within about `max_tokens` padded tokens. Each one
+    is split longest-first onto the rank with the fewest tokens so far, so per-rank token counts are
+    near-equal. The batches only depend on the seed, the epoch, the lengths and the number of ranks,
+    so every rank and every restart computes the same ones without communicating.
+
+    Batch sizes vary from step to step; `last_global_batch_size` is the number of examples across all
+    ranks of the batch yielded last. `set_epoch(epoch, start_index)` skips the global batches holding
+    the first `start_index` samples, and `consumed_samples(num_batches)` is that sample count after
+    `num_batches` batches of the epoch.
+    """
+
+    def __init__(self, lengths, max_tokens, num_replicas, rank, seed=0, megabatch_size=None):
+        self.lengths = torch.as_tensor(lengths)
+        self._lengths = self.lengths.tolist()
+        if len(self._lengths) < num_replicas:
+            raise ValueError("Every one of the {} ranks needs an example per batch, but there are only {}".format(
+                num_replicas, len(self._lengths)))
+        if int(self.lengths.max()) > max_tokens:
+            raise ValueError("The token budget {} is smaller than the longest example ({} tokens)".format(
+                max_tokens, int(self.lengths.max())))
+        self.max_tokens = max_tokens
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        # Enough examples for about 50 global batches of average-length examples
+        self.megabatch_size = megabatch_size or 50 * num_replicas * max(1, int(max_tokens / self.lengths.float().mean()))
+        self.epoch = 0
+        self.start_index = 0
+        self.last_global_batch_size = 0
+        self.stats = {}
+        self._cache = None
+
+    def set_epoch(self, epoch, start_index=0):
+        self.epoch = epoch
+        self.start_index = start_index
+
+    def _fits(self, longest, num_examples):
+        return longest * int(math.ceil(num_examples / self.num_replicas)) <= self.max_tokens
+
+    def _split(self, batch):
+        """Splits a global batch (sorted by decreasing length) into per-rank index lists."""
+        ranks = [[] for _ in range(self.num_replicas)]
+        tokens = [0] * self.num_replicas
+        for index in batch:
+            rank = min(range(self.num_replicas), key=lambda r: (tokens[r], len(ranks[r])))
+            ranks[rank].append(index)
+            tokens[rank] += self._lengths[index]
+        return ranks
+
+    def _global_batches(self):
+        if self._cache is not None and self._cache[0] == self.epoch:
+            return self._cache[1]
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        indices = torch.randperm(len(self.lengths), generator=g)
+
+        batches = []
+        for start in range(0, len(indices), self.megabatch_size):
+            chunk = indices[start:start + self.megabatch_size]
+            chunk = chunk[torch.sort(self.lengths[chunk], descending=True, stable=True)[1]].tolist()
+            current = []
+            for index in chunk:
+                if current and not self._fits(self._lengths[current[0]], len(current) + 1):
+                    batches.append(current)
+                    current = []
+                current.append(index)
+            if current:
+                batches.append(current)
+
+        # Every rank needs at least one example per batch; top up short batches from the start of the epoch,
+        # skipping examples the batch already holds so that none counts twice in a step
+        filler = indices.tolist()
+        for batch in batches:
+            members = set(batch)
+            for index in filler:
+                if len(batch) >= self.num_replicas:
+                    break
+                if index not in members:
+                    batch.append(index)
+                    members.add(index)
+        splits = [self._split(sorted(batch, key=lambda i: -self._lengths[i])) for batch in batches]
+        self._cache = (self.epoch, splits)
+        self._log_imbalance(splits)
+        return splits
+
+    def _log_imbalance(self, splits):
+        imbalances = []
+        for ranks in splits:
+            # Padded tokens per rank, i.e. the work of each rank with dynamic padding
+            tokens = [max(self._lengths[i] for i in rank) * len(rank) for rank in ranks]
+            imbalances.append(max(tokens) / (sum(tokens) / len(tokens)))
+        self.stats = {
+            'num_global_batches': len(splits),
+            'avg_global_batch_size': sum(sum(len(rank) for rank in ranks) for ranks in splits) / len(splits),
+            'avg_token_imbalance': sum(imbalances) / len(imbalances),
+            'max_token_imbalance': max(imbalances),
+        }
+        logger.info("Token budget batches of epoch %d: %d global batches of %.1f examples, per-rank padded "
+                    "tokens max/mean %.3f on average, %.3f at worst", self.epoch, self.stats['num_global_batches'],
+                    self.stats['avg_global_batch_size'], self.stats['avg_token_imbalance'],
+                    self.stats['max_token_imbalance'])
+
+    def _first_batch(self, splits):
+        """Index of the first global batch not covered by `start_index` samples."""
+        first, samples = 0, 0
+        while first < len(splits) and samples < self.start_index:
+            samples += sum(len(rank) for rank in splits[first])
+            first += 1
+        return first, samples
+
+    def consumed_samples(self, num_batches):
+        splits = self._global_batches()
+        first, samples = self._first_batch(splits)
+        return samples + sum(sum(len(rank) for rank in ranks) for ranks in splits[first:first + num_batches])
+
+    def __iter__(self):
+        splits = self._global_batches()
+        first, _ = self._first_batch(splits)
+        for ranks in splits[first:]:
+            self.last_global_batch_size = sum(len(rank) for rank in ranks)
+            yield ranks[self.rank]
+
+    def __len__(self):
+        splits = self._global_batches()
+        return len(splits) - self._first_batch(splits)[0]
+
+
+class StreamingFeatureDataset(IterableDataset):
+    """Train set that reads, tokenizes and shuffles the rows of train.tsv on the fly.
+
+    Nothing is read before the first batch is requested, and memory stays bounded by the shuffle buffer
+    whatever the size of the data set. Data line `j` belongs to rank `j % world_size`; the rows of a
+    rank are dealt to the DataLoader workers `batch_size` at a time, round-robin, so that every worker
+    but the one holding the rank's last batch yields whole batches and the number of batches the
+    DataLoader produces is `len(dataloader)`. Workers tokenize their rows in the background in chunks
+    of `chunk_size`, keep a buffer of `shuffle_buffer` examples and yield a random one (seeded by
+    `seed`, the epoch and the worker's shard) for every example they add.
+
+    All ranks must run the same number of steps, so every rank yields exactly `len(self)`, i.e.
+    num_lines // world_size, examples per epoch. The lines are counted once when the dataset is
+    created; a worker whose rows yield fewer examples (lines without a label are skipped) reads its
+    rows again from the start. Items are `(input_ids, input_mask, segment_ids, label, length)` as in
+    the cached dataset.
+    """
+
+    def __init__(self, processor, data_dir, label_list, tokenizer, output_mode, convert_kwargs, rank, world_size,
+                 batch_size=1, seed=0, shuffle_buffer=10000, chunk_size=256):
+        self.processor = processor
+        self.data_dir = data_dir
+        self.label_list = label_list
+        self.tokenizer = tokenizer
+        self.output_mode = output_mode
+        self.convert_kwargs = convert_kwargs
+        self.rank = rank
+        self.world_size = world_size
+        self.batch_size = batch_size
+        self.seed = seed
+        self.shuffle_buffer = shuffle_buffer
+        self.chunk_size = chunk_size
+        self.epoch = 0
+        # A raw scan for line breaks; parsing the whole file here would delay the first step
+        self.num_lines = processor.count_train_rows(data_dir)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return self.num_lines // self.world_size
+
+    def _worker_num_examples(self, num_workers, worker_id):
+        """Examples of the batches `worker_id`, `worker_id + num_workers`, ... of this rank."""
+        num_batches = (len(self) + self.batch_size - 1) // self.batch_size
+        return sum(min(self.batch_size, len(self) - b * self.batch_size)
+                   for b in range(worker_id, num_batches, num_workers))
+
+    def _rows(self, num_workers, worker_id):
+        for j, row in enumerate(self.processor.iter_train_rows(self.data_dir)):
+            if j % self.world_size == self.rank and (j // self.world_size // self.batch_size) % num_workers == worker_id:
+                yield j, row
+
+    def _features(self, num_workers, worker_id):
+        """Featurizes the rows of this worker chunk by chunk, in file order."""
+        label_dtype = torch.long if self.output_mode == "classification" else torch.float
+        chunk, chunk_start = [], None
+        rows = self._rows(num_workers, worker_id)
+        while True:
+            row = next(rows, None)
+            if row is not None:
+                if chunk_start is None:
+                    chunk_start = row[0]
+                chunk.append(row[1])
+            if chunk and (row is None or len(chunk) == self.chunk_size):
+                examples = self.processor.examples_from_rows(chunk, "train")
+                features = convert_examples_to_features(examples, self.label_list, tokenizer=self.tokenizer,
+                                                        output_mode=self.output_mode, start_index=chunk_start,
+                                                        **self.convert_kwargs)
+                for f in features:
+                    input_mask = torch.tensor(f.input_mask, dtype=torch.long)
+                    yield (torch.tensor(f.input_ids, dtype=torch.long), input_mask,
+                           torch.tensor(f.segment_ids, dtype=torch.long),
+                           torch.tensor(f.label_id, dtype=label_dtype), input_mask.sum())
+                chunk, chunk_start = [], None
+            if row is None:
+                return
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        num_workers = worker_info.num_workers if worker_info is not None else 1
+        worker_id = worker_info.id if worker_info is not None else 0
+        num_examples = self._worker_num_examples(num_workers, worker_id)
+        # Hashes of int tuples do not depend on PYTHONHASHSEED
+        rng = random.Random(hash((self.seed, self.epoch, self.rank, worker_id)))
+
+        buffer, count = [], 0
+        features = self._features(num_workers, worker_id)
+        while count + len(buffer) < num_examples:
+            item = next(features, None)
+            if item is None:
+                if count + len(buffer) == 0:
+                    # Not a single example in the rows of this worker
+                    break
+                # Rows without an example leave the worker short; top up by reading its rows again
+                features = self._features(num_workers, worker_id)
+                continue
+            buffer.append(item)
+            if len(buffer) >= self.shuffle_buffer:
+                index = rng.randrange(len(buffer))
+                buffer[index], buffer[-1] = buffer[-1], buffer[index]
+                yield buffer.pop()
+                count += 1
+        rng.shuffle(buffer)
+        for item in buffer:
+            yield item
@@ -0,0 +1,708 @@
+# coding=utf-8
+""" Gradient synchronization helpers shared by the distributed GLUE fine-tuning scripts """
+
+from __future__ import absolute_import, division, print_function
+
+import logging
+import socket
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class GradBucket(object):
+    """A group of parameters whose gradients are communicated as a single flat buffer.
+
+    The buffer is zero-padded up to a multiple of `pad_to_multiple` elements so that it can be split
+    into equally sized shards. When a `buffer` is given, the bucket uses its first elements instead of
+    allocating its own, so that buckets that are communicated one after another can share one buffer.
+    """
+
+    def __init__(self, params, pad_to_multiple=1, buffer=None):
+        self.params = params
+        self.numel = sum(p.numel() for p in params)
+        padded_numel = (self.numel + pad_to_multiple - 1) // pad_to_multiple * pad_to_multiple
+        if buffer is None:
+            buffer = torch.zeros(padded_numel, dtype=params[0].dtype, device=params[0].device)
+        self.buffer = buffer[:padded_numel]
+        # Views into the flat buffer with the shape of each parameter
+        self.views = []
+        offset = 0
+        for p in params:
+            self.views.append(self.buffer[offset:offset + p.numel()].view_as(p))
+            offset += p.numel()
+
+    def pack(self):
+        """Copies the current gradients into the flat buffer (missing gradients count as zero)."""
+        for p, view in zip(self.params, self.views):
+            if p.grad is None:
+                view.zero_()
+            else:
+                view.copy_(p.grad)
+        # A shared buffer holds whatever the previous bucket left in the padding
+        self.buffer[self.numel:].zero_()
+
+    def unpack(self):
+        """Copies the flat buffer back into the gradients of the bucket."""
+        for p, view in zip(self.params, self.views):
+            if p.grad is not None:
+                p.grad.copy_(view)
+
+    def unpack_params(self):
+        """Copies the flat buffer into the parameters themselves."""
+        for p, view in zip(self.params, self.views):
+            p.data.copy_(view)
+
+
+def build_grad_buckets(model, bucket_cap_mb, pad_to_multiple=1, exclude=(), shared_buffer=False):
+    """Groups the trainable parameters of `model` into buckets of at most `bucket_cap_mb` megabytes.
+
+    Parameters are visited in reverse registration order, which roughly matches the order in which
+    their gradients become ready during the backward pass. Parameters in `exclude` are synced elsewhere.
+    With `shared_buffer`, all buckets of a dtype share one flat buffer sized to the largest of them, so
+    they must be packed, communicated and unpacked one bucket at a time.
+    """
+    bucket_cap_bytes = int(bucket_cap_mb * 1024 * 1024)
+    exclude = set(exclude)
+    groups, current, current_bytes = [], [], 0
+    for param in reversed([p for p in model.parameters() if p.requires_grad and p not in exclude]):
+        param_bytes = param.numel() * param.element_size()
+        if current and (current_bytes + param_bytes > bucket_cap_bytes or param.dtype != current[0].dtype):
+            groups.append(current)
+            current, current_bytes = [], 0
+        current.append(param)
+        current_bytes += param_bytes
+    if current:
+        groups.append(current)
+    if not shared_buffer:
+        return [GradBucket(params, pad_to_multiple) for params in groups]
+
+    buffers = {}
+    for params in groups:
+        numel = sum(p.numel() for p in params)
+        padded_numel = (numel + pad_to_multiple - 1) // pad_to_multiple * pad_to_multiple
+        buffers[params[0].dtype] = max(buffers.get(params[0].dtype, 0), padded_numel)
+    for dtype, numel in buffers.items():
+        buffers[dtype] = torch.zeros(numel, dtype=dtype, device=groups[0][0].device)
+    return [GradBucket(params, pad_to_multiple, buffers[params[0].dtype]) for params in groups]
+
+
+class GradCompressor(object):
+    """Casts gradients to a low-precision wire format, with per-rank error feedback.
+
+    `kind` is one of 'fp16', 'bf16' or 'int8'; int8 payloads carry one float32 scale per tensor
+    (i.e. per bucket). When a `key` is given, the rounding error of the compressed tensor is kept on
+    this rank and added back the next time the same key is compressed, so no gradient signal is lost
+    over the course of training. Raw and wire byte counters are accumulated for reporting.
+    """
+
+    WIRE_DTYPES = {'fp16': torch.float16, 'bf16': torch.bfloat16, 'int8': torch.int8}
+
+    def __init__(self, kind, error_feedback=True):
+        if kind not in self.WIRE_DTYPES:
+            raise ValueError("Unknown gradient compression: %s" % kind)
+        self.kind = kind
+        self.wire_dtype = self.WIRE_DTYPES[kind]
+        self.error_feedback = error_feedback
+        self.residuals = {}
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+
+    def compress(self, tensor, key=None):
+        """Returns `(payload, scale)` for `tensor`; `scale` is None for the floating point formats."""
+        use_feedback = self.error_feedback and key is not None
+        if use_feedback:
+            residual = self.residuals.get(key)
+            # DDP may rebuild its buckets after the first step, in which case the old residual is dropped
+            if residual is not None and residual.shape == tensor.shape:
+                tensor = tensor + residual
+        if self.kind == 'int8':
+            scale = tensor.abs().max().reshape(1).float().clamp_(min=1e-30) / 127.0
+            payload = torch.round(tensor / scale).to(torch.int8)
+        else:
+            scale = None
+            payload = tensor.to(self.wire_dtype)
+        if use_feedback:
+            self.residuals[key] = tensor - self.decompress(payload, scale)
+
+        self.raw_bytes += tensor.numel() * tensor.element_size()
+        self.wire_bytes += payload.numel() * payload.element_size()
+        if scale is not None:
+            self.wire_bytes += scale.numel() * scale.element_size()
+        return payload, scale
+
+    def decompress(self, payload, scale=None):
+        """Converts a payload produced by `compress` back to float32."""
+        if scale is None:
+            return payload.float()
+        return payload.float() * scale
+
+    def summary(self):
+        """Returns a one-line report of the bytes saved so far."""
+        saved = self.raw_bytes - self.wire_bytes
+        return "Gradient compression ({}): raw {:.2f} MB, sent {:.2f} MB, saved {:.2f} MB ({:.1f}%)".format(
+            self.kind, self.raw_bytes / 2**20, self.wire_bytes / 2**20, saved / 2**20,
+            100.0 * saved / self.raw_bytes if self.raw_bytes else 0.0)
+
+
+def launch_allreduce(tensor, world_size, compressor=None, key=None):
+    """Starts averaging `tensor` across all processes.
+
+    Returns `(works, finish)`: once every work in `works` has completed, `finish()` writes the average
+    back into `tensor`. With a compressor the payload is sent in its wire format. Summing int8 values
+    from several ranks would overflow, so int8 payloads and their scales are all_gathered and
+    dequantized locally instead of being all-reduced.
+    """
+    if compressor is None:
+        works = [torch.distributed.all_reduce(tensor, op=torch.distributed.ReduceOp.SUM, async_op=True)]
+
+        def finish():
+            tensor.div_(world_size)
+        return works, finish
+
+    if compressor.kind == 'int8':
+        payload, scale = compressor.compress(tensor, key)
+        payloads = [torch.empty_like(payload) for _ in range(world_size)]
+        scales = [torch.empty_like(scale) for _ in range(world_size)]
+        works = [torch.distributed.all_gather(scales, scale, async_op=True),
+                 torch.distributed.all_gather(payloads, payload, async_op=True)]
+
+        def finish():
+            tensor.zero_()
+            for rank_payload, rank_scale in zip(payloads, scales):
+                tensor.add_(compressor.decompress(rank_payload, rank_scale))
+            tensor.div_(world_size)
+        return works, finish
+
+    # Divide before casting so that the low-precision sum cannot overflow
+    payload, _ = compressor.compress(tensor / world_size, key)
+    works = [torch.distributed.all_reduce(payload, op=torch.distributed.ReduceOp.SUM, async_op=True)]
+
+    def finish():
+        tensor.copy_(payload)
+    return works, finish
+
+
+def allreduce_tensor(tensor, world_size, compressor=None, key=None):
+    """Averages `tensor` in place across all processes."""
+    works, finish = launch_allreduce(tensor, world_size, compressor, key)
+    for work in works:
+        work.wait()
+    finish()
+
+
+def allreduce_buckets(buckets, world_size, compressor=None):
+    """Averages the gradients of every bucket across all processes with one all_reduce per bucket."""
+    pending = []
+    for index, bucket in enumerate(buckets):
+        bucket.pack()
+        pending.append(launch_allreduce(bucket.buffer, world_size, compressor, key=index))
+    for bucket, (works, finish) in zip(buckets, pending):
+        for work in works:
+            work.wait()
+        finish()
+        bucket.unpack()
+
+
+def compressed_allreduce_hook(compressor, bucket):
+    """DistributedDataParallel communication hook that all-reduces each bucket through `compressor`.
+
+    Register with `model.register_comm_hook(GradCompressor(kind), compressed_allreduce_hook)`.
+    """
+    buffer = bucket.buffer()
+    works, finish = launch_allreduce(buffer, torch.distributed.get_world_size(), compressor, key=bucket.index())
+
+    def complete(fut):
+        finish()
+        return buffer
+    return torch.futures.collect_all([work.get_future() for work in works]).then(complete)
+
+
+class ShardedGatherScatter(object):
+    """Bandwidth-optimal gradient averaging built from gather and all_gather.
+
+    Every bucket is split into `world_size` equal shards. Rank r gathers shard r from all processes
+    (a reduce-scatter) and averages only that slice, then the averaged shards are redistributed to
+    everyone with all_gather. Each rank sends and receives about 2 * (world_size - 1) / world_size
+    times the gradient size per step, so no single node becomes the bottleneck as world_size grows.
+
+    Buckets are processed one after another, so they may share one flat buffer (see
+    `build_grad_buckets(shared_buffer=True)`), and a single gather list sized to the largest shard is
+    allocated once and reused for every bucket and step.
+
+    With a `compressor`, both phases send the compressor's wire format; the shard owner accumulates in
+    float32 and error feedback is applied to the local gradients only. `last_sent_bytes` counts the
+    bytes of the tensors this rank handed to collectives since the last `sync()` (or `reset_sent_bytes()`):
+    the whole bucket to the gathers and its own shard to the all_gather, in the wire format.
+    """
+
+    def __init__(self, buckets, rank, world_size, compressor=None):
+        self.buckets = buckets
+        self.rank = rank
+        self.world_size = world_size
+        self.compressor = compressor
+        self.last_sent_bytes = 0
+        self.shards = []
+        for bucket in buckets:
+            assert bucket.buffer.numel() % world_size == 0, "Buckets must be padded to a multiple of world_size"
+            self.shards.append(list(bucket.buffer.chunk(world_size)))
+        max_shard_numel = max(bucket.buffer.numel() for bucket in buckets) // world_size
+        buffer = buckets[0].buffer
+        wire_dtype = compressor.wire_dtype if compressor is not None else buffer.dtype
+        self.gather_list = [torch.empty(max_shard_numel, dtype=wire_dtype, device=buffer.device)
+                            for _ in range(world_size)]
+        self.wire_shards = []
+        if compressor is not None:
+            self.wire_shards = [torch.empty(max_shard_numel, dtype=wire_dtype, device=buffer.device)
+                                for _ in range(world_size)]
+
+    def buffer_bytes(self):
+        """Bytes of the communication buffers held for the whole run, shared bucket buffers counted once."""
+        storages = {}
+        for bucket in self.buckets:
+            storage = bucket.buffer.untyped_storage()
+            storages[storage.data_ptr()] = storage.nbytes()
+        receive_bytes = sum(t.numel() * t.element_size() for t in self.gather_list + self.wire_shards)
+        return sum(storages.values()) + receive_bytes
+
+    def reset_sent_bytes(self):
+        self.last_sent_bytes = 0
+
+    def _count_sent(self, tensors):
+        self.last_sent_bytes += sum(t.numel() * t.element_size() for t in tensors)
+
+    def _gather_scales(self, scale, works):
+        """Shares the int8 scale of this rank with all processes; returns None for other formats."""
+        if scale is None:
+            return None
+        scales = [torch.empty_like(scale) for _ in range(self.world_size)]
+        works.append(torch.distributed.all_gather(scales, scale, async_op=True))
+        self._count_sent([scale])
+        return scales
+
+    def reduce_scatter(self, index, out=None):
+        """Packs bucket `index` and leaves the average of its shard `rank` in `out` (default: the shard itself)."""
+        bucket, shards = self.buckets[index], self.shards[index]
+        own_shard = shards[self.rank] if out is None else out
+        shard_numel = shards[self.rank].numel()
+        gather_list = [t[:shard_numel] for t in self.gather_list]
+        # Shard r of the bucket is gathered on rank r
+        works = []
+        bucket.pack()
+        if self.compressor is None:
+            send_shards, scales = shards, None
+        else:
+            payload, scale = self.compressor.compress(bucket.buffer, key=index)
+            send_shards, scales = payload.chunk(self.world_size), self._gather_scales(scale, works)
+        for owner in range(self.world_size):
+            works.append(torch.distributed.gather(
+                send_shards[owner], gather_list if owner == self.rank else None, dst=owner, async_op=True))
+        self._count_sent(send_shards)
+        for work in works:
+            work.wait()
+
+        if self.compressor is None:
+            own_shard.copy_(gather_list[0])
+            for grad in gather_list[1:]:
+                own_shard.add_(grad)
+        else:
+            own_shard.zero_()
+            for src, payload in enumerate(gather_list):
+                own_shard.add_(self.compressor.decompress(payload, scales[src] if scales else None))
+        own_shard.div_(self.world_size)
+        return own_shard
+
+    def all_gather(self, index):
+        """Sends shard `rank` of bucket `index` to all processes, filling in the other shards of its buffer."""
+        shards = self.shards[index]
+        own_shard = shards[self.rank]
+        if self.compressor is None:
+            torch.distributed.all_gather(shards, own_shard)
+            self._count_sent([own_shard])
+            return
+
+        # The averaged shard is identical on every rank after decompression, so no feedback here
+        payload, scale = self.compressor.compress(own_shard)
+        wire_shards = [t[:own_shard.numel()] for t in self.wire_shards]
+        works = []
+        scales = self._gather_scales(scale, works)
+        works.append(torch.distributed.all_gather(wire_shards, payload, async_op=True))
+        self._count_sent([payload])
+        for work in works:
+            work.wait()
+        for src, (shard, wire_shard) in enumerate(zip(shards, wire_shards)):
+            shard.copy_(self.compressor.decompress(wire_shard, scales[src] if scales else None))
+
+    def sync(self):
+        """Averages the gradients of all buckets across processes, one bucket at a time."""
+        self.reset_sent_bytes()
+        for index, bucket in enumerate(self.buckets):
+            self.reduce_scatter(index)
+            self.all_gather(index)
+            bucket.unpack()
+
+
+class OverlappedBucketAllreduce(object):
+    """Overlaps the gradient all_reduce with the backward pass using per-parameter gradient hooks.
+
+    Each hook counts down the parameters of its bucket; once every gradient of a bucket has been
+    accumulated the bucket is packed and an async all_reduce is launched while backward continues on the
+    lower layers. Buckets are launched strictly in bucket order so that all processes issue the
+    collectives in the same sequence. Call `prepare()` before the backward pass of a step that
+    synchronizes and `wait()` before the gradients are used.
+    """
+
+    def __init__(self, buckets, world_size, compressor=None):
+        self.buckets = buckets
+        self.world_size = world_size
+        self.compressor = compressor
+        self.enabled = False
+        self.pending = []
+        self.next_bucket = 0
+        self.launched = []
+        self.hook_handles = []
+        for index, bucket in enumerate(buckets):
+            for param in bucket.params:
+                self.hook_handles.append(param.register_post_accumulate_grad_hook(self._make_hook(index)))
+
+    def _make_hook(self, index):
+        def hook(param):
+            if self.enabled:
+                self.pending[index] -= 1
+                self._launch_ready_buckets()
+        return hook
+
+    def _launch(self, index):
+        bucket = self.buckets[index]
+        bucket.pack()
+        self.launched.append(launch_allreduce(bucket.buffer, self.world_size, self.compressor, key=index))
+
+    def _launch_ready_buckets(self):
+        while self.next_bucket < len(self.buckets) and self.pending[self.next_bucket] == 0:
+            self._launch(self.next_bucket)
+            self.next_bucket += 1
+
+    def prepare(self):
+        """Arms the hooks so that the next backward pass launches the all_reduce of every bucket."""
+        self.enabled = True
+        self.pending = [len(bucket.params) for bucket in self.buckets]
+        self.next_bucket = 0
+        self.launched = []
+
+    def wait(self):
+        """Waits for all outstanding all_reduce calls and writes the averaged gradients back."""
+        # Buckets holding parameters that received no gradient in this step are launched here
+        while self.next_bucket < len(self.buckets):
+            self._launch(self.next_bucket)
+            self.next_bucket += 1
+        for bucket, (works, finish) in zip(self.buckets, self.launched):
+            for work in works:
+                work.wait()
+            finish()
+            bucket.unpack()
+        self.enabled = False
+        self.launched = []
+
+
+class TopKBucketSync(object):
+    """Sparsified gradient averaging that only communicates the largest-magnitude entries of each bucket.
+
+    For every bucket the `density` fraction of entries with the largest magnitude is exchanged as
+    (index, value) pairs with all_gather and scatter-added into a dense average. With
+    `accumulate_residual` the entries that were not sent are kept locally and added to the gradient of
+    the next step. The first `warmup_steps` calls fall back to a dense all_reduce.
+    """
+
+    def __init__(self, buckets, world_size, density, warmup_steps=0, accumulate_residual=True):
+        if not 0.0 < density <= 1.0:
+            raise ValueError("Top-k density must be in (0, 1], got %s" % density)
+        self.buckets = buckets
+        self.world_size = world_size
+        self.density = density
+        self.warmup_steps = warmup_steps
+        self.residuals = [torch.zeros_like(bucket.buffer) for bucket in buckets] if accumulate_residual else None
+        self.steps = 0
+        self.dense_bytes = sum(bucket.buffer.numel() * bucket.buffer.element_size() for bucket in buckets)
+        self.last_sent_bytes = 0
+
+    def sync(self):
+        """Averages the gradients of all buckets across processes."""
+        self.steps += 1
+        if self.steps <= self.warmup_steps:
+            allreduce_buckets(self.buckets, self.world_size)
+            self.last_sent_bytes = self.dense_bytes
+            return
+
+        works, gathered, sent_bytes = [], [], 0
+        for index, bucket in enumerate(self.buckets):
+            bucket.pack()
+            if self.residuals is not None:
+                # The residual buffer becomes the accumulated gradient; whatever is not sent stays in it
+                accumulated = self.residuals[index].add_(bucket.buffer)
+            else:
+                accumulated = bucket.buffer
+            k = max(1, int(accumulated.numel() * self.density))
+            _, indices = torch.topk(accumulated.abs(), k, sorted=False)
+            values = accumulated[indices]
+            if self.residuals is not None:
+                accumulated.index_fill_(0, indices, 0)
+            indices = indices.to(torch.int32)
+
+            gathered_indices = [torch.empty_like(indices) for _ in range(self.world_size)]
+            gathered_values = [torch.empty_like(values) for _ in range(self.world_size)]
+            works.append(torch.distributed.all_gather(gathered_indices, indices, async_op=True))
+            works.append(torch.distributed.all_gather(gathered_values, values, async_op=True))
+            gathered.append((gathered_indices, gathered_values))
+            sent_bytes += indices.numel() * indices.element_size() + values.numel() * values.element_size()
+        for work in works:
+            work.wait()
+
+        for bucket, (gathered_indices, gathered_values) in zip(self.buckets, gathered):
+            bucket.buffer.zero_()
+            for indices, values in zip(gathered_indices, gathered_values):
+                bucket.buffer.index_add_(0, indices, values)
+            bucket.buffer.div_(self.world_size)
+            bucket.unpack()
+        self.last_sent_bytes = sent_bytes
+
+
+def find_embedding_params(model, min_rows=4096):
+    """Returns the `(name, weight)` of the vocabulary-sized `nn.Embedding` tables of `model`.
+
+    Position and token type embeddings are smaller than `min_rows` and stay on the dense path.
+    """
+    params = []
+    for name, module in model.named_modules():
+        if isinstance(module, torch.nn.Embedding) and module.num_embeddings >= min_rows \
+                and module.weight.requires_grad:
+            params.append((name + '.weight' if name else 'weight', module.weight))
+    return params
+
+
+class SparseEmbeddingSync(object):
+    """Averages embedding gradients by exchanging only the rows that are non-zero on some rank.
+
+    A batch touches a few thousand of the tens of thousands of vocabulary rows, and the gradient of
+    every other row is exactly zero. Every rank all_gathers the indices of its non-zero rows together
+    with those rows (padded to the largest count across ranks) and scatter-adds them into a dense
+    average, which equals the dense all_reduce result. Sent and dense-equivalent bytes are counted.
+    """
+
+    def __init__(self, params, world_size):
+        self.params = params
+        self.world_size = world_size
+        self.dense_bytes = sum(p.numel() * p.element_size() for p in params)
+        self.last_sent_bytes = 0
+        self.last_rows = 0
+
+    def sync(self):
+        sent_bytes, num_rows = 0, 0
+        for param in self.params:
+            if param.grad is None:
+                continue
+            grad = param.grad
+            rows = grad.ne(0).any(dim=1).nonzero().view(-1)
+
+            # Rows differ per rank, so every rank pads to the largest count
+            count = torch.tensor([rows.numel()], dtype=torch.int64)
+            counts = [torch.empty_like(count) for _ in range(self.world_size)]
+            torch.distributed.all_gather(counts, count)
+            counts = [c.item() for c in counts]
+            max_count = max(counts)
+            indices = torch.zeros(max_count, dtype=torch.int64, device=grad.device)
+            indices[:rows.numel()] = rows
+            values = torch.zeros(max_count, grad.size(1), dtype=grad.dtype, device=grad.device)
+            values[:rows.numel()] = grad[rows]
+
+            gathered_indices = [torch.empty_like(indices) for _ in range(self.world_size)]
+            gathered_values = [torch.empty_like(values) for _ in range(self.world_size)]
+            works = [torch.distributed.all_gather(gathered_indices, indices, async_op=True),
+                     torch.distributed.all_gather(gathered_values, values, async_op=True)]
+            for work in works:
+                work.wait()
+
+            grad.zero_()
+            for rank_count, rank_indices, rank_values in zip(counts, gathered_indices, gathered_values):
+                grad.index_add_(0, rank_indices[:rank_count], rank_values[:rank_count])
+            grad.div_(self.world_size)
+            sent_bytes += (count.numel() * count.element_size() + indices.numel() * indices.element_size()
+                           + values.numel() * values.element_size())
+            num_rows += rows.numel()
+        self.last_sent_bytes = sent_bytes
+        self.last_rows = num_rows
+
+
+def allreduce_average_tensors(tensors, world_size, bucket_cap_mb):
+    """Averages `tensors` in place across processes, packing them into flat buffers of at most `bucket_cap_mb`.
+
+    Returns the L2 distance between the local values and the average, i.e. how far this rank had drifted.
+    """
+    bucket_cap_bytes = int(bucket_cap_mb * 1024 * 1024)
+    groups, current, current_bytes = [], [], 0
+    for tensor in tensors:
+        tensor_bytes = tensor.numel() * tensor.element_size()
+        if current and (current_bytes + tensor_bytes > bucket_cap_bytes or tensor.dtype != current[0].dtype):
+            groups.append(current)
+            current, current_bytes = [], 0
+        current.append(tensor)
+        current_bytes += tensor_bytes
+    if current:
+        groups.append(current)
+
+    squared_distance = 0.0
+    for group in groups:
+        flat = torch.cat([tensor.reshape(-1) for tensor in group])
+        torch.distributed.all_reduce(flat, op=torch.distributed.ReduceOp.SUM)
+        flat.div_(world_size)
+        offset = 0
+        for tensor in group:
+            average = flat[offset:offset + tensor.numel()].view_as(tensor)
+            squared_distance += (tensor - average).float().pow(2).sum().item()
+            tensor.copy_(average)
+            offset += tensor.numel()
+    return squared_distance ** 0.5
+
+
+def parse_period_schedule(schedule):
+    """Parses a 'step:period,step:period' string into a sorted list of (start_step, period) pairs."""
+    pairs = []
+    for item in schedule.split(','):
+        start_step, period = item.split(':')
+        pairs.append((int(start_step), int(period)))
+    return sorted(pairs)
+
+
+class LocalSGDAverager(object):
+    """Local SGD: periodic model averaging instead of per-step gradient synchronization.
+
+    Every rank takes `period` purely local optimizer steps, after which the parameters (and optionally
+    the AdamW moments) are averaged across processes. `schedule`, a list of (start_step, period) pairs,
+    overrides `period` from each start step on. During the first `warmup_steps` optimizer steps the
+    gradients are all-reduced every step instead (post-local SGD). The optimizer state that is averaged
+    is the AdamW/LAMB moments or the LARS momentum buffer.
+    """
+
+    def __init__(self, model, optimizer, world_size, period, schedule=None, warmup_steps=0,
+                 average_optimizer_state=False, bucket_cap_mb=25.0):
+        self.model = model
+        self.optimizer = optimizer
+        self.world_size = world_size
+        self.period = period
+        self.schedule = schedule or []
+        self.warmup_steps = warmup_steps
+        self.average_optimizer_state = average_optimizer_state
+        self.bucket_cap_mb = bucket_cap_mb
+        self.grad_buckets = build_grad_buckets(model, bucket_cap_mb) if warmup_steps > 0 else []
+        self.steps = 0
+        self.local_steps = 0
+        self.rounds = 0
+
+    def current_period(self):
+        period = self.period
+        for start_step, scheduled_period in self.schedule:
+            if self.steps >= start_step:
+                period = scheduled_period
+        return period
+
+    def in_warmup(self):
+        return self.steps < self.warmup_steps
+
+    def sync_gradients(self):
+        """Called after backward: all-reduces the gradients while still in the warm-up phase."""
+        if self.in_warmup():
+            allreduce_buckets(self.grad_buckets, self.world_size)
+
+    def step(self):
+        """Called after every optimizer step; averages the model once `current_period()` local steps are done.
+
+        Returns the L2 distance of this rank's parameters from the average when an averaging round
+        happened, else None.
+        """
+        warmup = self.in_warmup()
+        self.steps += 1
+        if warmup:
+            return None
+        self.local_steps += 1
+        if self.local_steps < self.current_period():
+            return None
+        return self.average()
+
+    def optimizer_moments(self):
+        """The per-parameter optimizer state tensors that are averaged with the model."""
+        moments = []
+        for group in self.optimizer.param_groups:
+            for p in group['params']:
+                state = self.optimizer.state.get(p, {})
+                moments.extend(state[key] for key in ('exp_avg', 'exp_avg_sq', 'momentum_buffer') if key in state)
+        return moments
+
+    def average(self):
+        """Averages the parameters (and optionally the optimizer moments) across all processes."""
+        params = [p.data for p in self.model.parameters() if p.requires_grad]
+        divergence = allreduce_average_tensors(params, self.world_size, self.bucket_cap_mb)
+        if self.average_optimizer_state:
+            allreduce_average_tensors(self.optimizer_moments(), self.world_size, self.bucket_cap_mb)
+        self.local_steps = 0
+        self.rounds += 1
+        return divergence
+
+    def finalize(self):
+        """Averages any local steps taken since the last round so that all ranks end with the same model."""
+        if self.local_steps > 0:
+            return self.average()
+        return None
+
+    def state_dict(self):
+        return {'steps': self.steps, 'local_steps': self.local_steps, 'rounds': self.rounds}
+
+    def load_state_dict(self, state):
+        self.steps = state['steps']
+        self.local_steps = state['local_steps']
+        self.rounds = state['rounds']
+
+
+class HierarchicalAllreduce(object):
+    """Two-level gradient all_reduce for several processes per node.
+
+    Ranks are laid out node by node (rank = node_rank * nproc_per_node + local_rank). Every bucket is
+    first reduced onto the node leader (local rank 0) through a node-local process group, the leaders
+    then all-reduce among themselves, and finally each leader broadcasts the result inside its node.
+    Only one copy of the gradient crosses the network per node.
+    """
+
+    def __init__(self, buckets, rank, world_size, nproc_per_node):
+        if world_size % nproc_per_node != 0:
+            raise ValueError("world_size ({}) must be a multiple of nproc_per_node ({})".format(world_size, nproc_per_node))
+        self.buckets = buckets
+        self.world_size = world_size
+        num_nodes = world_size // nproc_per_node
+        node_rank = rank // nproc_per_node
+        self.leader = node_rank * nproc_per_node
+        self.is_leader = rank == self.leader
+
+        # new_group must be called by every process for every group, in the same order
+        self.node_group = None
+        for node in range(num_nodes):
+            group = torch.distributed.new_group(list(range(node * nproc_per_node, (node + 1) * nproc_per_node)))
+            if node == node_rank:
+                self.node_group = group
+        self.leader_group = torch.distributed.new_group(list(range(0, world_size, nproc_per_node)))
+
+    def sync(self):
+        """Averages the gradients of all buckets across all processes."""
+        for bucket in self.buckets:
+            bucket.pack()
+            torch.distributed.reduce(bucket.buffer, dst=self.leader, op=torch.distributed.ReduceOp.SUM, group=self.node_group)
+            if self.is_leader:
+                torch.distributed.all_reduce(bucket.buffer, op=torch.distributed.ReduceOp.SUM, group=self.leader_group)
+            torch.distributed.broadcast(bucket.buffer, src=self.leader, group=self.node_group)
+            bucket.buffer.div_(self.world_size)
+            bucket.unpack()
+
+
+def find_free_port():
+    """Returns a TCP port on localhost that is free right now, for a single-machine rendezvous."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
@@ -19,6 +19,7 @@ from __future__ import absolute_import, division, print_function
 
 import csv
 import logging
+import multiprocessing
 import os
 import sys
 from io import open
@@ -63,6 +64,9 @@ class InputFeatures(object):
 class DataProcessor(object):
     """Base class for data converters for sequence classification data sets."""
 
+    # Whether the .tsv files start with a header line, which `_create_examples` skips
+    has_header = True
+
     def get_train_examples(self, data_dir):
         """Gets a collection of `InputExample`s for the train set."""
         raise NotImplementedError()
@@ -87,6 +91,40 @@ class DataProcessor(object):
                 lines.append(line)
             return lines
 
+    @classmethod
+    def _iter_tsv(cls, input_file, quotechar=None):
+        """Reads a tab separated value file lazily, one line at a time."""
+        with open(input_file, "r", encoding="utf-8-sig") as f:
+            reader = csv.reader(f, delimiter="\t", quotechar=quotechar)
+            for line in reader:
+                if sys.version_info[0] == 2:
+                    line = list(unicode(cell, 'utf-8') for cell in line)
+                yield line
+
+    def iter_train_rows(self, data_dir):
+        """Yields the data lines of the train set (without the header) without reading the whole file."""
+        for (i, line) in enumerate(self._iter_tsv(os.path.join(data_dir, "train.tsv"))):
+            if i == 0 and self.has_header:
+                continue
+            yield line
+
+    def count_train_rows(self, data_dir):
+        """Counts the data lines of the train set by scanning for line breaks, without parsing the TSV."""
+        num_lines, last = 0, b"\n"
+        with open(os.path.join(data_dir, "train.tsv"), "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                num_lines += block.count(b"\n")
+                last = block[-1:]
+        if last != b"\n":
+            # The last line has no line break
+            num_lines += 1
+        return num_lines - 1 if self.has_header and num_lines else num_lines
+
+    def examples_from_rows(self, rows, set_type):
+        """Creates examples from data lines as returned by `iter_train_rows`."""
+        # `_create_examples` skips the first line of files with a header without reading it
+        return self._create_examples([None] + rows if self.has_header else rows, set_type)
+
 
 class MrpcProcessor(DataProcessor):
     """Processor for the MRPC data set (GLUE version)."""
@@ -167,6 +205,8 @@ class MnliMismatchedProcessor(MnliProcessor):
 class ColaProcessor(DataProcessor):
     """Processor for the CoLA data set (GLUE version)."""
 
+    has_header = False
+
     def get_train_examples(self, data_dir):
         """See base class."""
         return self._create_examples(
@@ -400,116 +440,160 @@ def convert_examples_to_features(examples, label_list, max_seq_length,
                                  pad_token_segment_id=0,
                                  sequence_a_segment_id=0, 
                                  sequence_b_segment_id=1,
-                                 mask_padding_with_zero=True):
+                                 mask_padding_with_zero=True,
+                                 num_workers=0,
+                                 chunk_size=2000,
+                                 start_index=0):
     """ Loads a data file into a list of `InputBatch`s
         `cls_token_at_end` define the location of the CLS token:
             - False (Default, BERT/XLM pattern): [CLS] + A + [SEP] + B + [SEP]
             - True (XLNet/GPT pattern): A + [SEP] + B + [SEP] + [CLS]
         `cls_token_segment_id` define the segment id associated to the CLS token (0 for BERT, 2 for XLNet)
+        `num_workers` > 1 featurizes chunks of `chunk_size` examples in a process pool, with the tokenizer
+            sent once to every worker; the features are the same, in the same order, as the serial ones
+        `start_index` is the position of `examples[0]` in the whole data set when converting it piecewise
     """
 
     label_map = {label : i for i, label in enumerate(label_list)}
+    options = dict(max_seq_length=max_seq_length, output_mode=output_mode,
+                   cls_token_at_end=cls_token_at_end, cls_token=cls_token,
+                   cls_token_segment_id=cls_token_segment_id, sep_token=sep_token,
+                   sep_token_extra=sep_token_extra, pad_on_left=pad_on_left, pad_token=pad_token,
+                   pad_token_segment_id=pad_token_segment_id, sequence_a_segment_id=sequence_a_segment_id,
+                   sequence_b_segment_id=sequence_b_segment_id, mask_padding_with_zero=mask_padding_with_zero)
+
+    if num_workers > 1 and len(examples) > chunk_size:
+        chunks = [(start_index + start, examples[start:start + chunk_size]) for start in range(0, len(examples), chunk_size)]
+        logger.info("Writing %d examples with %d processes", len(examples), num_workers)
+        with multiprocessing.Pool(num_workers, initializer=_init_featurize_worker,
+                                  initargs=(tokenizer, label_map, options)) as pool:
+            # imap returns the chunks in submission order
+            features = []
+            for chunk_features in pool.imap(_featurize_chunk, chunks):
+                features.extend(chunk_features)
+        return features
 
     features = []
-    for (ex_index, example) in enumerate(examples):
+    for (ex_index, example) in enumerate(examples, start_index):
         if ex_index % 10000 == 0:
-            logger.info("Writing example %d of %d" % (ex_index, len(examples)))
-
-        tokens_a = tokenizer.tokenize(example.text_a)
-
-        tokens_b = None
-        if example.text_b:
-            tokens_b = tokenizer.tokenize(example.text_b)
-            # Modifies `tokens_a` and `tokens_b` in place so that the total
-            # length is less than the specified length.
-            # Account for [CLS], [SEP], [SEP] with "- 3". " -4" for RoBERTa.
-            special_tokens_count = 4 if sep_token_extra else 3
-            _truncate_seq_pair(tokens_a, tokens_b, max_seq_length - special_tokens_count)
-        else:
-            # Account for [CLS] and [SEP] with "- 2" and with "- 3" for RoBERTa.
-            special_tokens_count = 3 if sep_token_extra else 2
-            if len(tokens_a) > max_seq_length - special_tokens_count:
-                tokens_a = tokens_a[:(max_seq_length - special_tokens_count)]
-
-        # The convention in BERT is:
-        # (a) For sequence pairs:
-        #  tokens:   [CLS] is this jack ##son ##ville ? [SEP] no it is not . [SEP]
-        #  type_ids:   0   0  0    0    0     0       0   0   1  1  1  1   1   1
-        # (b) For single sequences:
-        #  tokens:   [CLS] the dog is hairy . [SEP]
-        #  type_ids:   0   0   0   0  0     0   0
-        #
-        # Where "type_ids" are used to indicate whether this is the first
-        # sequence or the second sequence. The embedding vectors for `type=0` and
-        # `type=1` were learned during pre-training and are added to the wordpiece
-        # embedding vector (and position vector). This is not *strictly* necessary
-        # since the [SEP] token unambiguously separates the sequences, but it makes
-        # it easier for the model to learn the concept of sequences.
-        #
-        # For classification tasks, the first vector (corresponding to [CLS]) is
-        # used as as the "sentence vector". Note that this only makes sense because
-        # the entire model is fine-tuned.
-        tokens = tokens_a + [sep_token]
-        if sep_token_extra:
-            # roberta uses an extra separator b/w pairs of sentences
-            tokens += [sep_token]
-        segment_ids = [sequence_a_segment_id] * len(tokens)
-
-        if tokens_b:
-            tokens += tokens_b + [sep_token]
-            segment_ids += [sequence_b_segment_id] * (len(tokens_b) + 1)
-
-        if cls_token_at_end:
-            tokens = tokens + [cls_token]
-            segment_ids = segment_ids + [cls_token_segment_id]
-        else:
-            tokens = [cls_token] + tokens
-            segment_ids = [cls_token_segment_id] + segment_ids
+            logger.info("Writing example %d of %d" % (ex_index, start_index + len(examples)))
+        features.append(_convert_example_to_features(ex_index, example, label_map, tokenizer, **options))
+    return features
 
-        input_ids = tokenizer.convert_tokens_to_ids(tokens)
 
-        # The mask has 1 for real tokens and 0 for padding tokens. Only real
-        # tokens are attended to.
-        input_mask = [1 if mask_padding_with_zero else 0] * len(input_ids)
+# Tokenizer, label map and options of the featurization worker processes
+_featurize_state = None
 
-        # Zero-pad up to the sequence length.
-        padding_length = max_seq_length - len(input_ids)
-        if pad_on_left:
-            input_ids = ([pad_token] * padding_length) + input_ids
-            input_mask = ([0 if mask_padding_with_zero else 1] * padding_length) + input_mask
-            segment_ids = ([pad_token_segment_id] * padding_length) + segment_ids
-        else:
-            input_ids = input_ids + ([pad_token] * padding_length)
-            input_mask = input_mask + ([0 if mask_padding_with_zero else 1] * padding_length)
-            segment_ids = segment_ids + ([pad_token_segment_id] * padding_length)
-
-        assert len(input_ids) == max_seq_length
-        assert len(input_mask) == max_seq_length
-        assert len(segment_ids) == max_seq_length
-
-        if output_mode == "classification":
-            label_id = label_map[example.label]
-        elif output_mode == "regression":
-            label_id = float(example.label)
-        else:
-            raise KeyError(output_mode)
-
-        if ex_index < 5:
-            logger.info("*** Example ***")
-            logger.info("guid: %s" % (example.guid))
-            logger.info("tokens: %s" % " ".join(
-                    [str(x) for x in tokens]))
-            logger.info("input_ids: %s" % " ".join([str(x) for x in input_ids]))
-            logger.info("input_mask: %s" % " ".join([str(x) for x in input_mask]))
-            logger.info("segment_ids: %s" % " ".join([str(x) for x in segment_ids]))
-            logger.info("label: %s (id = %d)" % (example.label, label_id))
-
-        features.append(
-                InputFeatures(input_ids=input_ids,
-                              input_mask=input_mask,
-                              segment_ids=segment_ids,
-                              label_id=label_id))
-    return features
+
+def _init_featurize_worker(tokenizer, label_map, options):
+    global _featurize_state
+    _featurize_state = (tokenizer, label_map, options)
+
+
+def _featurize_chunk(chunk):
+    start, examples = chunk
+    tokenizer, label_map, options = _featurize_state
+    return [_convert_example_to_features(start + offset, example, label_map, tokenizer, **options)
+            for offset, example in enumerate(examples)]
+
+
+def _convert_example_to_features(ex_index, example, label_map, tokenizer, max_seq_length, output_mode,
+                                 cls_token_at_end, cls_token, cls_token_segment_id, sep_token,
+                                 sep_token_extra, pad_on_left, pad_token, pad_token_segment_id,
+                                 sequence_a_segment_id, sequence_b_segment_id, mask_padding_with_zero):
+    tokens_a = tokenizer.tokenize(example.text_a)
+
+    tokens_b = None
+    if example.text_b:
+        tokens_b = tokenizer.tokenize(example.text_b)
+        # Modifies `tokens_a` and `tokens_b` in place so that the total
+        # length is less than the specified length.
+        # Account for [CLS], [SEP], [SEP] with "- 3". " -4" for RoBERTa.
+        special_tokens_count = 4 if sep_token_extra else 3
+        _truncate_seq_pair(tokens_a, tokens_b, max_seq_length - special_tokens_count)
+    else:
+        # Account for [CLS] and [SEP] with "- 2" and with "- 3" for RoBERTa.
+        special_tokens_count = 3 if sep_token_extra else 2
+        if len(tokens_a) > max_seq_length - special_tokens_count:
+            tokens_a = tokens_a[:(max_seq_length - special_tokens_count)]
+
+    # The convention in BERT is:
+    # (a) For sequence pairs:
+    #  tokens:   [CLS] is this jack ##son ##ville ? [SEP] no it is not . [SEP]
+    #  type_ids:   0   0  0    0    0     0       0   0   1  1  1  1   1   1
+    # (b) For single sequences:
+    #  tokens:   [CLS] the dog is hairy . [SEP]
+    #  type_ids:   0   0   0   0  0     0   0
+    #
+    # Where "type_ids" are used to indicate whether this is the first
+    # sequence or the second sequence. The embedding vectors for `type=0` and
+    # `type=1` were learned during pre-training and are added to the wordpiece
+    # embedding vector (and position vector). This is not *strictly* necessary
+    # since the [SEP] token unambiguously separates the sequences, but it makes
+    # it easier for the model to learn the concept of sequences.
+    #
+    # For classification tasks, the first vector (corresponding to [CLS]) is
+    # used as as the "sentence vector". Note that this only makes sense because
+    # the entire model is fine-tuned.
+    tokens = tokens_a + [sep_token]
+    if sep_token_extra:
+        # roberta uses an extra separator b/w pairs of sentences
+        tokens += [sep_token]
+    segment_ids = [sequence_a_segment_id] * len(tokens)
+
+    if tokens_b:
+        tokens += tokens_b + [sep_token]
+        segment_ids += [sequence_b_segment_id] * (len(tokens_b) + 1)
+
+    if cls_token_at_end:
+        tokens = tokens + [cls_token]
+        segment_ids = segment_ids + [cls_token_segment_id]
+    else:
+        tokens = [cls_token] + tokens
+        segment_ids = [cls_token_segment_id] + segment_ids
+
+    input_ids = tokenizer.convert_tokens_to_ids(tokens)
+
+    # The mask has 1 for real tokens and 0 for padding tokens. Only real
+    # tokens are attended to.
+    input_mask = [1 if mask_padding_with_zero else 0] * len(input_ids)
+
+    # Zero-pad up to the sequence length.
+    padding_length = max_seq_length - len(input_ids)
+    if pad_on_left:
+        input_ids = ([pad_token] * padding_length) + input_ids
+        input_mask = ([0 if mask_padding_with_zero else 1] * padding_length) + input_mask
+        segment_ids = ([pad_token_segment_id] * padding_length) + segment_ids
+    else:
+        input_ids = input_ids + ([pad_token] * padding_length)
+        input_mask = input_mask + ([0 if mask_padding_with_zero else 1] * padding_length)
+        segment_ids = segment_ids + ([pad_token_segment_id] * padding_length)
+
+    assert len(input_ids) == max_seq_length
+    assert len(input_mask) == max_seq_length
+    assert len(segment_ids) == max_seq_length
+
+    if output_mode == "classification":
+        label_id = label_map[example.label]
+    elif output_mode == "regression":
+        label_id = float(example.label)
+    else:
+        raise KeyError(output_mode)
+
+    if ex_index < 5:
+        logger.info("*** Example ***")
+        logger.info("guid: %s" % (example.guid))
+        logger.info("tokens: %s" % " ".join(
+                [str(x) for x in tokens]))
+        logger.info("input_ids: %s" % " ".join([str(x) for x in input_ids]))
+        logger.info("input_mask: %s" % " ".join([str(x) for x in input_mask]))
+        logger.info("segment_ids: %s" % " ".join([str(x) for x in segment_ids]))
+        logger.info("label: %s (id = %d)" % (example.label, label_id))
+
+    return InputFeatures(input_ids=input_ids,
+                         input_mask=input_mask,
+                         segment_ids=segment_ids,
+                         label_id=label_id)
 
 
 def _truncate_seq_pair(tokens_a, tokens_b, max_length):
@@ -0,0 +1,316 @@
+# coding=utf-8
+""" Optimizers for the distributed GLUE fine-tuning scripts """
+
+from __future__ import absolute_import, division, print_function
+
+import logging
+import math
+
+import torch
+from pytorch_transformers import AdamW
+from torch.optim import Optimizer
+
+from utils_dist import ShardedGatherScatter, build_grad_buckets
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedAdamW(Optimizer):
+    """ZeRO stage 1: AdamW whose `exp_avg`/`exp_avg_sq` state is sharded across processes.
+
+    Parameters are packed into flat buckets (padded to a multiple of world_size) and every rank owns the
+    contiguous shard `rank` of each bucket. `step()` reduce-scatters the gradients to their owners, clips
+    them by the global norm, applies the same update as `pytorch_transformers.AdamW` to the owned shard
+    only and all-gathers the updated parameters. The buckets share one flat buffer and are communicated
+    one at a time, so besides the sharded moments and averaged gradient shards a rank only holds
+    buffers of about twice the bucket size; optimizer memory per rank drops to about 1/world_size.
+
+    Because gradients are only averaged inside `step()`, clipping with `max_grad_norm` happens here and
+    `clip_grad_norm_` must not be called on the (local) gradients beforehand.
+    """
+
+    def __init__(self, params, rank, world_size, lr=1e-3, betas=(0.9, 0.999), eps=1e-6, weight_decay=0.0,
+                 correct_bias=True, max_grad_norm=None, bucket_cap_mb=25.0):
+        defaults = dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay, correct_bias=correct_bias)
+        super(ShardedAdamW, self).__init__(params, defaults)
+        self.rank = rank
+        self.world_size = world_size
+        self.max_grad_norm = max_grad_norm
+        self.steps = 0
+
+        group_of = {}
+        for index, group in enumerate(self.param_groups):
+            for p in group['params']:
+                group_of[p] = index
+
+        model_params = torch.nn.ParameterList([p for group in self.param_groups for p in group['params']])
+        self.buckets = build_grad_buckets(model_params, bucket_cap_mb, pad_to_multiple=world_size, shared_buffer=True)
+        self.comm = ShardedGatherScatter(self.buckets, rank, world_size)
+
+        # For every bucket, the pieces of parameters that fall into the owned shard:
+        # (group index, flat parameter view, start, end) with start/end relative to the shard
+        self.segments = []
+        self.exp_avg = []
+        self.exp_avg_sq = []
+        # The averaged gradient of the owned shards, kept until all of them are known for clipping
+        self.grad_shards = []
+        for bucket, shards in zip(self.buckets, self.comm.shards):
+            shard_numel = shards[rank].numel()
+            shard_start = rank * shard_numel
+            shard_end = shard_start + shard_numel
+            segments, offset = [], 0
+            for p in bucket.params:
+                start, end = max(offset, shard_start), min(offset + p.numel(), shard_end)
+                if start < end:
+                    segments.append((group_of[p], p.data.view(-1)[start - offset:end - offset],
+                                     start - shard_start, end - shard_start))
+                offset += p.numel()
+            self.segments.append(segments)
+            self.exp_avg.append(torch.zeros_like(shards[rank]))
+            self.exp_avg_sq.append(torch.zeros_like(shards[rank]))
+            self.grad_shards.append(torch.zeros_like(shards[rank]))
+
+    def state_bytes(self):
+        """Bytes this rank holds for the optimizer: sharded state, gradient shards and communication buffers."""
+        shard_bytes = sum(t.numel() * t.element_size() for t in self.exp_avg + self.exp_avg_sq + self.grad_shards)
+        return shard_bytes + self.comm.buffer_bytes()
+
+    def _clip_coef(self, grad_shards):
+        """Same clipping coefficient as `torch.nn.utils.clip_grad_norm_` over the full averaged gradient."""
+        squared_norm = torch.zeros(1, dtype=torch.float32, device=grad_shards[0].device)
+        for grad in grad_shards:
+            squared_norm += grad.float().pow(2).sum()
+        torch.distributed.all_reduce(squared_norm, op=torch.distributed.ReduceOp.SUM)
+        total_norm = squared_norm.sqrt()
+        return torch.clamp(self.max_grad_norm / (total_norm + 1e-6), max=1.0)
+
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            loss = closure()
+
+        self.comm.reset_sent_bytes()
+        grad_shards = [self.comm.reduce_scatter(index, out=grad) for index, grad in enumerate(self.grad_shards)]
+        if self.max_grad_norm is not None:
+            clip_coef = self._clip_coef(grad_shards)
+            for grad in grad_shards:
+                grad.mul_(clip_coef)
+
+        self.steps += 1
+        step_sizes = []
+        for group in self.param_groups:
+            beta1, beta2 = group['betas']
+            step_size = group['lr']
+            if group['correct_bias']:
+                bias_correction1 = 1.0 - beta1 ** self.steps
+                bias_correction2 = 1.0 - beta2 ** self.steps
+                step_size = step_size * math.sqrt(bias_correction2) / bias_correction1
+            step_sizes.append(step_size)
+
+        # All groups share betas and eps; only lr and weight decay differ per group
+        beta1, beta2 = self.defaults['betas']
+        eps = self.defaults['eps']
+        for index, (grad, exp_avg, exp_avg_sq, segments, shards) in enumerate(zip(
+                grad_shards, self.exp_avg, self.exp_avg_sq, self.segments, self.comm.shards)):
+            exp_avg.mul_(beta1).add_(grad, alpha=1.0 - beta1)
+            exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1.0 - beta2)
+            update = exp_avg / exp_avg_sq.sqrt().add_(eps)
+            for group_index, param, start, end in segments:
+                group = self.param_groups[group_index]
+                param.add_(update[start:end], alpha=-step_sizes[group_index])
+                if group['weight_decay'] > 0.0:
+                    param.add_(param, alpha=-group['lr'] * group['weight_decay'])
+                # The owned shard now carries the updated parameters to be all-gathered
+                shards[self.rank][start:end].copy_(param)
+            # The bucket buffer is shared, so its parameters are gathered before the next bucket is updated
+            self.comm.all_gather(index)
+            self.buckets[index].unpack_params()
+        return loss
+
+
+class MultiTensorAdamW(Optimizer):
+    """`pytorch_transformers.AdamW` with multi-tensor (`torch._foreach_*`) updates.
+
+    The per-parameter loop of AdamW launches half a dozen small ops for every tensor; here every
+    operation is applied to all parameters of a param group in one call. The arithmetic and its order
+    are the same as in AdamW, weight decay included, and the state is kept per parameter under the
+    same keys, so the two optimizers produce the same parameters and load each other's state dicts.
+    """
+
+    def __init__(self, params, lr=1e-3, betas=(0.9, 0.999), eps=1e-6, weight_decay=0.0, correct_bias=True):
+        defaults = dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay, correct_bias=correct_bias)
+        super(MultiTensorAdamW, self).__init__(params, defaults)
+
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            loss = closure()
+
+        for group in self.param_groups:
+            beta1, beta2 = group['betas']
+            # Parameters are grouped by step count, which differs only for parameters that missed gradients
+            by_step = {}
+            for p in group['params']:
+                if p.grad is None:
+                    continue
+                if p.grad.data.is_sparse:
+                    raise RuntimeError('Adam does not support sparse gradients, please consider SparseAdam instead')
+                state = self.state[p]
+                if len(state) == 0:
+                    state['step'] = 0
+                    state['exp_avg'] = torch.zeros_like(p.data)
+                    state['exp_avg_sq'] = torch.zeros_like(p.data)
+                state['step'] += 1
+                tensors = by_step.setdefault(state['step'], ([], [], [], []))
+                tensors[0].append(p.data)
+                tensors[1].append(p.grad.data)
+                tensors[2].append(state['exp_avg'])
+                tensors[3].append(state['exp_avg_sq'])
+
+            for step, (params, grads, exp_avgs, exp_avg_sqs) in by_step.items():
+                torch._foreach_mul_(exp_avgs, beta1)
+                torch._foreach_add_(exp_avgs, grads, alpha=1.0 - beta1)
+                torch._foreach_mul_(exp_avg_sqs, beta2)
+                torch._foreach_addcmul_(exp_avg_sqs, grads, grads, value=1.0 - beta2)
+                denoms = torch._foreach_sqrt(exp_avg_sqs)
+                torch._foreach_add_(denoms, group['eps'])
+
+                step_size = group['lr']
+                if group['correct_bias']:
+                    bias_correction1 = 1.0 - beta1 ** step
+                    bias_correction2 = 1.0 - beta2 ** step
+                    step_size = step_size * math.sqrt(bias_correction2) / bias_correction1
+                torch._foreach_addcdiv_(params, exp_avgs, denoms, value=-step_size)
+                if group['weight_decay'] > 0.0:
+                    torch._foreach_add_(params, params, alpha=-group['lr'] * group['weight_decay'])
+        return loss
+
+
+def clip_grad_norm_multi_tensor_(parameters, max_norm):
+    """`torch.nn.utils.clip_grad_norm_` (L2 norm) with one multi-tensor norm and one multi-tensor scaling."""
+    if isinstance(parameters, torch.Tensor):
+        parameters = [parameters]
+    grads = [p.grad for p in parameters if p.grad is not None]
+    if len(grads) == 0:
+        return torch.tensor(0.0)
+    total_norm = torch.norm(torch.stack(torch._foreach_norm(grads)))
+    clip_coef = torch.clamp(max_norm / (total_norm + 1e-6), max=1.0)
+    torch._foreach_mul_(grads, clip_coef.to(grads[0].device))
+    return total_norm
+
+
+
+class LAMB(Optimizer):
+    """Layer-wise Adaptive Moments for Batch training (You et al., 2019) for large global batches.
+
+    The AdamW direction `m_hat / (sqrt(v_hat) + eps) + weight_decay * w` of every parameter is rescaled
+    by the trust ratio `||w|| / ||direction||`, so every layer moves by about `lr` relative to its own
+    norm whatever the batch size. Param groups with `layer_adaptation` False (biases and LayerNorm) take
+    the plain AdamW step. The state uses the AdamW keys, so local SGD can average it.
+    """
+
+    def __init__(self, params, lr=1e-3, betas=(0.9, 0.999), eps=1e-6, weight_decay=0.0, layer_adaptation=True):
+        defaults = dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay, layer_adaptation=layer_adaptation)
+        super(LAMB, self).__init__(params, defaults)
+
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            loss = closure()
+
+        for group in self.param_groups:
+            beta1, beta2 = group['betas']
+            for p in group['params']:
+                if p.grad is None:
+                    continue
+                grad = p.grad.data
+                state = self.state[p]
+                if len(state) == 0:
+                    state['step'] = 0
+                    state['exp_avg'] = torch.zeros_like(p.data)
+                    state['exp_avg_sq'] = torch.zeros_like(p.data)
+                exp_avg, exp_avg_sq = state['exp_avg'], state['exp_avg_sq']
+                state['step'] += 1
+
+                exp_avg.mul_(beta1).add_(grad, alpha=1.0 - beta1)
+                exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1.0 - beta2)
+                bias_correction1 = 1.0 - beta1 ** state['step']
+                bias_correction2 = 1.0 - beta2 ** state['step']
+                update = (exp_avg / bias_correction1) / (exp_avg_sq / bias_correction2).sqrt().add_(group['eps'])
+                if group['weight_decay'] > 0.0:
+                    update.add_(p.data, alpha=group['weight_decay'])
+
+                trust_ratio = 1.0
+                if group.get('layer_adaptation', True):
+                    weight_norm = p.data.norm().item()
+                    update_norm = update.norm().item()
+                    if weight_norm > 0 and update_norm > 0:
+                        trust_ratio = weight_norm / update_norm
+                p.data.add_(update, alpha=-group['lr'] * trust_ratio)
+        return loss
+
+
+class LARS(Optimizer):
+    """Layer-wise Adaptive Rate Scaling (You et al., 2017): momentum SGD with a per-layer learning rate.
+
+    The local learning rate of every parameter is `trust_coefficient * ||w|| / (||g|| + weight_decay * ||w||)`;
+    param groups with `layer_adaptation` False use the global one. LARS needs an SGD-scale `lr`
+    (e.g. 1.0 or more), not the AdamW fine-tuning one.
+    """
+
+    def __init__(self, params, lr=1.0, momentum=0.9, weight_decay=0.0, trust_coefficient=0.001,
+                 eps=1e-8, layer_adaptation=True):
+        defaults = dict(lr=lr, momentum=momentum, weight_decay=weight_decay, trust_coefficient=trust_coefficient,
+                        eps=eps, layer_adaptation=layer_adaptation)
+        super(LARS, self).__init__(params, defaults)
+
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            loss = closure()
+
+        for group in self.param_groups:
+            for p in group['params']:
+                if p.grad is None:
+                    continue
+                grad = p.grad.data
+                local_lr = 1.0
+                if group.get('layer_adaptation', True):
+                    weight_norm = p.data.norm().item()
+                    grad_norm = grad.norm().item()
+                    if weight_norm > 0 and grad_norm > 0:
+                        local_lr = group['trust_coefficient'] * weight_norm / (
+                            grad_norm + group['weight_decay'] * weight_norm + group['eps'])
+                update = grad.add(p.data, alpha=group['weight_decay']) if group['weight_decay'] > 0.0 else grad.clone()
+                update.mul_(group['lr'] * local_lr)
+
+                state = self.state[p]
+                if 'momentum_buffer' not in state:
+                    state['momentum_buffer'] = update
+                else:
+                    state['momentum_buffer'].mul_(group['momentum']).add_(update)
+                p.data.sub_(state['momentum_buffer'])
+        return loss
+
+
+def scaled_learning_rate(learning_rate, global_batch_size, base_batch_size, rule):
+    """Learning rate for `global_batch_size` given the one tuned for `base_batch_size`.
+
+    'linear' scales it with the batch size (Goyal et al., 2017), 'sqrt' with its square root, which keeps
+    the variance of the update constant and is the usual rule for LAMB; 'none' keeps it.
+    """
+    if rule == 'linear':
+        return learning_rate * global_batch_size / base_batch_size
+    if rule == 'sqrt':
+        return learning_rate * math.sqrt(global_batch_size / base_batch_size)
+    return learning_rate
+
+
+# --optimizer_backend -> (AdamW implementation, gradient clipping function)
+OPTIMIZER_BACKENDS = {
+    'loop': (AdamW, torch.nn.utils.clip_grad_norm_),
+    'foreach': (MultiTensorAdamW, clip_grad_norm_multi_tensor_),
+}
+
+OPTIMIZERS = ['adamw', 'lamb', 'lars']
+LR_SCALING_RULES = ['none', 'linear', 'sqrt']
@@ -0,0 +1,210 @@
+# coding=utf-8
+""" Sharded parameter server with bounded staleness (SSP) for asynchronous data-parallel training.
+
+Parameters are split across one or more server processes. Workers push their (clipped) gradients to
+every server, which applies them immediately with its own AdamW optimizer, and then pull fresh weights.
+A worker that has pushed `clock` gradients may only pull once every other worker has pushed at least
+`clock - staleness` gradients, so fast workers run ahead of slow ones by at most `staleness` steps
+instead of waiting for them on every step.
+
+Communication uses plain sockets (multiprocessing.connection) so that it works across hosts as well as on
+localhost. Tensors are sent as raw float32 bytes rather than pickled, since torch registers shared-memory
+reducers for tensors that only work between processes on the same host.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import logging
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+PS_AUTHKEY = b'glue-param-server'
+
+
+def assign_shards(named_shapes, num_servers):
+    """Assigns every parameter to a server, balancing the number of elements greedily.
+
+    `named_shapes` is a list of (name, shape) pairs in registration order. Returns a list with the
+    parameter names of every server, each in registration order. The result is deterministic so that
+    workers and servers agree on it without communicating.
+    """
+    loads = [0] * num_servers
+    owner = {}
+    for name, shape in sorted(named_shapes, key=lambda item: -torch.Size(item[1]).numel()):
+        server = loads.index(min(loads))
+        owner[name] = server
+        loads[server] += torch.Size(shape).numel()
+    return [[name for name, _ in named_shapes if owner[name] == server] for server in range(num_servers)]
+
+
+class _ShardServer(object):
+    """State of one parameter server process."""
+
+    def __init__(self, params, no_decay, num_workers, staleness, optim_args):
+        # Imported here so that only server processes pay for it
+        from pytorch_transformers import AdamW, WarmupLinearSchedule
+
+        self.names = list(params.keys())
+        self.params = [torch.nn.Parameter(params[name].float()) for name in self.names]
+        self.numel = sum(p.numel() for p in self.params)
+        self.flat = torch.zeros(self.numel)
+        grouped_parameters = [
+            {'params': [p for n, p in zip(self.names, self.params) if not any(nd in n for nd in no_decay)],
+             'weight_decay': optim_args['weight_decay']},
+            {'params': [p for n, p in zip(self.names, self.params) if any(nd in n for nd in no_decay)],
+             'weight_decay': 0.0},
+        ]
+        grouped_parameters = [group for group in grouped_parameters if group['params']]
+        self.optimizer = AdamW(grouped_parameters, lr=optim_args['learning_rate'], eps=optim_args['adam_epsilon'])
+        self.scheduler = WarmupLinearSchedule(self.optimizer, warmup_steps=optim_args['warmup_steps'],
+                                              t_total=optim_args['t_total'])
+        self.staleness = staleness
+        self.clocks = [0] * num_workers
+        self.updates = 0
+        self.lock = threading.Condition()
+
+    def apply(self, worker_id, clock, flat_grad):
+        with self.lock:
+            offset = 0
+            for p in self.params:
+                p.grad = flat_grad[offset:offset + p.numel()].view_as(p)
+                offset += p.numel()
+            self.optimizer.step()
+            self.scheduler.step()
+            self.updates += 1
+            self.clocks[worker_id] = clock
+            self.lock.notify_all()
+
+    def snapshot(self, clock):
+        """Returns the flat parameters once no worker is more than `staleness` clocks behind `clock`."""
+        with self.lock:
+            self.lock.wait_for(lambda: min(self.clocks) >= clock - self.staleness)
+            offset = 0
+            for p in self.params:
+                self.flat[offset:offset + p.numel()].copy_(p.data.view(-1))
+                offset += p.numel()
+            return self.flat.numpy().tobytes()
+
+    def finish(self, worker_id):
+        with self.lock:
+            self.clocks[worker_id] = float('inf')
+            self.lock.notify_all()
+
+    def handle(self, conn):
+        """Serves one worker connection until the worker closes it."""
+        _, worker_id = conn.recv()
+        flat_grad = torch.zeros(self.numel)
+        while True:
+            message = conn.recv()
+            if message[0] == 'push':
+                conn.recv_bytes_into(flat_grad.numpy())
+                self.apply(worker_id, message[1], flat_grad)
+            elif message[0] == 'pull':
+                conn.send_bytes(self.snapshot(message[1]))
+            elif message[0] == 'done':
+                self.finish(worker_id)
+            elif message[0] == 'close':
+                conn.close()
+                return
+
+
+def run_server(server_id, address, params, no_decay, num_workers, staleness, optim_args):
+    """Entry point of a parameter server process holding the parameters in `params` (name -> tensor)."""
+    server = _ShardServer(params, no_decay, num_workers, staleness, optim_args)
+    listener = Listener(address, authkey=PS_AUTHKEY)
+    threads = []
+    for _ in range(num_workers):
+        conn = listener.accept()
+        thread = threading.Thread(target=server.handle, args=(conn,), daemon=True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    listener.close()
+    logger.info("Parameter server %d applied %d updates", server_id, server.updates)
+
+
+def start_servers(model, num_servers, host, base_port, num_workers, staleness, no_decay, optim_args):
+    """Spawns `num_servers` parameter server processes initialized with the weights of `model`."""
+    import torch.multiprocessing as mp
+
+    named_params = [(n, p) for n, p in model.named_parameters() if p.requires_grad]
+    shards = assign_shards([(n, tuple(p.shape)) for n, p in named_params], num_servers)
+    tensors = dict((n, p.detach().cpu().clone()) for n, p in named_params)
+    context = mp.get_context('spawn')
+    processes = []
+    for server_id, names in enumerate(shards):
+        process = context.Process(target=run_server, args=(
+            server_id, (host, base_port + server_id), dict((n, tensors[n]) for n in names),
+            no_decay, num_workers, staleness, optim_args))
+        process.start()
+        processes.append(process)
+    return processes
+
+
+class ParameterServerClient(object):
+    """Worker side of the sharded parameter server: pushes gradients and pulls the weights of every shard."""
+
+    def __init__(self, model, worker_id, num_servers, host, base_port, connect_timeout=300):
+        named_params = [(n, p) for n, p in model.named_parameters() if p.requires_grad]
+        shards = assign_shards([(n, tuple(p.shape)) for n, p in named_params], num_servers)
+        params_by_name = dict(named_params)
+        self.shards = [[params_by_name[n] for n in names] for names in shards]
+        self.buffers = [torch.zeros(sum(p.numel() for p in params)) for params in self.shards]
+        self.clock = 0
+
+        self.conns = []
+        for server_id in range(num_servers):
+            deadline = time.time() + connect_timeout
+            while True:
+                try:
+                    conn = Client((host, base_port + server_id), authkey=PS_AUTHKEY)
+                    break
+                except (ConnectionRefusedError, OSError):
+                    # The servers are started by rank 0 and may not be listening yet
+                    if time.time() > deadline:
+                        raise
+                    time.sleep(1)
+            conn.send(('hello', worker_id))
+            self.conns.append(conn)
+
+    def push_pull(self):
+        """Pushes the current gradients to all servers, then pulls the updated weights into the model."""
+        self.clock += 1
+        for conn, params, flat in zip(self.conns, self.shards, self.buffers):
+            offset = 0
+            for p in params:
+                if p.grad is None:
+                    flat[offset:offset + p.numel()].zero_()
+                else:
+                    flat[offset:offset + p.numel()].copy_(p.grad.view(-1))
+                offset += p.numel()
+            conn.send(('push', self.clock))
+            conn.send_bytes(flat.numpy())
+        self.pull(self.clock)
+
+    def pull(self, clock):
+        """Copies the server weights into the model, waiting until they satisfy the staleness bound for `clock`."""
+        for conn in self.conns:
+            conn.send(('pull', clock))
+        for conn, params, flat in zip(self.conns, self.shards, self.buffers):
+            conn.recv_bytes_into(flat.numpy())
+            offset = 0
+            for p in params:
+                p.data.copy_(flat[offset:offset + p.numel()].view_as(p))
+                offset += p.numel()
+
+    def finish(self):
+        """Tells the servers that this worker will not push any more, so it no longer holds back others."""
+        for conn in self.conns:
+            conn.send(('done',))
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(('close',))
+            conn.close()
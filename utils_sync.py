@@ -0,0 +1,645 @@
+# coding=utf-8
+""" Pluggable gradient synchronization strategies for run_glue.py, selected with --sync_strategy.
+
+The training loop only talks to a strategy through the hooks of `SyncStrategy`. For every micro-batch it calls
+
+    with micro_step_context(sync_step): forward -> before_backward(sync_step) -> backward -> after_backward(sync_step)
+
+where `sync_step` is True on the last micro-batch of an accumulation window, and once per optimization step
+
+    before_optimizer() -> gradient clipping (if `clips_gradients`) -> optimizer_step() -> after_optimizer()
+
+A new strategy subclasses `SyncStrategy`, overrides the hooks it needs and is added to `SYNC_STRATEGIES`.
+Every strategy counts the time the training loop spends blocked in its communication and the bytes of the
+tensors it hands to collectives as send buffers on this rank (in the wire format when compressed), so
+strategies can be compared in the same run configuration.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import contextlib
+import logging
+import time
+
+import torch
+
+from utils_dist import (GradCompressor, HierarchicalAllreduce, LocalSGDAverager,
+                        OverlappedBucketAllreduce, ShardedGatherScatter, SparseEmbeddingSync,
+                        TopKBucketSync, allreduce_buckets, allreduce_tensor, build_grad_buckets,
+                        compressed_allreduce_hook, find_embedding_params, parse_period_schedule)
+from utils_optim import LAMB, LARS, OPTIMIZER_BACKENDS, ShardedAdamW
+from utils_ps import ParameterServerClient, start_servers
+
+logger = logging.getLogger(__name__)
+
+
+def _tensor_bytes(tensors):
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def _grads(model):
+    return [p.grad for p in model.parameters() if p.requires_grad and p.grad is not None]
+
+
+class SyncStrategy(object):
+    """Base class of the gradient synchronization strategies.
+
+    Subclasses implement `sync_gradients()`, which must leave the averaged gradients in `p.grad`, and
+    override the other hooks when they need to. The class attributes describe what the strategy supports
+    and are checked against the command line in `__init__`.
+    """
+
+    name = None
+    # Whether --grad_compression can be used with this strategy
+    supports_compression = False
+    # Whether --fp16 (apex amp) can be used with this strategy
+    supports_fp16 = True
+    # Whether the training loop clips the (averaged) gradients before the optimizer step
+    clips_gradients = True
+    # Whether all ranks wait for each other after every gradient synchronization
+    barrier_after_sync = True
+    # Whether every optimizer step uses the average of the gradients of all ranks
+    averages_gradients = True
+    # Whether gradients are communicated during the backward pass, so backward time includes waiting for peers
+    communicates_in_backward = False
+    # Whether the gradients of the word embeddings can be synced row-wise (--sparse_embedding_sync)
+    supports_sparse_embedding = False
+    # Whether --optimizer lamb/lars can replace AdamW
+    supports_optimizer_choice = True
+    # Whether rank 0's model and optimizer state is enough to resume training (--save_steps/--resume)
+    supports_checkpoint = True
+
+    def __init__(self, args):
+        if args.grad_compression != 'none' and not self.supports_compression:
+            raise ValueError("--grad_compression cannot be combined with the {} sync strategy".format(self.name))
+        if args.fp16 and not self.supports_fp16:
+            raise ValueError("The {} sync strategy does not support --fp16".format(self.name))
+        if args.optimizer != 'adamw' and not self.supports_optimizer_choice:
+            raise ValueError("The {} sync strategy only supports --optimizer adamw".format(self.name))
+        if args.sparse_embedding_sync and not self.supports_sparse_embedding:
+            raise ValueError("The {} sync strategy does not support --sparse_embedding_sync".format(self.name))
+        self.args = args
+        self.rank = args.rank
+        self.world_size = args.world_size
+        self.compressor = None
+        if args.grad_compression != 'none':
+            self.compressor = GradCompressor(args.grad_compression, error_feedback=not args.no_error_feedback)
+        self.model = None
+        self.optimizer = None
+        self.sparse_params = []
+        self.sparse_sync = None
+        self.embedding_dense_bytes = 0
+        self.embedding_sent_bytes = 0
+        self.comm_time = 0.0
+        self.comm_bytes = 0
+        self.num_syncs = 0
+
+    def wrap_model(self, model):
+        """Called once the process group exists; returns the model used for training and evaluation."""
+        return model
+
+    def build_optimizer(self, grouped_parameters):
+        args = self.args
+        if args.optimizer == 'lamb':
+            return LAMB(grouped_parameters, lr=args.learning_rate, eps=args.adam_epsilon)
+        if args.optimizer == 'lars':
+            return LARS(grouped_parameters, lr=args.learning_rate, momentum=args.lars_momentum,
+                        trust_coefficient=args.lars_trust_coefficient)
+        optimizer_class, _ = OPTIMIZER_BACKENDS[args.optimizer_backend]
+        return optimizer_class(grouped_parameters, lr=args.learning_rate, eps=args.adam_epsilon)
+
+    def setup(self, model, optimizer, t_total, no_decay):
+        """Called once before training, after the optimizer (and apex amp) have been set up."""
+        self.model = model
+        self.optimizer = optimizer
+        if self.args.sparse_embedding_sync:
+            # The embedding tables leave the dense path of the strategy and are synced row-wise
+            named_params = find_embedding_params(model)
+            self.sparse_params = [param for _, param in named_params]
+            self.sparse_sync = SparseEmbeddingSync(self.sparse_params, self.world_size)
+            logger.info("  Row-wise sparse sync for %s (%.2f MB dense)", ", ".join(name for name, _ in named_params),
+                        self.sparse_sync.dense_bytes / 2**20)
+
+    def _dense_named_parameters(self):
+        """The parameters with a gradient that the strategy itself has to average."""
+        sparse_ids = set(id(param) for param in self.sparse_params)
+        for name, param in self.model.named_parameters():
+            if param.requires_grad and param.grad is not None and id(param) not in sparse_ids:
+                yield name, param
+
+    def micro_step_context(self, sync_step):
+        """Context manager around the forward and backward pass of every micro-batch."""
+        return contextlib.nullcontext()
+
+    def before_backward(self, sync_step):
+        pass
+
+    def after_backward(self, sync_step):
+        pass
+
+    def before_optimizer(self):
+        """Averages the gradients of all ranks; called once per optimization step before clipping."""
+        start = time.time()
+        self.sync_gradients()
+        if self.sparse_sync is not None:
+            self._sync_sparse()
+        if self.barrier_after_sync:
+            torch.distributed.barrier()
+        self.comm_time += time.time() - start
+        self.num_syncs += 1
+
+    def sync_gradients(self):
+        raise NotImplementedError
+
+    def _sync_sparse(self):
+        self.sparse_sync.sync()
+        self.comm_bytes += self.sparse_sync.last_sent_bytes
+        self.embedding_sent_bytes += self.sparse_sync.last_sent_bytes
+        self.embedding_dense_bytes += self.sparse_sync.dense_bytes
+        if self.num_syncs == 0:
+            logger.info("Embedding sync: %d non-zero rows, sent %.2f MB instead of %.2f MB dense",
+                        self.sparse_sync.last_rows, self.sparse_sync.last_sent_bytes / 2**20,
+                        self.sparse_sync.dense_bytes / 2**20)
+
+    def optimizer_step(self, optimizer, scheduler):
+        optimizer.step()
+        scheduler.step()  # Update learning rate schedule
+
+    def after_optimizer(self, global_step):
+        """Called after every optimizer step; returns extra fields for the loss log of that step."""
+        return {}
+
+    def before_checkpoint(self):
+        """Called on all ranks right before rank 0 saves the training state."""
+        pass
+
+    def state_dict(self):
+        """Returns the strategy's own state to save with the training state (called after `before_checkpoint`)."""
+        return {}
+
+    def load_state_dict(self, state):
+        """Restores the state returned by `state_dict` when resuming (called after `setup`)."""
+        pass
+
+    def finish(self):
+        """Called once after the last training step."""
+        pass
+
+    def _count_compressed(self, sync, tensors):
+        """Runs `sync()` and counts the bytes it sends, in the compressor's wire format if there is one."""
+        if self.compressor is None:
+            sync()
+            self.comm_bytes += _tensor_bytes(tensors)
+        else:
+            wire_bytes = self.compressor.wire_bytes
+            sync()
+            self.comm_bytes += self.compressor.wire_bytes - wire_bytes
+
+    def stats(self):
+        stats = {
+            'sync_strategy': self.name,
+            'num_syncs': self.num_syncs,
+            'comm_time': self.comm_time,
+            'comm_bytes': self.comm_bytes,
+            'avg_comm_time': self.comm_time / self.num_syncs if self.num_syncs else 0.0,
+        }
+        if self.comm_bytes is None:
+            # The strategy cannot see what it sends; report nothing rather than a wrong figure
+            stats['avg_comm_bytes'] = None
+        else:
+            stats['avg_comm_bytes'] = self.comm_bytes / self.num_syncs if self.num_syncs else 0.0
+        if self.sparse_sync is not None:
+            # Bytes the embedding tables would have cost on the dense path, and what the row-wise sync sent
+            stats['embedding_dense_bytes'] = self.embedding_dense_bytes
+            stats['embedding_sent_bytes'] = self.embedding_sent_bytes
+        return stats
+
+    def summary(self):
+        """Returns a one-line report of the time and bytes spent on communication so far."""
+        stats = self.stats()
+        summary = "Sync strategy {}: {} syncs, {:.4f} s blocked ({:.4f} s/sync)".format(
+            self.name, stats['num_syncs'], stats['comm_time'], stats['avg_comm_time'])
+        if stats['comm_bytes'] is None:
+            summary += ", bytes sent not measured"
+        else:
+            summary += ", {:.2f} MB sent ({:.2f} MB/sync)".format(
+                stats['comm_bytes'] / 2**20, stats['avg_comm_bytes'] / 2**20)
+        if self.sparse_sync is not None and self.embedding_sent_bytes:
+            summary += "; embeddings {:.2f} MB sent instead of {:.2f} MB dense ({:.1f}x less)".format(
+                self.embedding_sent_bytes / 2**20, self.embedding_dense_bytes / 2**20,
+                self.embedding_dense_bytes / self.embedding_sent_bytes)
+        return summary
+
+
+class NoSync(SyncStrategy):
+    """Every rank trains on its own data without communicating (also used for single-process training)."""
+
+    name = 'none'
+    barrier_after_sync = False
+    averages_gradients = False
+
+    def sync_gradients(self):
+        pass
+
+
+class GatherScatterSync(SyncStrategy):
+    """Rank 0 gathers every gradient, averages it and scatters the result back, one parameter at a time."""
+
+    name = 'gather_scatter'
+    supports_sparse_embedding = True
+
+    def sync_gradients(self):
+        for _, param in self._dense_named_parameters():
+            # Create tensor list to hold gradients from all processes
+            gather_list = [torch.zeros_like(param.grad) for _ in range(self.world_size)]
+
+            # Gather gradients from all processes to process 0
+            torch.distributed.gather(param.grad, gather_list if self.rank == 0 else None, dst=0)
+
+            # Process 0 computes the average
+            if self.rank == 0:
+                # Element-wise sum of all gradients
+                avg_grad = torch.zeros_like(param.grad)
+                for grad in gather_list:
+                    avg_grad += grad
+                # Divide by world_size to get the average
+                avg_grad /= self.world_size
+                # Prepare list for scattering
+                scatter_list = [avg_grad for _ in range(self.world_size)]
+            else:
+                scatter_list = None
+
+            # Scatter the average gradient back to all processes
+            torch.distributed.scatter(param.grad, scatter_list if self.rank == 0 else None, src=0)
+            # Every rank hands its gradient to the gather; only rank 0 hands a scatter list
+            self.comm_bytes += _tensor_bytes([param.grad] + (scatter_list if self.rank == 0 else []))
+
+
+class ReduceScatterSync(SyncStrategy):
+    """Each rank averages only its own shard of every gradient bucket, then the shards are all-gathered."""
+
+    name = 'reduce_scatter'
+    supports_compression = True
+    supports_sparse_embedding = True
+
+    def setup(self, model, optimizer, t_total, no_decay):
+        super(ReduceScatterSync, self).setup(model, optimizer, t_total, no_decay)
+        # Preallocate one bucket buffer and one gather list; they are reused for every bucket and step
+        self.buckets = build_grad_buckets(model, self.args.bucket_cap_mb, pad_to_multiple=self.world_size,
+                                          exclude=self.sparse_params, shared_buffer=True)
+        self.comm = ShardedGatherScatter(self.buckets, self.rank, self.world_size, self.compressor)
+        logger.info("  Gradient buckets = %d (cap %.1f MB)", len(self.buckets), self.args.bucket_cap_mb)
+
+    def sync_gradients(self):
+        # Every bucket is handed to the gathers whole and to the all_gather as the owned shard
+        self.comm.sync()
+        self.comm_bytes += self.comm.last_sent_bytes
+
+
+class AllreduceSync(SyncStrategy):
+    """One all_reduce per parameter."""
+
+    name = 'allreduce'
+    supports_compression = True
+    supports_sparse_embedding = True
+
+    def sync_gradients(self):
+        for name, param in self._dense_named_parameters():
+            if self.compressor is not None:
+                self._count_compressed(
+                    lambda: allreduce_tensor(param.grad, self.world_size, self.compressor, key=name), [])
+                continue
+
+            # Use all_reduce to sum up gradients from all processes
+            torch.distributed.all_reduce(param.grad, op=torch.distributed.ReduceOp.SUM)
+
+            # Divide by world_size to get the average
+            param.grad.div_(self.world_size)
+            self.comm_bytes += _tensor_bytes([param.grad])
+
+
+class BucketedAllreduceSync(SyncStrategy):
+    """One all_reduce per flat gradient bucket instead of one per parameter."""
+
+    name = 'bucketed'
+    supports_compression = True
+    supports_sparse_embedding = True
+
+    def setup(self, model, optimizer, t_total, no_decay):
+        super(BucketedAllreduceSync, self).setup(model, optimizer, t_total, no_decay)
+        self.buckets = build_grad_buckets(model, self.args.bucket_cap_mb, exclude=self.sparse_params)
+        logger.info("  Gradient buckets = %d (cap %.1f MB)", len(self.buckets), self.args.bucket_cap_mb)
+
+    def sync_gradients(self):
+        self._count_compressed(lambda: allreduce_buckets(self.buckets, self.world_size, self.compressor),
+                               [bucket.buffer for bucket in self.buckets])
+
+
+class OverlapSync(BucketedAllreduceSync):
+    """Bucketed async all_reduce launched from gradient hooks while backward is still running.
+
+    Only the wait for the outstanding all_reduce calls is counted as communication time.
+    """
+
+    name = 'overlap'
+    # Gradients are read before apex unscales them
+    supports_fp16 = False
+
+    def setup(self, model, optimizer, t_total, no_decay):
+        super(OverlapSync, self).setup(model, optimizer, t_total, no_decay)
+        self.comm = OverlappedBucketAllreduce(self.buckets, self.world_size, self.compressor)
+
+    def before_backward(self, sync_step):
+        # Only the last micro-step of an accumulation window communicates
+        if sync_step:
+            self.comm.prepare()
+
+    def sync_gradients(self):
+        self._count_compressed(self.comm.wait, [bucket.buffer for bucket in self.buckets])
+
+
+class TopKSync(BucketedAllreduceSync):
+    """All_gather of the top-k entries of every gradient bucket, with optional local residual accumulation."""
+
+    name = 'topk'
+    supports_compression = False
+
+    def setup(self, model, optimizer, t_total, no_decay):
+        super(TopKSync, self).setup(model, optimizer, t_total, no_decay)
+        args = self.args
+        self.comm = TopKBucketSync(self.buckets, self.world_size, args.topk_density,
+                                   warmup_steps=args.topk_warmup_steps,
+                                   accumulate_residual=args.topk_residual == 'accumulate')
+
+    def sync_gradients(self):
+        self.comm.sync()
+        self.comm_bytes += self.comm.last_sent_bytes
+        logger.info("Step %d top-k sync: sent %.2f MB of %.2f MB dense (%.1fx compression)",
+                    self.num_syncs, self.comm.last_sent_bytes / 2**20, self.comm.dense_bytes / 2**20,
+                    self.comm.dense_bytes / self.comm.last_sent_bytes)
+
+
+class HierarchicalSync(BucketedAllreduceSync):
+    """Reduce inside each node, all_reduce among node leaders, then broadcast inside each node."""
+
+    name = 'hierarchical'
+    supports_compression = False
+
+    def setup(self, model, optimizer, t_total, no_decay):
+        super(HierarchicalSync, self).setup(model, optimizer, t_total, no_decay)
+        self.comm = HierarchicalAllreduce(self.buckets, self.rank, self.world_size, self.args.nproc_per_node)
+
+    def sync_gradients(self):
+        self.comm.sync()
+        self.comm_bytes += _tensor_bytes([bucket.buffer for bucket in self.buckets])
+
+
+class LocalSGDSync(SyncStrategy):
+    """Average the model every H local steps instead of the gradients every step."""
+
+    name = 'local_sgd'
+    # Ranks run independently between averaging rounds
+    barrier_after_sync = False
+    averages_gradients = False
+
+    def setup(self, model, optimizer, t_total, no_decay):
+        super(LocalSGDSync, self).setup(model, optimizer, t_total, no_decay)
+        args = self.args
+        self.averager = LocalSGDAverager(
+            model, optimizer, self.world_size, args.local_sgd_period,
+            schedule=parse_period_schedule(args.local_sgd_schedule) if args.local_sgd_schedule else None,
+            warmup_steps=args.local_sgd_warmup_steps,
+            average_optimizer_state=args.local_sgd_average_optimizer_state,
+            bucket_cap_mb=args.bucket_cap_mb)
+
+    def sync_gradients(self):
+        # Gradients are only all-reduced during the post-local SGD warm-up
+        if self.averager.in_warmup():
+            self.averager.sync_gradients()
+            self.comm_bytes += _tensor_bytes([bucket.buffer for bucket in self.averager.grad_buckets])
+
+    def _averaged_bytes(self):
+        params = [p.data for p in self.model.parameters() if p.requires_grad]
+        num_bytes = _tensor_bytes(params)
+        if self.args.local_sgd_average_optimizer_state:
+            num_bytes += _tensor_bytes(self.averager.optimizer_moments())
+        return num_bytes
+
+    def after_optimizer(self, global_step):
+        rounds = self.averager.rounds
+        start = time.time()
+        divergence = self.averager.step()
+        self.comm_time += time.time() - start
+        fields = {'local_sgd_round': self.averager.rounds}
+        if self.averager.rounds != rounds:
+            self.comm_bytes += self._averaged_bytes()
+        if divergence is not None:
+            fields['param_divergence'] = divergence
+            logger.info("Local SGD round %d after step %d: parameter distance from average = %.6f",
+                        self.averager.rounds, global_step, divergence)
+        return fields
+
+    def before_checkpoint(self):
+        # Rank 0 saves the model for everyone, so it must be the average
+        start = time.time()
+        if self.averager.local_steps > 0:
+            self.averager.average()
+            self.comm_bytes += self._averaged_bytes()
+        self.comm_time += time.time() - start
+
+    def state_dict(self):
+        # The step count decides when the warm-up ends and which scheduled period applies
+        return self.averager.state_dict()
+
+    def load_state_dict(self, state):
+        if state:
+            self.averager.load_state_dict(state)
+
+    def finish(self):
+        # Make sure every rank ends up with the same (averaged) model
+        start = time.time()
+        if self.averager.finalize() is not None:
+            self.comm_bytes += self._averaged_bytes()
+        self.comm_time += time.time() - start
+
+
+class ParameterServerSync(SyncStrategy):
+    """Asynchronous sharded parameter servers with bounded staleness.
+
+    Rank 0 starts the servers; every rank pushes its clipped gradients and pulls fresh weights instead of
+    taking a local optimizer step, so the push/pull time is counted as communication time.
+    """
+
+    name = 'param_server'
+    barrier_after_sync = False
+    # The servers run AdamW
+    supports_optimizer_choice = False
+    averages_gradients = False
+    # The optimizer state lives on the servers
+    supports_checkpoint = False
+
+    def setup(self, model, optimizer, t_total, no_decay):
+        super(ParameterServerSync, self).setup(model, optimizer, t_total, no_decay)
+        args = self.args
+        self.ps_port = args.ps_port if args.ps_port is not None else int(args.master_port) + 1
+        self.processes = []
+        if self.rank == 0:
+            # Every worker push is one server update, so the schedule is stretched by world_size
+            self.processes = start_servers(model, args.ps_num_servers, args.master_ip, self.ps_port, self.world_size,
+                                           args.ps_staleness, no_decay, {
+                                               'learning_rate': args.learning_rate,
+                                               'adam_epsilon': args.adam_epsilon,
+                                               'weight_decay': args.weight_decay,
+                                               'warmup_steps': args.warmup_steps * self.world_size,
+                                               't_total': t_total * self.world_size,
+                                           })
+        self.client = ParameterServerClient(model, self.rank, args.ps_num_servers, args.master_ip, self.ps_port)
+
+    def sync_gradients(self):
+        # Gradients are pushed to the parameter servers after clipping
+        pass
+
+    def optimizer_step(self, optimizer, scheduler):
+        # The servers apply the update; pull fresh weights within the staleness bound
+        start = time.time()
+        self.client.push_pull()
+        self.comm_time += time.time() - start
+        # Gradients are pushed as float32; the pulled weights are received, not sent
+        self.comm_bytes += sum(buffer.numel() * buffer.element_size() for buffer in self.client.buffers)
+
+    def finish(self):
+        # Every rank evaluates, so all of them fetch the final weights once every worker has pushed its
+        # last gradient; then stop the servers
+        self.client.finish()
+        torch.distributed.barrier()
+        self.client.pull(0)
+        self.client.close()
+        for process in self.processes:
+            process.join()
+
+
+class Zero1Sync(SyncStrategy):
+    """Reduce-scatter + AdamW state sharded across ranks (ZeRO stage 1).
+
+    The sharded optimizer communicates inside `step()`, so the whole optimizer step is counted as
+    communication time.
+    """
+
+    name = 'zero1'
+    supports_fp16 = False
+    # The sharded optimizer clips by the global norm of the averaged gradient itself
+    clips_gradients = False
+    # Every rank only holds its own shard of the optimizer state
+    supports_checkpoint = False
+    supports_optimizer_choice = False
+
+    def build_optimizer(self, grouped_parameters):
+        args = self.args
+        # ZeRO-1: every rank keeps the AdamW state of its own shard; gradient sync and clipping happen in step()
+        optimizer = ShardedAdamW(grouped_parameters, self.rank, self.world_size, lr=args.learning_rate,
+                                 eps=args.adam_epsilon, max_grad_norm=args.max_grad_norm,
+                                 bucket_cap_mb=args.bucket_cap_mb)
+        logger.info("  Optimizer state and buffers on this rank = %.2f MB (%.2f MB of communication buffers)",
+                    optimizer.state_bytes() / 2**20, optimizer.comm.buffer_bytes() / 2**20)
+        return optimizer
+
+    def sync_gradients(self):
+        # The sharded optimizer reduce-scatters the gradients itself in step()
+        pass
+
+    def optimizer_step(self, optimizer, scheduler):
+        start = time.time()
+        optimizer.step()
+        self.comm_time += time.time() - start
+        scheduler.step()
+        self.comm_bytes += optimizer.comm.last_sent_bytes
+
+
+class DDPSync(SyncStrategy):
+    """torch DistributedDataParallel, which all-reduces gradient buckets during the backward pass.
+
+    The gradients are already averaged when backward returns, so no time is spent in `before_optimizer`;
+    the bytes counted are the gradient bytes (or compressed wire bytes) DDP all-reduces per step.
+    Gradient accumulation micro-steps run under `no_sync()`, so only the last one all-reduces.
+    """
+
+    name = 'ddp'
+    supports_compression = True
+    barrier_after_sync = False
+    communicates_in_backward = True
+
+    def __init__(self, args):
+        super(DDPSync, self).__init__(args)
+        if args.comm_hook == 'powersgd' and self.compressor is not None:
+            raise ValueError("--grad_compression cannot be combined with the powersgd communication hook")
+
+    def wrap_model(self, model):
+        args = self.args
+        # Wrap model with DistributedDataParallel for distributed training
+        model = torch.nn.parallel.DistributedDataParallel(
+            model,
+            device_ids=[args.local_rank] if torch.cuda.is_available() else None,
+            output_device=args.local_rank if torch.cuda.is_available() else None
+        )
+        logger.info(f"Model wrapped with DistributedDataParallel for rank {args.rank}")
+        return model
+
+    def micro_step_context(self, sync_step):
+        # DDP decides in forward whether backward all-reduces, so no_sync must cover both
+        if sync_step:
+            return contextlib.nullcontext()
+        return self.model.no_sync()
+
+    def setup(self, model, optimizer, t_total, no_decay):
+        super(DDPSync, self).setup(model, optimizer, t_total, no_decay)
+        args = self.args
+        if args.comm_hook == 'powersgd':
+            from torch.distributed.algorithms.ddp_comm_hooks import powerSGD_hook as powerSGD
+
+            # Replace DDP's dense all_reduce with rank-r PowerSGD compression of every gradient bucket
+            powersgd_state = powerSGD.PowerSGDState(
+                process_group=None,
+                matrix_approximation_rank=args.powersgd_rank,
+                start_powerSGD_iter=args.powersgd_start_iter,
+                use_error_feedback=not args.no_error_feedback,
+                warm_start=not args.no_powersgd_warm_start,
+                random_seed=args.seed,
+            )
+            model.register_comm_hook(powersgd_state, powerSGD.powerSGD_hook)
+            # The P/Q factors PowerSGD sends depend on the bucket shapes and switch in at start_powerSGD_iter,
+            # so the bytes are left unmeasured instead of counting the dense gradients
+            self.comm_bytes = None
+        elif self.compressor is not None:
+            # Let DDP send each gradient bucket in a low-precision wire format with error feedback
+            model.register_comm_hook(self.compressor, compressed_allreduce_hook)
+        elif args.log_comm:
+            from torch.distributed.algorithms.ddp_comm_hooks import default_hooks
+
+            # DDP's built-in all_reduce bypasses torch.distributed; the equivalent Python hook goes through it,
+            # so that --log_comm sees every gradient bucket
+            model.register_comm_hook(None, default_hooks.allreduce_hook)
+
+    def sync_gradients(self):
+        if self.comm_bytes is None:
+            return
+        if self.compressor is None:
+            self.comm_bytes += _tensor_bytes(_grads(self.model))
+        else:
+            self.comm_bytes = self.compressor.wire_bytes
+
+
+# Registry of the strategies selectable with --sync_strategy
+SYNC_STRATEGIES = {
+    'none': NoSync,
+    'gather_scatter': GatherScatterSync,
+    'reduce_scatter': ReduceScatterSync,
+    'allreduce': AllreduceSync,
+    'bucketed': BucketedAllreduceSync,
+    'overlap': OverlapSync,
+    'topk': TopKSync,
+    'hierarchical': HierarchicalSync,
+    'local_sgd': LocalSGDSync,
+    'param_server': ParameterServerSync,
+    'zero1': Zero1Sync,
+    'ddp': DDPSync,
+}